@@ -0,0 +1,129 @@
+"""Cold storage for past events.
+
+Old events are moved out of the hot events file into gzipped,
+date-partitioned segment files under `<base_data_path>/archive`. A
+segment is named after the period it covers, either a year
+(`events-2020.json.gz`) or a month (`events-2020-11.json.gz`).
+"""
+
+import os
+import re
+import gzip
+import json
+import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from models import CalendarEntry
+import encoding
+from files import write_events
+import constants
+import utils
+
+SEGMENT_RE = re.compile(r"events-(\d{4}(?:-\d{2})?)\.json\.gz\Z")
+
+YEARLY = "year"
+MONTHLY = "month"
+
+
+def archive_path(base_data_path) -> str:
+    return os.path.join(base_data_path, constants.ARCHIVE_DIRNAME)
+
+
+def segment_filename(base_data_path, key) -> str:
+    return os.path.join(archive_path(base_data_path), f"events-{key}.json.gz")
+
+
+def list_segments(base_data_path) -> List[str]:
+    """Return sorted keys of all existing segments."""
+    path = archive_path(base_data_path)
+    if not os.path.exists(path):
+        return list()
+    keys = list()
+    for name in os.listdir(path):
+        m = SEGMENT_RE.match(name)
+        if m:
+            keys.append(m.group(1))
+    return sorted(keys)
+
+
+def read_segment(base_data_path, key) -> List[CalendarEntry]:
+    path = segment_filename(base_data_path, key)
+    if not os.path.exists(path):
+        return list()
+    with gzip.open(path, "rt") as f:
+        return [CalendarEntry.parse_obj(d) for d in json.load(f)]
+
+
+def write_segment(base_data_path, key, events: Sequence[CalendarEntry]) -> None:
+    path = segment_filename(base_data_path, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wb") as f:
+        encoding.write_events_json(f, sorted(events, key=lambda e: e.dt))
+    os.replace(tmp_path, path)
+
+
+def overlaps(key, start=None, end=None) -> bool:
+    """Return True if segment `key` may hold events in [start, end)."""
+    seg_start, seg_end = utils.period_range(key)
+    if start and seg_end <= start:
+        return False
+    if end and seg_start >= end:
+        return False
+    return True
+
+
+def read_archived_events(
+    base_data_path,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> List[CalendarEntry]:
+    """Return archived events in [start, end), sorted by dt.
+
+    Only segments overlapping the requested range are opened.
+    """
+    events = list()
+    for key in list_segments(base_data_path):
+        if not overlaps(key, start, end):
+            continue
+        for e in read_segment(base_data_path, key):
+            if start and e.dt < start:
+                continue
+            if end and e.dt >= end:
+                continue
+            events.append(e)
+    return sorted(events, key=lambda e: e.dt)
+
+
+def archive_events(
+    events_data_path,
+    base_data_path,
+    events: Sequence[CalendarEntry],
+    before: datetime.datetime,
+    period=YEARLY,
+) -> Tuple[List[CalendarEntry], int]:
+    """Move events starting before `before` into cold segments.
+
+    Returns the remaining hot events and the number of archived events.
+    Segments are written before the hot file so an interrupted run
+    never loses events; re-running is idempotent because segment
+    contents are keyed by uid.
+    """
+    hot = list()
+    cold: Dict[str, List[CalendarEntry]] = dict()
+    for e in events:
+        if e.dt < before:
+            cold.setdefault(utils.period_key(e.dt, period == MONTHLY), list()).append(e)
+        else:
+            hot.append(e)
+    if not cold:
+        return list(events), 0
+
+    for key, new_events in cold.items():
+        by_uid = {e.uid: e for e in read_segment(base_data_path, key)}
+        by_uid.update({e.uid: e for e in new_events})
+        write_segment(base_data_path, key, list(by_uid.values()))
+
+    # archiving every event is deliberate, not an accidental wipe
+    write_events(events_data_path, hot, allow_empty=True)
+    return hot, sum(len(v) for v in cold.values())
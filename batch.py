@@ -0,0 +1,203 @@
+"""Apply many create, update and delete operations with a single write.
+
+Operations are JSON objects, one per line:
+
+    {"op": "create", "summary": "Standup", "dt": "2026-10-20 09:30",
+     "timezone": "london", "duration": 900, "remind": ["5m"]}
+    {"op": "update", "uid": "...", "summary": "Standup (moved)", "dt": "..."}
+    {"op": "delete", "uid": "..."}
+
+Events can also be selected by "external_id". Durations are seconds,
+as in the events file. Each operation is applied to the in-memory
+index; the events file, search index, reminder timeline and snapshot
+are written once at the end.
+"""
+
+import json
+import datetime
+from collections import namedtuple
+from typing import Callable, Dict, Iterable, List, Optional
+
+from files import file_signature, write_events
+from index import EventIndex
+from models import CalendarEntry, Repeats
+import publish
+import reminders
+import search
+import snapshot
+
+OPERATIONS = ("create", "update", "delete")
+
+Result = namedtuple("Result", "line op uid error")
+
+
+class InvalidOperation(Exception):
+    pass
+
+
+class Changes:
+    """Events to write and indexes to update when committing."""
+
+    def __init__(self):
+        self.updated: Dict[str, CalendarEntry] = dict()
+        self.removed_uids: List[str] = list()
+        self.changed: List[datetime.datetime] = list()
+
+    def update(self, event: CalendarEntry, old_dt=None) -> None:
+        self.updated[event.uid] = event
+        self.changed.extend(dt for dt in (old_dt, event.dt) if dt)
+
+    def remove(self, event: CalendarEntry) -> None:
+        self.updated.pop(event.uid, None)
+        self.removed_uids.append(event.uid)
+        self.changed.append(event.dt)
+
+    def __bool__(self):
+        return bool(self.changed)
+
+
+def parse_operations(lines: Iterable[str]):
+    """Yield (line number, operation or exception) for non-blank lines."""
+    for n, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            op = json.loads(line)
+        except ValueError as e:
+            yield n, InvalidOperation(f"invalid json: {e}")
+            continue
+        if not isinstance(op, dict) or op.get("op") not in OPERATIONS:
+            yield n, InvalidOperation(f"op must be one of {', '.join(OPERATIONS)}")
+            continue
+        yield n, op
+
+
+def find_event(index: EventIndex, op) -> CalendarEntry:
+    event = None
+    if op.get("uid"):
+        event = index.get(op["uid"])
+    elif op.get("external_id"):
+        event = index.get_external(op["external_id"])
+    else:
+        raise InvalidOperation("uid or external_id required")
+    if event is None:
+        raise InvalidOperation(f"event not found: {op.get('uid') or op['external_id']}")
+    return event
+
+
+def parse_repeats(value) -> Repeats:
+    try:
+        if isinstance(value, int):
+            return Repeats(value)
+        return Repeats[str(value).upper()]
+    except (KeyError, ValueError):
+        raise InvalidOperation(f"invalid repeats: {value}")
+
+
+def apply_fields(event: CalendarEntry, op) -> None:
+    """Set the optional fields given in `op` on `event`."""
+    if "summary" in op:
+        event.summary = str(op["summary"])
+    if "description" in op:
+        event.description = op["description"]
+    if "duration" in op:
+        event.duration = datetime.timedelta(seconds=float(op["duration"]))
+    if "repeats" in op:
+        event.repeats = parse_repeats(op["repeats"])
+    if "remind" in op:
+        try:
+            event.reminders = [reminders.parse_reminder(r) for r in op["remind"]]
+        except ValueError as e:
+            raise InvalidOperation(str(e))
+
+
+def apply_operation(
+    index: EventIndex,
+    op,
+    make_event: Callable[..., CalendarEntry],
+    changes: Changes,
+    now: datetime.datetime,
+) -> str:
+    """Apply one operation to the index and return the affected uid.
+
+    `make_event(summary, dt_str, timezone)` creates events and parses
+    dates in the same way as the create command.
+    """
+    if op["op"] == "create":
+        if not op.get("summary") or not op.get("dt"):
+            raise InvalidOperation("summary and dt required")
+        event = make_event(op["summary"], str(op["dt"]), op.get("timezone"))
+        event.external_id = op.get("external_id")
+        event.source = op.get("source")
+        apply_fields(event, op)
+        index.add(event)
+        changes.update(event)
+        return event.uid
+
+    event = find_event(index, op)
+    if op["op"] == "delete":
+        index.remove(event.uid)
+        changes.remove(event)
+        return event.uid
+
+    # update a copy so a failing operation leaves the event untouched
+    updated = event.copy()
+    if "dt" in op or "timezone" in op:
+        moved = make_event(
+            updated.summary,
+            str(op.get("dt") or updated.dt.isoformat()),
+            op.get("timezone") or updated.timezone,
+        )
+        updated.dt = moved.dt
+        updated.timezone = moved.timezone
+    apply_fields(updated, op)
+    updated.updated = now
+    index.add(updated)
+    changes.update(updated, old_dt=event.dt)
+    return updated.uid
+
+
+def apply_operations(
+    index: EventIndex,
+    operations,
+    make_event: Callable[..., CalendarEntry],
+    now: Optional[datetime.datetime] = None,
+):
+    """Apply (line, operation) pairs; return results and the changes to commit."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    changes = Changes()
+    results = list()
+    for n, op in operations:
+        if isinstance(op, Exception):
+            results.append(Result(n, None, None, str(op)))
+            continue
+        try:
+            uid = apply_operation(index, op, make_event, changes, now)
+        except Exception as e:
+            results.append(Result(n, op["op"], op.get("uid"), str(e) or repr(e)))
+            continue
+        results.append(Result(n, op["op"], uid, None))
+    return results, changes
+
+
+def commit(events_data_path, index: EventIndex, changes: Changes) -> None:
+    """Write the events once and bring the persisted indexes up to date."""
+    if not changes:
+        return
+    updated = list(changes.updated.values())
+    signature = file_signature(events_data_path)
+    write_events(
+        events_data_path, index.events, allow_empty=True, changed=changes.changed
+    )
+    search.update_index(events_data_path, signature, updated, changes.removed_uids)
+    reminders.update_timeline(
+        events_data_path, signature, updated, changes.removed_uids
+    )
+    publish.update_fragments(events_data_path, signature, updated, changes.removed_uids)
+    snapshot.write_snapshot(events_data_path, index)
+
+
+def result_json(result: Result) -> str:
+    r = {"line": result.line, "op": result.op, "uid": result.uid}
+    r.update({"ok": False, "error": result.error} if result.error else {"ok": True})
+    return json.dumps(r)
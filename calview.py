@@ -0,0 +1,89 @@
+"""Month calendars overlaid with the number of events per day."""
+
+import calendar
+import datetime
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import click
+
+from constants import CURRENT_TZ
+from models import CalendarEntry
+from timezones import convert_many
+
+CELL_WIDTH = 5
+MONTHS_PER_ROW = 2
+
+
+def add_months(year, month, n):
+    month += n
+    return year + (month - 1) // 12, (month - 1) % 12 + 1
+
+
+def month_span(year, month, months):
+    """Return local start of the first and end of the last month."""
+    end_year, end_month = add_months(year, month, months)
+    return (
+        datetime.datetime(year, month, 1, tzinfo=CURRENT_TZ),
+        datetime.datetime(end_year, end_month, 1, tzinfo=CURRENT_TZ),
+    )
+
+
+def day_histogram(events: Iterable[CalendarEntry]) -> Dict[datetime.date, int]:
+    """Count events per local date in one pass."""
+    times = convert_many((e.dt for e in events), CURRENT_TZ)
+    return Counter(dt.date() for dt in times)
+
+
+def format_cell(day: datetime.date, counts, today) -> str:
+    count = counts.get(day, 0)
+    text = f"{day.day:>2}"
+    if count:
+        text += f"·{count}" if count < 10 else "·+"
+    text = text.ljust(CELL_WIDTH)
+    if day == today:
+        return click.style(text, reverse=True)
+    if count:
+        return click.style(text, fg="green")
+    return text
+
+
+def format_month(
+    year, month, counts: Dict[datetime.date, int], today=None
+) -> List[str]:
+    """Return the lines of one month, each CELL_WIDTH * 7 characters wide."""
+    width = CELL_WIDTH * 7
+    lines = [
+        f"{calendar.month_name[month]} {year}".center(width),
+        "".join(calendar.day_abbr[i][:2].ljust(CELL_WIDTH) for i in range(7)),
+    ]
+    for week in calendar.Calendar().monthdatescalendar(year, month):
+        lines.append(
+            "".join(
+                (
+                    format_cell(day, counts, today)
+                    if day.month == month
+                    else " " * CELL_WIDTH
+                )
+                for day in week
+            )
+        )
+    # pad to six weeks so months line up side by side
+    while len(lines) < 8:
+        lines.append(" " * width)
+    return lines
+
+
+def format_months(
+    year, month, months, counts, today: Optional[datetime.date] = None
+) -> List[str]:
+    """Return lines showing `months` months from year/month, side by side."""
+    blocks = [
+        format_month(*add_months(year, month, i), counts, today) for i in range(months)
+    ]
+    lines = list()
+    for i in range(0, len(blocks), MONTHS_PER_ROW):
+        row = blocks[i : i + MONTHS_PER_ROW]
+        lines.extend("  ".join(parts).rstrip() for parts in zip(*row))
+        lines.append("")
+    return lines
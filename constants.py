@@ -1,9 +1,32 @@
 import datetime
 
+import timezones
+
 SETTINGS_FILENAME = "settings.json"
 EVENTS_FILENAME = "events.json"
 
+# prefer the named local zone, it follows DST; fall back to the current offset
 CURRENT_TZ = (
-    datetime.datetime.now(datetime.timezone(datetime.timedelta(0))).astimezone().tzinfo
+    timezones.local_timezone()
+    or datetime.datetime.now(datetime.timezone(datetime.timedelta(0)))
+    .astimezone()
+    .tzinfo
+)
+DEFAULT_TZ_NAME = (
+    CURRENT_TZ.name
+    if isinstance(CURRENT_TZ, timezones.TableTimezone)
+    else CURRENT_TZ.tzname(datetime.datetime.now())  # type: ignore
 )
-DEFAULT_TZ_NAME = CURRENT_TZ.tzname(datetime.datetime.now())  # type: ignore
+ARCHIVE_DIRNAME = "archive"
+SEARCH_INDEX_FILENAME = "search_index.json"
+REMINDERS_FILENAME = "reminders.json"
+SNAPSHOT_FILENAME = "events.snapshot.pickle"
+EVENTS_RECORDS_FILENAME = "events.rec"
+EVENTS_SHARDS_DIRNAME = "events.d"
+MANIFEST_FILENAME = "manifest.json"
+SYNC_BASE_FILENAME = "events.base.json"
+SYNC_BASE_SHARDS_DIRNAME = "events.base.d"
+SYNC_STATE_FILENAME = "sync.json"
+FEEDS_DIRNAME = "feeds"
+FEEDS_FILENAME = "feeds.json"
+PUBLISH_FRAGMENTS_FILENAME = "publish_fragments.json"
@@ -0,0 +1,178 @@
+"""Event digests for one or more windows, sent over several channels.
+
+Settings:
+
+    DIGEST_WINDOWS: window names, default ["today"]
+    DIGEST_CHANNELS: any of "email", "slack", "sms", default ["email"]
+    DIGEST_RECIPIENTS: list of {"user", "email", "mobile", "slack_channel"};
+        defaults to MY_EMAIL_ADDRESS/MY_MOBILE receiving everyone's events
+"""
+
+import html
+import datetime
+from collections import namedtuple
+from string import Template
+from typing import Dict, List, Optional, Sequence
+
+from constants import CURRENT_TZ
+from index import EventIndex
+from models import CalendarEntry
+from services import mailgun, slack, twilio
+from services.scheduler import get_scheduler
+import utils
+
+# name: (title, days from today to window start, window length in days)
+WINDOWS = {
+    "today": ("Today", 0, 1),
+    "tomorrow": ("Tomorrow", 1, 1),
+    "week": ("Week ahead", 1, 7),
+}
+
+DEFAULT_WINDOWS = ["today"]
+DEFAULT_CHANNELS = ["email"]
+DEFAULT_SLACK_CHANNEL = "#random"
+
+HTML_TEMPLATE = Template("<html><body>\n$sections</body></html>\n")
+HTML_SECTION_TEMPLATE = Template("<h3>$title</h3>\n<ul>\n$items</ul>\n")
+HTML_ITEM_TEMPLATE = Template("<li>$time $summary</li>\n")
+
+Window = namedtuple("Window", "name title start end")
+Batch = namedtuple("Batch", "user emails mobiles slack_channels")
+Rendered = namedtuple("Rendered", "text html")
+Dispatch = namedtuple("Dispatch", "user channel target result")
+
+
+def get_windows(names: Sequence[str], today: datetime.datetime) -> List[Window]:
+    windows = list()
+    for name in names:
+        title, offset, length = WINDOWS[name]
+        start = today + datetime.timedelta(days=offset)
+        windows.append(Window(name, title, start, start + datetime.timedelta(length)))
+    return windows
+
+
+def compute_digests(
+    index: EventIndex, windows: Sequence[Window]
+) -> Dict[Optional[str], Dict[str, List[CalendarEntry]]]:
+    """Bucket events by user and window in a single pass.
+
+    The None user holds every user's events.
+    """
+    digests: Dict[Optional[str], Dict[str, List[CalendarEntry]]] = dict()
+    if not windows:
+        return digests
+    span_start = min(w.start for w in windows)
+    span_end = max(w.end for w in windows)
+    for e in index.between(span_start, span_end):
+        for w in windows:
+            if w.start <= e.dt < w.end:
+                for user in (None, e.user):
+                    digests.setdefault(user, dict()).setdefault(w.name, list()).append(
+                        e
+                    )
+    return digests
+
+
+def get_batches(context) -> List[Batch]:
+    """Group recipients by user so each user's digest is rendered once."""
+    recipients = context.get("DIGEST_RECIPIENTS") or [
+        {
+            "user": None,
+            "email": context.get("MY_EMAIL_ADDRESS"),
+            "mobile": context.get("MY_MOBILE"),
+            "slack_channel": context.get("SLACK_CHANNEL", DEFAULT_SLACK_CHANNEL),
+        }
+    ]
+    batches: Dict[Optional[str], Batch] = dict()
+    for r in recipients:
+        user = r.get("user")
+        batch = batches.setdefault(user, Batch(user, list(), list(), list()))
+        for key, targets in (
+            ("email", batch.emails),
+            ("mobile", batch.mobiles),
+            ("slack_channel", batch.slack_channels),
+        ):
+            if r.get(key) and r[key] not in targets:
+                targets.append(r[key])
+    return list(batches.values())
+
+
+def format_time(e: CalendarEntry, with_date=False) -> str:
+    dt = e.dt.astimezone(CURRENT_TZ)
+    return dt.strftime("%a %d %b %H:%M") if with_date else dt.strftime("%H:%M")
+
+
+def render(windows: Sequence[Window], digest: Dict[str, List[CalendarEntry]]):
+    """Render text and html bodies for one user's digest."""
+    text_parts = list()
+    html_sections = list()
+    for w in windows:
+        events = digest.get(w.name, ())
+        with_date = (w.end - w.start) > datetime.timedelta(days=1)
+        lines = [(format_time(e, with_date), e.summary) for e in events]
+        text_parts.append(w.title)
+        text_parts.extend(f"{t} {summary}" for t, summary in lines)
+        if not lines:
+            text_parts.append("No events")
+        text_parts.append("")
+        items = "".join(
+            HTML_ITEM_TEMPLATE.substitute(time=t, summary=html.escape(summary))
+            for t, summary in lines
+        )
+        html_sections.append(
+            HTML_SECTION_TEMPLATE.substitute(
+                title=html.escape(w.title), items=items or "<li>No events</li>\n"
+            )
+        )
+    return Rendered(
+        "\n".join(text_parts), HTML_TEMPLATE.substitute(sections="".join(html_sections))
+    )
+
+
+def send_digests(
+    context, index: EventIndex, subject="Today's events", scheduler=None
+) -> List[Dispatch]:
+    """Compute, render and send digests to all recipients over all channels.
+
+    Requests go through the rate limited scheduler, channels in
+    parallel; exceptions are returned as results.
+    """
+    windows = get_windows(
+        context.get("DIGEST_WINDOWS") or DEFAULT_WINDOWS, utils.dt_today()
+    )
+    channels = context.get("DIGEST_CHANNELS") or DEFAULT_CHANNELS
+    digests = compute_digests(index, windows)
+    scheduler = scheduler or get_scheduler(context)
+
+    dispatches = list()
+    for batch in get_batches(context):
+        rendered = render(windows, digests.get(batch.user, dict()))
+        if "email" in channels and batch.emails:
+            scheduler.submit(
+                "mailgun",
+                mailgun.send_email,
+                context,
+                batch.emails,
+                subject,
+                rendered.text,
+                html=rendered.html,
+            )
+            dispatches.append((batch.user, "email", batch.emails))
+        if "slack" in channels:
+            for channel in batch.slack_channels:
+                scheduler.submit(
+                    "slack",
+                    slack.post_message,
+                    context,
+                    channel,
+                    f"{subject}\n{rendered.text}",
+                )
+                dispatches.append((batch.user, "slack", channel))
+        if "sms" in channels:
+            for mobile in batch.mobiles:
+                scheduler.submit(
+                    "twilio", twilio.send_sms, context, rendered.text, to=mobile
+                )
+                dispatches.append((batch.user, "sms", mobile))
+
+    return [Dispatch(*d, r) for d, r in zip(dispatches, scheduler.run())]
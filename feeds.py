@@ -0,0 +1,385 @@
+"""Read-only subscriptions to iCalendar (.ics) feeds.
+
+Feeds are urls or local paths. Each one is fetched conditionally:
+with If-None-Match/If-Modified-Since for urls, by comparing mtime and
+size for paths. A changed feed is parsed line by line as it is read
+and its events are cached as pickled CalendarEntry records with
+`source` set to the feed, so an unchanged feed costs no parsing.
+
+Feed events are shown alongside the user's events but never written
+to the events file. Views refresh feeds older than FEED_REFRESH_MINUTES
+(default 60).
+
+Settings:
+
+    FEED_REFRESH_MINUTES: minutes before views fetch a feed again
+"""
+
+import os
+import sys
+import json
+import uuid
+import pickle
+import getpass
+import hashlib
+import datetime
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pytz
+import requests
+
+from models import CalendarEntry, Repeats
+import constants
+
+UTC = datetime.timezone.utc
+DEFAULT_REFRESH_MINUTES = 60
+FETCH_TIMEOUT = 30
+
+FREQUENCIES = {
+    "HOURLY": Repeats.HOURLY,
+    "DAILY": Repeats.DAILY,
+    "WEEKLY": Repeats.WEEKLY,
+    "MONTHLY": Repeats.MONTHLY,
+    "YEARLY": Repeats.YEARLY,
+}
+
+Fetched = namedtuple("Fetched", "changed lines state")
+
+
+def feeds_dir(base_data_path) -> str:
+    return os.path.join(base_data_path, constants.FEEDS_DIRNAME)
+
+
+def registry_path(base_data_path) -> str:
+    return os.path.join(feeds_dir(base_data_path), constants.FEEDS_FILENAME)
+
+
+def cache_path(base_data_path, feed) -> str:
+    name = hashlib.sha1(feed.encode()).hexdigest()
+    return os.path.join(feeds_dir(base_data_path), f"{name}.pickle")
+
+
+def is_url(feed) -> bool:
+    return feed.startswith(("http://", "https://"))
+
+
+def normalize(feed) -> str:
+    """Return urls unchanged and paths as absolute paths."""
+    if feed.startswith("file://"):
+        feed = feed[len("file://") :]
+    return feed if is_url(feed) else os.path.abspath(os.path.expanduser(feed))
+
+
+def read_registry(base_data_path) -> Dict[str, Dict]:
+    """Return feed: state for all subscribed feeds."""
+    path = registry_path(base_data_path)
+    if not os.path.exists(path):
+        return dict()
+    with open(path) as f:
+        return json.load(f)["feeds"]
+
+
+def write_registry(base_data_path, registry) -> None:
+    path = registry_path(base_data_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wt") as f:
+        json.dump({"feeds": registry}, f)
+    os.replace(tmp_path, path)
+
+
+def unfold(lines: Iterable[str]) -> Iterator[str]:
+    """Join continuation lines, which start with a space or tab."""
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def split_property(line) -> Tuple[str, Dict[str, str], str]:
+    """Return name, parameters and value of a content line."""
+    # the value starts at the first colon outside quoted parameter values
+    quoted = False
+    for i, c in enumerate(line):
+        if c == '"':
+            quoted = not quoted
+        elif c == ":" and not quoted:
+            break
+    else:
+        return line.upper(), dict(), ""
+    name, *params = line[:i].split(";")
+    parameters = dict()
+    for p in params:
+        key, _, value = p.partition("=")
+        parameters[key.upper()] = value.strip('"')
+    return name.upper(), parameters, line[i + 1 :]
+
+
+def unescape(text) -> str:
+    result = list()
+    chars = iter(text)
+    for c in chars:
+        if c == "\\":
+            c = next(chars, "")
+            c = "\n" if c in "nN" else c
+        result.append(c)
+    return "".join(result)
+
+
+def zone_name(tzid, default_tz) -> str:
+    return tzid if tzid in pytz.all_timezones_set else default_tz
+
+
+def parse_dt(value, params, default_tz) -> Tuple[datetime.datetime, str, bool]:
+    """Return (aware datetime, timezone name, all day) of a DTSTART like value."""
+    tz_name = zone_name(params.get("TZID"), default_tz)
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        dt = datetime.datetime.strptime(value[:8], "%Y%m%d")
+        return pytz.timezone(tz_name).localize(dt), tz_name, True
+    dt = datetime.datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return dt.replace(tzinfo=UTC), "UTC", False
+    return pytz.timezone(tz_name).localize(dt), tz_name, False
+
+
+def parse_duration(value) -> datetime.timedelta:
+    """Return a timedelta for an iCalendar duration like -P1DT2H30M."""
+    sign = -1 if value.startswith("-") else 1
+    value = value.lstrip("+-").lstrip("P")
+    seconds = 0
+    number = ""
+    in_time = False
+    for c in value:
+        if c.isdigit():
+            number += c
+        elif c == "T":
+            in_time = True
+        else:
+            n = int(number or 0)
+            number = ""
+            if c == "W":
+                seconds += n * 7 * 86400
+            elif c == "D":
+                seconds += n * 86400
+            elif c == "H":
+                seconds += n * 3600
+            elif c == "M" and in_time:
+                seconds += n * 60
+            elif c == "S":
+                seconds += n
+    return datetime.timedelta(seconds=sign * seconds)
+
+
+def parse_repeats(rrule) -> Repeats:
+    """Return the repeat of simple rules; others are shown once."""
+    parts = dict(p.partition("=")[::2] for p in rrule.upper().split(";"))
+    if parts.get("INTERVAL", "1") != "1" or "COUNT" in parts or "UNTIL" in parts:
+        return Repeats.UNIQUE
+    return FREQUENCIES.get(parts.get("FREQ"), Repeats.UNIQUE)
+
+
+def make_entry(props: Dict, feed, default_tz, now, user) -> Optional[CalendarEntry]:
+    """Return the CalendarEntry for the properties of one VEVENT."""
+    if "DTSTART" not in props:
+        return None
+    params, value = props["DTSTART"]
+    dt, tz_name, all_day = parse_dt(value, params, default_tz)
+    if "DTEND" in props:
+        end = parse_dt(props["DTEND"][1], props["DTEND"][0], default_tz)[0]
+        duration = end - dt
+    elif "DURATION" in props:
+        duration = parse_duration(props["DURATION"][1])
+    else:
+        duration = datetime.timedelta(days=1 if all_day else 0)
+    ics_uid = props.get("UID", (None, None))[1] or f"{value}-{props.get('SUMMARY')}"
+    stamp = props.get("LAST-MODIFIED") or props.get("DTSTAMP")
+    updated = parse_dt(stamp[1], stamp[0], "UTC")[0] if stamp else now
+    description = props.get("DESCRIPTION")
+    return CalendarEntry(
+        uid=str(uuid.uuid5(uuid.NAMESPACE_URL, f"{feed}#{ics_uid}")),
+        user=user,
+        dt=dt,
+        created=updated,
+        updated=updated,
+        summary=unescape(props.get("SUMMARY", ({}, ""))[1]),
+        description=unescape(description[1]) if description else None,
+        duration=duration,
+        timezone=tz_name,
+        repeats=(
+            parse_repeats(props["RRULE"][1]) if "RRULE" in props else Repeats.UNIQUE
+        ),
+        external_id=ics_uid,
+        source=feed,
+        data=None,
+        reminders=None,
+    )
+
+
+def parse_ics(lines: Iterable[str], feed, default_tz=None) -> Iterator[CalendarEntry]:
+    """Yield events of an iCalendar stream without reading all of it first.
+
+    Cancelled and unparseable events are skipped.
+    """
+    default_tz = default_tz or constants.DEFAULT_TZ_NAME
+    now = datetime.datetime.now(UTC)
+    user = getpass.getuser()
+    props = None
+    depth = 0  # nested components like VALARM inside the event
+    for line in unfold(lines):
+        name, params, value = split_property(line)
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            props = dict()
+        elif props is None:
+            continue
+        elif name == "BEGIN":
+            depth += 1
+        elif name == "END" and depth:
+            depth -= 1
+        elif name == "END" and value.upper() == "VEVENT":
+            if props.get("STATUS", (None, ""))[1].upper() != "CANCELLED":
+                try:
+                    entry = make_entry(props, feed, default_tz, now, user)
+                except ValueError:
+                    entry = None
+                if entry:
+                    yield entry
+            props = None
+        elif not depth and name not in props:
+            props[name] = (params, value)
+
+
+def fetch(feed, state: Dict) -> Fetched:
+    """Fetch a feed unless it is unchanged since `state`.
+
+    Returns whether it changed, the lines to parse and the new state.
+    The caller must consume `lines` to finish the download.
+    """
+    state = dict(state)
+    if not is_url(feed):
+        st = os.stat(feed)
+        signature = [st.st_mtime_ns, st.st_size]
+        if signature == state.get("signature"):
+            return Fetched(False, iter(()), state)
+        state["signature"] = signature
+
+        def read_file():
+            with open(feed, encoding="utf-8", errors="replace") as f:
+                yield from f
+
+        return Fetched(True, read_file(), state)
+
+    headers = dict()
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    r = requests.get(feed, headers=headers, stream=True, timeout=FETCH_TIMEOUT)
+    if r.status_code == 304:
+        r.close()
+        return Fetched(False, iter(()), state)
+    r.raise_for_status()
+    state["etag"] = r.headers.get("ETag")
+    state["last_modified"] = r.headers.get("Last-Modified")
+    r.encoding = r.encoding or "utf-8"
+    return Fetched(True, r.iter_lines(decode_unicode=True), state)
+
+
+def read_cache(base_data_path, feed) -> List[CalendarEntry]:
+    path = cache_path(base_data_path, feed)
+    if not os.path.exists(path):
+        return list()
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def write_cache(base_data_path, feed, events: List[CalendarEntry]) -> None:
+    path = cache_path(base_data_path, feed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(events, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def refresh(base_data_path, feed, state: Dict, now=None) -> Tuple[bool, Dict]:
+    """Fetch and re-parse one feed if it changed; return (changed, state)."""
+    now = now or datetime.datetime.now(UTC)
+    fetched = fetch(feed, state)
+    state = fetched.state
+    if fetched.changed:
+        events = sorted(parse_ics(fetched.lines, feed), key=lambda e: e.dt)
+        write_cache(base_data_path, feed, events)
+        state["count"] = len(events)
+    state["checked"] = now.timestamp()
+    return fetched.changed, state
+
+
+def subscribe(base_data_path, feed) -> Tuple[str, Dict]:
+    """Add a feed and fetch it; return the normalized feed and its state."""
+    feed = normalize(feed)
+    registry = read_registry(base_data_path)
+    _, registry[feed] = refresh(base_data_path, feed, registry.get(feed, dict()))
+    write_registry(base_data_path, registry)
+    return feed, registry[feed]
+
+
+def unsubscribe(base_data_path, feed) -> bool:
+    feed = normalize(feed)
+    registry = read_registry(base_data_path)
+    if registry.pop(feed, None) is None:
+        return False
+    write_registry(base_data_path, registry)
+    path = cache_path(base_data_path, feed)
+    if os.path.exists(path):
+        os.remove(path)
+    return True
+
+
+def refresh_all(base_data_path, max_age=None, now=None) -> Dict[str, bool]:
+    """Refresh feeds last checked more than `max_age` ago, or all.
+
+    Feeds that cannot be fetched keep their cached events.
+    """
+    now = now or datetime.datetime.now(UTC)
+    registry = read_registry(base_data_path)
+    changed = dict()
+    for feed, state in registry.items():
+        age = now.timestamp() - state.get("checked", 0)
+        if max_age is not None and age < max_age.total_seconds():
+            continue
+        try:
+            changed[feed], registry[feed] = refresh(base_data_path, feed, state, now)
+        except (OSError, requests.RequestException) as e:
+            print(f"Could not refresh {feed}: {e}", file=sys.stderr)
+    if changed:
+        write_registry(base_data_path, registry)
+    return changed
+
+
+def feed_events(
+    context,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> List[CalendarEntry]:
+    """Return cached events of all feeds starting in [start, end)."""
+    base_data_path = context["base_data_path"]
+    if not os.path.exists(registry_path(base_data_path)):
+        return list()
+    minutes = context.get("FEED_REFRESH_MINUTES", DEFAULT_REFRESH_MINUTES)
+    refresh_all(base_data_path, datetime.timedelta(minutes=minutes))
+    events = list()
+    for feed in read_registry(base_data_path):
+        events.extend(
+            e
+            for e in read_cache(base_data_path, feed)
+            if (not start or e.dt >= start) and (not end or e.dt < end)
+        )
+    return events
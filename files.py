@@ -1,31 +1,97 @@
 import os
 import json
-from typing import List, Sequence
+import datetime
+from typing import List, Optional, Sequence
 
 
 from models import CalendarEntry
+import encoding
+import records
+import shards
 
 
-def read_events(events_data_path) -> List[CalendarEntry]:
+def parse_events(s) -> List[CalendarEntry]:
+    if not s:
+        return list()
+    return [CalendarEntry.parse_obj(d) for d in json.loads(s)]
+
+
+def read_events(
+    events_data_path,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> List[CalendarEntry]:
+    """Return events, optionally only those starting in [start, end).
+
+    Record files decode only the requested range, sharded stores read
+    only the shards covering it.
+    """
+    if records.is_records_path(events_data_path):
+        return records.read_records(events_data_path, start, end)
+    if shards.is_shards_path(events_data_path):
+        return shards.read_shards(events_data_path, start, end)
     if not os.path.exists(events_data_path):
         return list()
     with open(events_data_path) as f:
-        s = f.read()
-        if not s:
-            return list()
-        data = json.loads(s)
-        return [CalendarEntry.parse_obj(d) for d in data]
+        events = parse_events(f.read())
+    if start or end:
+        events = [
+            e
+            for e in events
+            if (not start or e.dt >= start) and (not end or e.dt < end)
+        ]
+    return events
+
+
+def supports_range_reads(events_data_path) -> bool:
+    """Return True if the layout can read a date range without reading all."""
+    return records.is_records_path(events_data_path) or shards.is_shards_path(
+        events_data_path
+    )
+
+
+def content_path(events_data_path) -> str:
+    """Return the file whose content identifies the content of the events."""
+    if shards.is_shards_path(events_data_path):
+        return shards.manifest_path(events_data_path)
+    return events_data_path
+
+
+def file_signature(path) -> Optional[List[int]]:
+    """Return a cheap signature of a file to detect changes, or None."""
+    path = content_path(path)
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
 
+def write_events(
+    events_data_path,
+    event_data: Sequence[CalendarEntry],
+    allow_empty=False,
+    changed: Optional[Sequence[datetime.datetime]] = None,
+) -> None:
+    """Write all events.
 
-def write_events(events_data_path, event_data: Sequence[CalendarEntry]) -> None:
+    `changed` optionally holds the old and new datetimes of changed
+    events; sharded stores then only rewrite those months.
+    """
     # we only accept writing when we have at least one event to write
-    assert event_data
+    assert event_data or allow_empty
     # only write to existing path
     assert events_data_path
+    if shards.is_shards_path(events_data_path):
+        shards.write_shards(events_data_path, event_data, changed)
+        return
 
     base_data_path = os.path.split(events_data_path)[0]
     if not os.path.exists(base_data_path):
         os.makedirs(base_data_path)
-    events = [json.loads(e.json()) for e in event_data]
-    with open(events_data_path, "wt") as f:
-        f.write(json.dumps(events))
+    if records.is_records_path(events_data_path):
+        records.write_records(events_data_path, event_data)
+        return
+    tmp_path = f"{events_data_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        encoding.write_events_json(f, event_data)
+    os.replace(tmp_path, events_data_path)
@@ -0,0 +1,70 @@
+import bisect
+import itertools
+import datetime
+from typing import Dict, Iterable, List, Optional
+
+from models import CalendarEntry
+
+
+class EventIndex:
+    """Lookup structures over a list of events.
+
+    Events are kept sorted by start time so range queries are a binary
+    search plus a slice; uid and external_id lookups are dict lookups.
+    """
+
+    def __init__(self, events: Iterable[CalendarEntry] = ()):
+        self.events: List[CalendarEntry] = sorted(events, key=lambda e: e.dt)
+        self.starts: List[datetime.datetime] = [e.dt for e in self.events]
+        self.by_uid: Dict[str, CalendarEntry] = {e.uid: e for e in self.events}
+        self.by_external_id: Dict[str, CalendarEntry] = {
+            e.external_id: e for e in self.events if e.external_id
+        }
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def between(
+        self,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+    ) -> List[CalendarEntry]:
+        """Return events starting in [start, end), sorted by start."""
+        lo = bisect.bisect_left(self.starts, start) if start else 0
+        hi = bisect.bisect_left(self.starts, end) if end else len(self.starts)
+        return self.events[lo:hi]
+
+    def get(self, uid) -> Optional[CalendarEntry]:
+        return self.by_uid.get(uid)
+
+    def get_external(self, external_id) -> Optional[CalendarEntry]:
+        return self.by_external_id.get(external_id)
+
+    def add(self, event: CalendarEntry) -> None:
+        """Add or replace an event."""
+        self.remove(event.uid)
+        i = bisect.bisect_right(self.starts, event.dt)
+        self.starts.insert(i, event.dt)
+        self.events.insert(i, event)
+        self.by_uid[event.uid] = event
+        if event.external_id:
+            self.by_external_id[event.external_id] = event
+
+    def remove(self, uid) -> Optional[CalendarEntry]:
+        event = self.by_uid.pop(uid, None)
+        if not event:
+            return None
+        # the event may have been mutated in place since it was indexed,
+        # so fall back to searching below its current start time
+        lo = bisect.bisect_left(self.starts, event.dt)
+        for i in itertools.chain(range(lo, len(self.events)), range(lo)):
+            if self.events[i] is event:
+                del self.events[i]
+                del self.starts[i]
+                break
+        if event.external_id and self.by_external_id.get(event.external_id) is event:
+            del self.by_external_id[event.external_id]
+        return event
@@ -0,0 +1,266 @@
+"""Load test the notification path against local stub services.
+
+Starts stub Slack, Mailgun and Twilio http servers with configurable
+latency and error rates, writes a synthetic calendar of due events,
+and drives `notify-soon` or `notify-today` against them:
+
+    python loadtest.py --events 10000 --scenario soon --latency 0.05
+    python loadtest.py --events 2000 --users 50 --scenario today --error-rate 0.1
+
+Reports throughput, p50/p99 latency of outbound requests and peak
+python memory.
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import datetime
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from unittest import mock
+
+import click
+import requests
+
+from files import write_events
+from models import CalendarEntry, Repeats
+import notify
+
+
+class StubServer:
+    """Local http server answering like a provider api.
+
+    Each request sleeps `latency` seconds; a fraction `error_rate` of
+    requests is answered with 429 and a Retry-After of `retry_after`.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with stub.lock:
+                    stub.requests += 1
+                    failed = stub.random.random() < stub.error_rate
+                    if failed:
+                        stub.errors += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if failed:
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(stub.retry_after))
+                    body = b'{"ok": false, "error": "ratelimited"}'
+                else:
+                    self.send_response(200)
+                    body = json.dumps(stub.response_body(self.path)).encode()
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def response_body(self, path):
+        if path.endswith("/Messages.json"):
+            return {"sid": f"SM{self.requests:032d}", "status": "queued"}
+        return {"ok": True, "id": f"<{self.requests}@stub>", "message": "Queued"}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_events(
+    n, minutes=15, users=1, now: Optional[datetime.datetime] = None, seed=None
+) -> List[CalendarEntry]:
+    """Return `n` events starting within `minutes` from now, across `users`."""
+    rnd = random.Random(seed)
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    events = list()
+    for i in range(n):
+        dt = now + datetime.timedelta(seconds=rnd.uniform(1, minutes * 60 - 1))
+        events.append(
+            CalendarEntry(
+                uid=f"00000000-0000-4000-8000-{i:012d}",
+                user=f"user{i % users}",
+                summary=f"load test event {i}",
+                dt=dt.replace(microsecond=0),
+                timezone="UTC",
+                created=now,
+                updated=now,
+                duration=datetime.timedelta(minutes=30),
+                repeats=Repeats.UNIQUE,
+            )
+        )
+    return events
+
+
+def make_context(data_path, slack_url, mailgun_url, twilio_url, users=1) -> Dict:
+    context = {
+        "events_data_path": os.path.join(data_path, "events.json"),
+        "SLACK_TOKEN": "xoxp-load-test",
+        "SLACK_API_URL": slack_url,
+        "MG_API_KEY": "load-test",
+        "MG_API_URL": f"{mailgun_url}/v3/",
+        "MG_FROM": "loadtest@example.com",
+        "MY_EMAIL_ADDRESS": "me@example.com",
+        "MY_MOBILE": "+440000000000",
+        "TWILIO_ACCOUNT_SID": "AC00000000000000000000000000000000",
+        "TWILIO_AUTH_TOKEN": "load-test",
+        "TWILIO_ORIGIN_NUMBER": "+440000000001",
+        "TWILIO_API_URL": twilio_url,
+        "DIGEST_CHANNELS": ["email", "slack", "sms"],
+        "DIGEST_RECIPIENTS": [
+            {
+                "user": f"user{i}",
+                "email": f"user{i}@example.com",
+                "mobile": f"+44{i:010d}",
+                "slack_channel": f"#user{i}",
+            }
+            for i in range(users)
+        ],
+    }
+    return context
+
+
+def percentile(values, p) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+
+def run_load_test(
+    events=1000,
+    scenario="soon",
+    users=1,
+    minutes=15,
+    latency=0.0,
+    error_rate=0.0,
+    retry_after=0,
+    rate_limits=None,
+    seed=None,
+) -> Dict:
+    """Run one load test and return its measurements."""
+    data_path = tempfile.mkdtemp(prefix="yewcal-loadtest-")
+    latencies: List[float] = list()
+    latencies_lock = threading.Lock()
+    send = requests.Session.send
+
+    def timed_send(session, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(session, request, **kwargs)
+        finally:
+            with latencies_lock:
+                latencies.append(time.perf_counter() - start)
+
+    stubs = [StubServer(latency, error_rate, retry_after, seed) for _ in range(3)]
+    try:
+        with stubs[0] as slack, stubs[1] as mailgun, stubs[2] as twilio:
+            context = make_context(data_path, slack.url, mailgun.url, twilio.url, users)
+            # large default limits: measure our overhead, not the providers'
+            context["RATE_LIMITS"] = rate_limits or {
+                "slack": [1000, 1000],
+                "mailgun": [1000, 1000],
+                "twilio": [1000, 1000],
+            }
+            write_events(
+                context["events_data_path"],
+                make_events(events, minutes, users, seed=seed),
+            )
+            tracemalloc.start()
+            start = time.perf_counter()
+            with mock.patch.object(requests.Session, "send", timed_send), mock.patch(
+                "builtins.print"
+            ):
+                if scenario == "today":
+                    notify.notify_todays_events(context)
+                else:
+                    notify.notify_impending_events(context, minutes)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stub_requests = sum(s.requests for s in stubs)
+            stub_errors = sum(s.errors for s in stubs)
+    finally:
+        shutil.rmtree(data_path, ignore_errors=True)
+
+    return {
+        "scenario": scenario,
+        "events": events,
+        "users": users,
+        "requests": stub_requests,
+        "errors": stub_errors,
+        "elapsed_s": round(elapsed, 3),
+        "events_per_s": round(events / elapsed, 1) if elapsed else 0.0,
+        "requests_per_s": round(stub_requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "peak_memory_mb": round(peak / 2**20, 2),
+    }
+
+
+@click.command()
+@click.option("--events", "-n", default=1000, help="Number of due events")
+@click.option(
+    "--scenario",
+    "-s",
+    type=click.Choice(("soon", "today")),
+    default="soon",
+    help="notify-soon or notify-today",
+)
+@click.option("--users", "-u", default=1, help="Users with their own recipients")
+@click.option("--minutes", "-m", default=15, help="Window events fall into")
+@click.option("--latency", "-l", default=0.0, help="Stub response latency, seconds")
+@click.option("--error-rate", "-e", default=0.0, help="Fraction answered with 429")
+@click.option("--retry-after", default=0, help="Retry-After sent with 429")
+@click.option("--seed", default=None, type=int)
+def main(events, scenario, users, minutes, latency, error_rate, retry_after, seed):
+    """Load test notifications against local stub services."""
+    report = run_load_test(
+        events=events,
+        scenario=scenario,
+        users=users,
+        minutes=minutes,
+        latency=latency,
+        error_rate=error_rate,
+        retry_after=retry_after,
+        seed=seed,
+    )
+    for k, v in report.items():
+        print(f"{k.ljust(16)}: {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Per-event three-way merge and changesets.
+
+Events are matched by uid with dicts, so diffing and merging are
+linear in the number of events. When both sides changed the same
+event, the one with the later `updated` wins and the uid is reported
+as a conflict; a modification wins over a deletion.
+"""
+
+import json
+from collections import namedtuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from models import CalendarEntry
+import encoding
+
+# uids of events added, updated and removed locally, and of conflicts
+MergeReport = namedtuple("MergeReport", "added updated removed conflicts")
+
+
+def by_uid(events: Sequence[CalendarEntry]) -> Dict[str, CalendarEntry]:
+    return {e.uid: e for e in events}
+
+
+def changeset(
+    old: Sequence[CalendarEntry], new: Sequence[CalendarEntry]
+) -> Dict[str, list]:
+    """Return the events to upsert and the uids to remove to turn old into new."""
+    old_map = by_uid(old)
+    new_map = by_uid(new)
+    return {
+        "upserts": [
+            json.loads(e.json()) for uid, e in new_map.items() if old_map.get(uid) != e
+        ],
+        "removed": [uid for uid in old_map if uid not in new_map],
+    }
+
+
+def apply_changeset(
+    events: Sequence[CalendarEntry], changes: Dict[str, list]
+) -> List[CalendarEntry]:
+    result = by_uid(events)
+    for uid in changes["removed"]:
+        result.pop(uid, None)
+    for d in changes["upserts"]:
+        e = CalendarEntry.parse_obj(d)
+        result[e.uid] = e
+    return list(result.values())
+
+
+def is_empty(changes) -> bool:
+    return not changes["upserts"] and not changes["removed"]
+
+
+def newer(a: CalendarEntry, b: CalendarEntry) -> CalendarEntry:
+    return b if b.updated > a.updated else a
+
+
+def merge_events(
+    base: Sequence[CalendarEntry],
+    local: Sequence[CalendarEntry],
+    remote: Sequence[CalendarEntry],
+) -> Tuple[List[CalendarEntry], MergeReport]:
+    """Merge remote changes since `base` into local ones.
+
+    Returns the merged events and a report of what changed locally.
+    """
+    base_map = by_uid(base)
+    local_map = by_uid(local)
+    remote_map = by_uid(remote)
+    report = MergeReport(list(), list(), list(), list())
+    merged: Dict[str, CalendarEntry] = dict()
+
+    for uid in local_map.keys() | remote_map.keys() | base_map.keys():
+        b = base_map.get(uid)
+        loc = local_map.get(uid)
+        rem = remote_map.get(uid)
+        result: Optional[CalendarEntry]
+        if loc == rem:
+            result = loc
+        elif loc == b:
+            # only remote changed
+            result = rem
+        elif rem == b:
+            # only local changed
+            result = loc
+        else:
+            report.conflicts.append(uid)
+            if loc is None or rem is None:
+                result = loc or rem
+            else:
+                result = newer(loc, rem)
+
+        if result is not None:
+            merged[uid] = result
+        if result is loc or result == loc:
+            continue
+        if loc is None:
+            report.added.append(uid)
+        elif result is None:
+            report.removed.append(uid)
+        else:
+            report.updated.append(uid)
+
+    return sorted(merged.values(), key=lambda e: e.dt), report
+
+
+def serialize(events: Sequence[CalendarEntry]) -> bytes:
+    """Return events in the events.json format."""
+    return encoding.dumps_events(events)
@@ -2,7 +2,7 @@ import datetime
 import json
 from enum import Enum
 
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
 
@@ -15,6 +15,11 @@ class Repeats(Enum):
     YEARLY = 5
 
 
+class Reminder(BaseModel):
+    minutes: int  # before the event starts
+    channel: str = "slack"  # slack, email, sms, macos
+
+
 class CalendarEntry(BaseModel):
     uid: str
     user: str  # local os username
@@ -29,6 +34,7 @@ class CalendarEntry(BaseModel):
     external_id: Optional[str]  # google, ical, etc. id
     source: Optional[str]  # when we pull from another calendar
     data: Optional[Dict]  # arbitrary extra data like conference url
+    reminders: Optional[List[Reminder]]
 
     def dump(self):
         print(f"uid     : {self.uid}")
@@ -41,6 +47,9 @@ class CalendarEntry(BaseModel):
         if self.source or self.external_id:
             print(f"source  : {self.source}")
             print(f"ext id  : {self.external_id}")
+        if self.reminders:
+            reminders = ", ".join(f"{r.minutes}m {r.channel}" for r in self.reminders)
+            print(f"remind  : {reminders}")
         if self.data:
             print(json.dumps(self.data, indent=4, default=str))
 
@@ -1,34 +1,46 @@
 import os
+import sys
+import time
+import datetime
 
-from utils import dt_today, dt_tomorrow, dt_nowish
-from files import read_events
-from services import slack, mailgun
+from utils import dt_nowish
+from constants import CURRENT_TZ
+from files import file_signature, read_events
+from index import EventIndex
+from services import slack, mailgun, twilio
+from services.scheduler import get_scheduler
+import digest
+import reminders
 
 
 def notify_macos(title, text):
+    if not sys.platform == "darwin":
+        return
     os.system(f"osascript -e 'display notification '{text}' with title '{title}'")
 
 
 def events_as_string(events):
-    s = ""
-    for e in events:
-        s += f"{e.dt.hour}:{e.dt.minute} {e.summary}\n"
-    return s
+    return "".join(f"{e.dt:%H:%M} {e.summary}\n" for e in events)
 
 
-def notify_todays_events(context):
-    events = read_events(context["events_data_path"])
-    events = tuple(e for e in events if e.dt >= dt_today() and e.dt < dt_tomorrow())
-    body = events_as_string(events)
-    r = mailgun.send_email(
-        context,
-        to_addresses=[context["MY_EMAIL_ADDRESS"]],
-        subject="Today's events",
-        body=body,
-    )
+def get_index(context) -> EventIndex:
+    """Return an index over the context events, reading them if needed."""
+    if context.get("events") is not None:
+        return EventIndex(context["events"])
+    return EventIndex(read_events(context["events_data_path"]))
 
-    if not r.status_code == 200:
-        print(r.content)
+
+def notify_todays_events(context):
+    """Send the daily digest; return the first email response, if any."""
+    results = digest.send_digests(context, get_index(context))
+    r = None
+    for d in results:
+        if isinstance(d.result, Exception):
+            print(f"{d.channel} to {d.target} failed: {d.result}")
+        elif d.channel == "email":
+            if not d.result.status_code == 200:
+                print(d.result.content)
+            r = r or d.result
     return r
 
 
@@ -40,9 +52,108 @@ def get_impending_events(events, minutes=15):
     return events
 
 
+def impending_events_text(events):
+    return "\n".join(f"{e.summary} at {e.dt}" for e in events)
+
+
 def notify_impending_events(context, minutes=15):
-    events = read_events(context["events_data_path"])
+    """Notify about events starting within `minutes`.
+
+    Slack messages are rate limited, and events starting in the same
+    minute are sent as one message.
+    """
+    events = read_events(context["events_data_path"], dt_nowish(0), dt_nowish(minutes))
     events = get_impending_events(events, minutes)
+    channel = context.get("SLACK_CHANNEL", digest.DEFAULT_SLACK_CHANNEL)
+    scheduler = get_scheduler(context)
     for e in events:
-        slack.post_message_to_slack(context, "#random", f"{e.summary} at {e.dt}")
+        scheduler.coalesce(
+            "slack",
+            e.dt.replace(second=0, microsecond=0),
+            e,
+            lambda es: slack.post_message(context, channel, impending_events_text(es)),
+        )
         notify_macos(e.summary, f"{e.summary} at {e.dt}")
+    for r in scheduler.run():
+        if isinstance(r, Exception) or not r.status_code == 200:
+            print(f"slack notification failed: {getattr(r, 'content', r)}")
+
+
+def reminder_text(event, occurrence, minutes):
+    return f"Reminder: {event.summary} at {occurrence.astimezone(CURRENT_TZ):%H:%M} (in {minutes} minutes)"
+
+
+def notify_reminders(context, now=None, scheduler=None):
+    """Send all due reminders from the reminder timeline.
+
+    Returns the number of reminders sent. Reminders for unknown
+    channels are reported and skipped.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    events = context.get("events")
+    if events is None:
+        events = read_events(context["events_data_path"])
+    base_data_path = os.path.dirname(context["events_data_path"])
+    timeline = reminders.load_timeline(
+        base_data_path, context["events_data_path"], events, now
+    )
+    due = reminders.pop_due(timeline, now, {e.uid: e for e in events})
+    reminders.write_timeline(base_data_path, timeline)
+
+    scheduler = scheduler or get_scheduler(context)
+    channel = context.get("SLACK_CHANNEL", digest.DEFAULT_SLACK_CHANNEL)
+    sent = 0
+    for event, occurrence, kind, minutes in due:
+        if kind not in reminders.CHANNELS:
+            print(f"unknown reminder channel {kind} for {event.summary}")
+            continue
+        sent += 1
+        text = reminder_text(event, occurrence, minutes)
+        if kind == "slack":
+            scheduler.coalesce(
+                "slack",
+                ("reminders", channel),
+                text,
+                lambda texts: slack.post_message(context, channel, "\n".join(texts)),
+            )
+        elif kind == "email":
+            scheduler.submit(
+                "mailgun",
+                mailgun.send_email,
+                context,
+                [context["MY_EMAIL_ADDRESS"]],
+                text,
+                text,
+            )
+        elif kind == "sms":
+            scheduler.submit("twilio", twilio.send_sms, context, text)
+        elif kind == "macos":
+            notify_macos(event.summary, text)
+    for r in scheduler.run():
+        if isinstance(r, Exception):
+            print(f"reminder failed: {r}")
+    return sent
+
+
+def run_reminder_daemon(context, max_sleep=60):
+    """Send reminders as they become due, forever.
+
+    Sleeps until the next reminder or at most `max_sleep` seconds, so
+    changes to the events file are picked up. The events are only read
+    again when the file changed.
+    """
+    base_data_path = os.path.dirname(context["events_data_path"])
+    signature = None
+    while True:
+        current = file_signature(context["events_data_path"])
+        if current != signature or context.get("events") is None:
+            context["events"] = read_events(context["events_data_path"])
+            signature = current
+        notify_reminders(context)
+        timeline = reminders.read_timeline(base_data_path)
+        next_fire = timeline and reminders.next_fire_time(timeline)
+        wait = max_sleep
+        if next_fire:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            wait = min(max_sleep, max(0, (next_fire - now).total_seconds()))
+        time.sleep(wait)
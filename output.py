@@ -0,0 +1,74 @@
+"""Machine readable event output.
+
+Rows are written as they are produced, without styling or
+humanizing, so large listings can be piped into other tools.
+"""
+
+import csv
+import json
+from typing import Callable, Dict, Iterable, Optional, Sequence, TextIO
+
+from models import CalendarEntry
+
+FORMATS = ("jsonl", "csv", "tsv")
+
+FIELDS: Dict[str, Callable[[CalendarEntry], object]] = {
+    "uid": lambda e: e.uid,
+    "user": lambda e: e.user,
+    "dt": lambda e: e.dt.isoformat(),
+    "date": lambda e: e.dt.date().isoformat(),
+    "time": lambda e: e.dt.strftime("%H:%M"),
+    "summary": lambda e: e.summary,
+    "description": lambda e: e.description,
+    "duration": lambda e: e.duration.total_seconds(),
+    "timezone": lambda e: e.timezone,
+    "repeats": lambda e: e.repeats.name.lower(),
+    "external_id": lambda e: e.external_id,
+    "source": lambda e: e.source,
+    "created": lambda e: e.created.isoformat(),
+    "updated": lambda e: e.updated.isoformat(),
+}
+
+DEFAULT_FIELDS = ("uid", "dt", "summary", "duration", "timezone", "repeats")
+
+
+class UnknownField(Exception):
+    pass
+
+
+def parse_fields(fields_str: Optional[str]) -> Sequence[str]:
+    """Return field names from a comma separated string."""
+    if not fields_str:
+        return DEFAULT_FIELDS
+    fields = [f.strip() for f in fields_str.split(",") if f.strip()]
+    for f in fields:
+        if f not in FIELDS:
+            raise UnknownField(f"Unknown field: {f}, choose from {', '.join(FIELDS)}")
+    return fields
+
+
+def stream_events(
+    events: Iterable[CalendarEntry],
+    fmt: str,
+    out: TextIO,
+    fields: Sequence[str] = DEFAULT_FIELDS,
+) -> int:
+    """Write events to `out` one row at a time; return the row count."""
+    getters = [FIELDS[f] for f in fields]
+    count = 0
+    if fmt == "jsonl":
+        dumps = json.dumps
+        write = out.write
+        for e in events:
+            write(dumps(dict(zip(fields, (g(e) for g in getters)))))
+            write("\n")
+            count += 1
+        return count
+
+    delimiter = "\t" if fmt == "tsv" else ","
+    writer = csv.writer(out, delimiter=delimiter, lineterminator="\n")
+    writer.writerow(fields)
+    for e in events:
+        writer.writerow([g(e) for g in getters])
+        count += 1
+    return count
@@ -0,0 +1,304 @@
+"""Publish upcoming events as .ics and JSON feeds for subscription.
+
+Every event is rendered once into an iCalendar VEVENT and a JSON
+fragment. The fragments are kept next to the events file, grouped by
+month window, and updated per event on upsert like the search index.
+Publishing concatenates the fragments of the windows in range, so
+only changed events are rendered again. If the events file was changed
+some other way, fragments are reused for events whose start and update
+time did not change.
+
+The feeds are written to PUBLISH_TARGET, a local directory or an
+fsspec url like s3://bucket/calendar. Nothing is written if the
+content is unchanged since the last publish to that target.
+
+Settings:
+
+    PUBLISH_TARGET: directory or url to write the feeds to
+    PUBLISH_DAYS: days ahead to include, default 90
+    PUBLISH_NAME: file name of the feeds without suffix, default "calendar"
+
+Fragments layout:
+
+    {
+        "signature": [mtime_ns, size],  # of the events file it reflects
+        "windows": {"YYYY-MM": {uid: [start_ts, stamp, ics, json, repeats]}},
+        "published": {target: content hash},
+    }
+"""
+
+import os
+import json
+import hashlib
+import datetime
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import fsspec
+
+from models import CalendarEntry, Repeats
+from files import file_signature
+import constants
+import encoding
+import utils
+
+UTC = datetime.timezone.utc
+DEFAULT_DAYS = 90
+DEFAULT_NAME = "calendar"
+FOLD_OCTETS = 75
+
+ICS_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    "PRODID:-//yewcal//yewcal//EN\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+)
+ICS_FOOTER = "END:VCALENDAR\r\n"
+
+Published = namedtuple("Published", "hash uploaded events")
+
+
+class PublishError(Exception):
+    pass
+
+
+def fragments_path(base_data_path) -> str:
+    return os.path.join(base_data_path, constants.PUBLISH_FRAGMENTS_FILENAME)
+
+
+def escape(text) -> str:
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def fold(line) -> str:
+    """Return a content line folded at 75 octets, with CRLF."""
+    parts = list()
+    current = ""
+    size = 0
+    for c in line:
+        n = len(c.encode())
+        if size + n > FOLD_OCTETS:
+            parts.append(current)
+            current = " "
+            size = 1
+        current += c
+        size += n
+    parts.append(current)
+    return "\r\n".join(parts) + "\r\n"
+
+
+def ics_time(dt: datetime.datetime) -> str:
+    return dt.astimezone(UTC).strftime("%Y%m%dT%H%M%SZ")
+
+
+def render_ics(e: CalendarEntry) -> str:
+    """Return the VEVENT for an event, with times in UTC."""
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{e.uid}",
+        f"DTSTAMP:{ics_time(e.updated)}",
+        f"DTSTART:{ics_time(e.dt)}",
+        f"DTEND:{ics_time(e.dt + e.duration)}",
+        f"SUMMARY:{escape(e.summary)}",
+    ]
+    if e.description:
+        lines.append(f"DESCRIPTION:{escape(e.description)}")
+    if e.repeats != Repeats.UNIQUE:
+        lines.append(f"RRULE:FREQ={e.repeats.name}")
+    lines.append("END:VEVENT")
+    return "".join(fold(line) for line in lines)
+
+
+def event_stamp(e: CalendarEntry) -> str:
+    return f"{e.dt.isoformat()} {e.updated.isoformat()}"
+
+
+def window_key(dt: datetime.datetime) -> str:
+    return utils.period_key(dt, monthly=True)
+
+
+def render_fragment(e: CalendarEntry) -> list:
+    return [
+        e.dt.timestamp(),
+        event_stamp(e),
+        render_ics(e),
+        encoding.event_json(e),
+        e.repeats != Repeats.UNIQUE,
+    ]
+
+
+def new_fragments() -> Dict:
+    return {"signature": None, "windows": dict(), "published": dict()}
+
+
+def remove_event(fragments, uid) -> None:
+    for key, window in list(fragments["windows"].items()):
+        if window.pop(uid, None) is not None and not window:
+            del fragments["windows"][key]
+
+
+def add_event(fragments, e: CalendarEntry, previous: Optional[Dict] = None) -> None:
+    """Add or replace the fragments of an event.
+
+    `previous` maps uid to a fragment that is reused if still current.
+    """
+    remove_event(fragments, e.uid)
+    fragment = previous.get(e.uid) if previous else None
+    if not fragment or fragment[1] != event_stamp(e):
+        fragment = render_fragment(e)
+    fragments["windows"].setdefault(window_key(e.dt), dict())[e.uid] = fragment
+
+
+def build_fragments(
+    events: Iterable[CalendarEntry], since: datetime.datetime, old=None
+) -> Dict:
+    """Return fragments for repeating events and events starting from `since` on."""
+    previous = dict()
+    for window in (old or new_fragments())["windows"].values():
+        previous.update(window)
+    fragments = new_fragments()
+    if old:
+        fragments["published"] = old.get("published", dict())
+    for e in events:
+        if e.dt >= since or e.repeats != Repeats.UNIQUE:
+            add_event(fragments, e, previous)
+    return fragments
+
+
+def read_fragments(base_data_path) -> Optional[Dict]:
+    path = fragments_path(base_data_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return None
+
+
+def write_fragments(base_data_path, fragments) -> None:
+    path = fragments_path(base_data_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wt") as f:
+        f.write(json.dumps(fragments))
+    os.replace(tmp_path, path)
+
+
+def load_fragments(
+    base_data_path, events_data_path, events, since: datetime.datetime
+) -> Dict:
+    """Return the fragments, bringing them up to date if the events file changed."""
+    signature = file_signature(events_data_path)
+    fragments = read_fragments(base_data_path)
+    if fragments is None or fragments.get("signature") != signature:
+        fragments = build_fragments(events, since, fragments)
+        fragments["signature"] = signature
+        write_fragments(base_data_path, fragments)
+    return fragments
+
+
+def update_fragments(
+    events_data_path,
+    signature,
+    events: Sequence[CalendarEntry] = (),
+    removed_uids: Sequence[str] = (),
+) -> None:
+    """Render changed events and drop removed ones.
+
+    Call after the events file was written, with its `signature` from
+    before. Nothing happens if nothing was published yet, or the
+    fragments were already stale: the next publish brings them up to
+    date.
+    """
+    base_data_path = os.path.dirname(events_data_path)
+    fragments = read_fragments(base_data_path)
+    if fragments is None or fragments.get("signature") != signature:
+        return
+    for uid in removed_uids:
+        remove_event(fragments, uid)
+    for e in events:
+        add_event(fragments, e)
+    fragments["signature"] = file_signature(events_data_path)
+    write_fragments(base_data_path, fragments)
+
+
+def feed_content(fragments, start: datetime.datetime, end: datetime.datetime):
+    """Return the ics and json feeds of events in [start, end) and their count.
+
+    Repeating events that started earlier are included as well.
+    """
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    last = window_key(end)
+    selected: List[list] = list()
+    for key, window in fragments["windows"].items():
+        if key > last:
+            continue
+        selected.extend(
+            f for f in window.values() if f[0] < end_ts and (f[0] >= start_ts or f[4])
+        )
+    selected.sort(key=lambda f: f[0])
+    ics = ICS_HEADER + "".join(f[2] for f in selected) + ICS_FOOTER
+    data = "[" + ", ".join(f[3] for f in selected) + "]"
+    return ics.encode(), data.encode(), len(selected)
+
+
+def storage_options(context, target) -> Dict:
+    if target.startswith("s3://"):
+        return {
+            "key": context.get("AWS_ACCESS_KEY_ID"),
+            "secret": context.get("AWS_SECRET_ACCESS_KEY"),
+        }
+    return dict()
+
+
+def write_files(context, target, files: Dict[str, bytes]) -> None:
+    """Write files atomically to a local directory or an fsspec url.
+
+    Locally each file is written to a temporary name and renamed; on
+    object stores a single put replaces an object atomically.
+    """
+    if "://" not in target:
+        os.makedirs(target, exist_ok=True)
+        for name, data in files.items():
+            path = os.path.join(target, name)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return
+    fs, path = fsspec.core.url_to_fs(target, **storage_options(context, target))
+    for name, data in files.items():
+        fs.pipe_file(f"{path.rstrip('/')}/{name}", data)
+
+
+def publish(
+    context,
+    events: Iterable[CalendarEntry],
+    now: Optional[datetime.datetime] = None,
+    force=False,
+) -> Published:
+    """Write the feeds of upcoming events unless they did not change."""
+    target = context.get("PUBLISH_TARGET")
+    if not target:
+        raise PublishError("Set PUBLISH_TARGET to a directory or url")
+    now = now or datetime.datetime.now(UTC)
+    days = context.get("PUBLISH_DAYS", DEFAULT_DAYS)
+    name = context.get("PUBLISH_NAME", DEFAULT_NAME)
+    start = utils.period_range(window_key(now))[0]
+    fragments = load_fragments(
+        context["base_data_path"], context["events_data_path"], events, start
+    )
+    ics, data, count = feed_content(fragments, now, now + datetime.timedelta(days))
+    digest = hashlib.sha256(ics + b"\0" + data).hexdigest()
+    if not force and fragments["published"].get(target) == digest:
+        return Published(digest, False, count)
+    write_files(context, target, {f"{name}.ics": ics, f"{name}.json": data})
+    fragments["published"][target] = digest
+    write_fragments(context["base_data_path"], fragments)
+    return Published(digest, True, count)
@@ -0,0 +1,379 @@
+"""Filter expressions over events, planned against the available indexes.
+
+    after:today before:"next month" summary:lunch
+    tz:london or source:googlecal
+    (text:budget or text:review) not repeats:unique
+    has:external_id
+
+Terms are `field:value`, values with spaces are quoted. Terms next to
+each other must all match; `or`, `not` and parentheses combine them.
+A bare word is a `text:` term.
+
+The planner looks at the terms that must match and picks the cheapest
+index that narrows the events down: uid or external_id lookups, the
+time interval of the sorted events, or the postings of the search
+index. Every candidate is then checked against the whole expression,
+so the index only decides how many events are examined.
+"""
+
+import re
+import time
+import bisect
+import datetime
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional
+
+from index import EventIndex
+from models import CalendarEntry, Repeats
+import search
+import utils
+
+Term = namedtuple("Term", "field value arg")
+And = namedtuple("And", "children")
+Or = namedtuple("Or", "children")
+Not = namedtuple("Not", "child")
+
+Access = namedtuple("Access", "kind detail estimate fetch")
+Plan = namedtuple("Plan", "access children")
+Result = namedtuple("Result", "events plan examined timings")
+
+TOKEN_RE = re.compile(
+    r"\s*(?:(?P<paren>[()])|(?:(?P<field>[a-z_]+):)?"
+    r'(?P<value>"(?:[^"\\]|\\.)*"|[^\s()"]+))'
+)
+KEYWORDS = ("and", "or", "not")
+HAS_FIELDS = ("external_id", "description", "source", "reminders", "data")
+FIELDS = (
+    "after",
+    "before",
+    "on",
+    "summary",
+    "description",
+    "tz",
+    "source",
+    "repeats",
+    "has",
+    "uid",
+    "external_id",
+    "text",
+)
+
+
+class QueryError(Exception):
+    pass
+
+
+def tokenize(expr: str) -> List[tuple]:
+    """Return (kind, field, value) tokens; kind is "(", ")", "op" or "term"."""
+    tokens = list()
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise QueryError(f"unexpected input at {pos}: {expr[pos:]}")
+        pos = m.end()
+        if m.group("paren"):
+            tokens.append((m.group("paren"), None, None))
+            continue
+        field, value = m.group("field"), m.group("value")
+        if value.startswith('"'):
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif not field and value.lower() in KEYWORDS:
+            tokens.append(("op", None, value.lower()))
+            continue
+        tokens.append(("term", field or "text", value))
+    return tokens
+
+
+def day_span(dt: datetime.datetime):
+    start = datetime.datetime.combine(dt.date(), datetime.time(), tzinfo=dt.tzinfo)
+    return start, start + datetime.timedelta(days=1)
+
+
+def compile_term(field, value, parse_datetime) -> Term:
+    """Return a term with its value parsed for matching."""
+    if field not in FIELDS:
+        raise QueryError(f"unknown field: {field}")
+    if field in ("after", "before", "on"):
+        try:
+            dt = parse_datetime(value)
+        except Exception:
+            dt = None
+        if dt is None:
+            raise QueryError(f"invalid date: {value}")
+        return Term(field, value, day_span(dt) if field == "on" else dt)
+    if field == "repeats":
+        try:
+            return Term(field, value, Repeats[value.upper()])
+        except KeyError:
+            raise QueryError(f"invalid repeats: {value}")
+    if field == "has":
+        if value not in HAS_FIELDS:
+            raise QueryError(f"has: takes one of {', '.join(HAS_FIELDS)}")
+        return Term(field, value, value)
+    if field == "text":
+        terms = search.tokenize(value)
+        if not terms:
+            raise QueryError(f"no searchable text in: {value}")
+        return Term(field, value, terms)
+    if field in ("uid", "external_id"):
+        return Term(field, value, value)
+    return Term(field, value, value.casefold())
+
+
+class Parser:
+    """Recursive descent over: or_expr := and_expr ("or" and_expr)*,
+    and_expr := not_expr (["and"] not_expr)*, not_expr := "not" not_expr
+    | "(" or_expr ")" | term.
+    """
+
+    def __init__(self, tokens, parse_datetime):
+        self.tokens = tokens
+        self.pos = 0
+        self.parse_datetime = parse_datetime
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise QueryError("unexpected end of query")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.or_expr()
+        if self.peek() is not None:
+            raise QueryError(f"unexpected {self.peek()[2] or self.peek()[0]}")
+        return node
+
+    def or_expr(self):
+        children = [self.and_expr()]
+        while self.peek() == ("op", None, "or"):
+            self.next()
+            children.append(self.and_expr())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def and_expr(self):
+        children = [self.not_expr()]
+        while self.peek() not in (None, (")", None, None), ("op", None, "or")):
+            if self.peek() == ("op", None, "and"):
+                self.next()
+            children.append(self.not_expr())
+        return children[0] if len(children) == 1 else And(children)
+
+    def not_expr(self):
+        kind, field, value = self.next()
+        if kind == "op" and value == "not":
+            return Not(self.not_expr())
+        if kind == "(":
+            node = self.or_expr()
+            if self.next()[0] != ")":
+                raise QueryError("missing )")
+            return node
+        if kind == "term":
+            return compile_term(field, value, self.parse_datetime)
+        raise QueryError(f"unexpected {value or kind}")
+
+
+def parse(expr: str, parse_datetime: Callable) -> object:
+    """Return the expression tree for `expr`.
+
+    `parse_datetime(str)` returns an aware datetime; None or an
+    exception mean the date is invalid.
+    """
+    tokens = tokenize(expr)
+    if not tokens:
+        raise QueryError("empty query")
+    return Parser(tokens, parse_datetime).parse()
+
+
+def match_term(term: Term, e: CalendarEntry) -> bool:
+    field, arg = term.field, term.arg
+    if field == "after":
+        return e.dt >= arg
+    if field == "before":
+        return e.dt < arg
+    if field == "on":
+        return arg[0] <= e.dt < arg[1]
+    if field == "summary":
+        return arg in e.summary.casefold()
+    if field == "description":
+        return arg in (e.description or "").casefold()
+    if field == "tz":
+        return arg in e.timezone.casefold()
+    if field == "source":
+        return arg == (e.source or "").casefold()
+    if field == "repeats":
+        return e.repeats == arg
+    if field == "has":
+        return bool(getattr(e, arg))
+    if field == "uid":
+        return e.uid == arg or utils.get_short_uid(e.uid) == arg
+    if field == "external_id":
+        return e.external_id == arg
+    terms = search.event_terms(e)
+    return all(t in terms for t in arg)
+
+
+def matches(node, e: CalendarEntry) -> bool:
+    if isinstance(node, Term):
+        return match_term(node, e)
+    if isinstance(node, And):
+        return all(matches(c, e) for c in node.children)
+    if isinstance(node, Or):
+        return any(matches(c, e) for c in node.children)
+    return not matches(node.child, e)
+
+
+class Sources:
+    """The indexes a plan can use; the search index is loaded on demand."""
+
+    def __init__(self, index: EventIndex, load_text_index: Callable[[], Dict]):
+        self.index = index
+        self._load_text_index = load_text_index
+        self._text_index = None
+
+    @property
+    def text_index(self) -> Dict:
+        if self._text_index is None:
+            self._text_index = self._load_text_index()
+        return self._text_index
+
+
+def interval_access(terms: List[Term], sources: Sources) -> Optional[Access]:
+    start = end = None
+    for t in terms:
+        lo, hi = {
+            "after": (t.arg, None),
+            "before": (None, t.arg),
+            "on": t.arg,
+        }.get(t.field, (None, None))
+        if lo and (start is None or lo > start):
+            start = lo
+        if hi and (end is None or hi < end):
+            end = hi
+    if start is None and end is None:
+        return None
+    starts = sources.index.starts
+    first = bisect.bisect_left(starts, start) if start else 0
+    last = bisect.bisect_left(starts, end) if end else len(starts)
+    detail = (
+        f"[{start.isoformat() if start else '-'}, {end.isoformat() if end else '-'})"
+    )
+    return Access(
+        "interval",
+        detail,
+        max(last - first, 0),
+        lambda: sources.index.between(start, end),
+    )
+
+
+def text_access(terms: List[Term], sources: Sources) -> Optional[Access]:
+    words = sorted({w for t in terms if t.field == "text" for w in t.arg})
+    if not words:
+        return None
+    postings = sources.text_index["postings"]
+    matched = sorted((postings.get(w, {}) for w in words), key=len)
+
+    def fetch():
+        uids = set(matched[0])
+        for m in matched[1:]:
+            uids.intersection_update(m)
+        events = (sources.index.get(uid) for uid in uids)
+        return sorted((e for e in events if e), key=lambda e: e.dt)
+
+    return Access("text", " ".join(words), len(matched[0]), fetch)
+
+
+def key_access(terms: List[Term], sources: Sources) -> Optional[Access]:
+    for t in terms:
+        if t.field == "uid" and utils.is_uuid(t.arg):
+            event = sources.index.get(t.arg)
+        elif t.field == "external_id":
+            event = sources.index.get_external(t.arg)
+        else:
+            continue
+        return Access(
+            t.field, t.arg, int(bool(event)), lambda: [event] if event else []
+        )
+    return None
+
+
+def scan_access(sources: Sources) -> Access:
+    return Access(
+        "scan", "all events", len(sources.index), lambda: sources.index.events
+    )
+
+
+def plan_conjunction(terms: List[Term], sources: Sources) -> Access:
+    """Return the cheapest access path for terms that must all match."""
+    paths = [
+        access(terms, sources) for access in (key_access, interval_access, text_access)
+    ]
+    return min(
+        (p for p in paths if p is not None),
+        key=lambda p: p.estimate,
+        default=scan_access(sources),
+    )
+
+
+def plan(node, sources: Sources) -> Plan:
+    if isinstance(node, Or):
+        children = [plan(c, sources) for c in node.children]
+        if any(c.access.kind == "scan" for c in children):
+            return Plan(scan_access(sources), list())
+        estimate = sum(c.access.estimate for c in children)
+
+        def fetch():
+            union = {e.uid: e for c in children for e in execute_plan(c)}
+            return sorted(union.values(), key=lambda e: e.dt)
+
+        return Plan(Access("union", "", estimate, fetch), children)
+    terms = node.children if isinstance(node, And) else [node]
+    return Plan(
+        plan_conjunction([t for t in terms if isinstance(t, Term)], sources), []
+    )
+
+
+def execute_plan(p: Plan) -> List[CalendarEntry]:
+    return p.access.fetch()
+
+
+def run(
+    expr: str,
+    index: EventIndex,
+    load_text_index: Callable[[], Dict],
+    parse_datetime: Callable,
+) -> Result:
+    """Parse, plan and run a query; return events sorted by start."""
+    timings = dict()
+    t0 = time.perf_counter()
+    node = parse(expr, parse_datetime)
+    t1 = time.perf_counter()
+    p = plan(node, Sources(index, load_text_index))
+    t2 = time.perf_counter()
+    candidates = execute_plan(p)
+    t3 = time.perf_counter()
+    events = [e for e in candidates if matches(node, e)]
+    t4 = time.perf_counter()
+    timings.update(parse=t1 - t0, plan=t2 - t1, fetch=t3 - t2, filter=t4 - t3)
+    return Result(events, p, len(candidates), timings)
+
+
+def explain(result: Result) -> List[str]:
+    """Return lines describing the plan, rows examined and timings."""
+
+    def describe(p: Plan, depth=0):
+        a = p.access
+        line = f"{'  ' * depth}{a.kind} {a.detail}".rstrip()
+        yield f"{line} (~{a.estimate} events)"
+        for c in p.children:
+            yield from describe(c, depth + 1)
+
+    lines = ["plan:"] + [f"  {line}" for line in describe(result.plan)]
+    lines.append(f"examined {result.examined}, matched {len(result.events)}")
+    lines.append(", ".join(f"{k} {v * 1000:.2f}ms" for k, v in result.timings.items()))
+    return lines
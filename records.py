@@ -0,0 +1,118 @@
+"""Record oriented event file that can be memory-mapped.
+
+Layout, little endian:
+
+    header   magic (8 bytes), record count (uint64)
+    table    one (start timestamp float64, offset uint64, length uint32)
+             entry per record, sorted by start
+    records  the json of each event, as in events.json
+
+Range queries binary search the table in the mapped file and decode
+only the records in range, so memory use follows the result size.
+"""
+
+import os
+import mmap
+import struct
+import datetime
+from typing import List, Optional, Sequence
+
+from models import CalendarEntry
+import encoding
+
+MAGIC = b"YCREC1\0\0"
+HEADER = struct.Struct("<8sQ")
+ENTRY = struct.Struct("<dQI")
+
+RECORDS_SUFFIX = ".rec"
+
+
+class InvalidRecordFile(Exception):
+    pass
+
+
+def is_records_path(path) -> bool:
+    return str(path).endswith(RECORDS_SUFFIX)
+
+
+def write_records(path, events: Sequence[CalendarEntry]) -> None:
+    events = sorted(events, key=lambda e: e.dt)
+    blobs = [encoding.event_json(e).encode() for e in events]
+    offset = HEADER.size + ENTRY.size * len(blobs)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(blobs)))
+        for e, blob in zip(events, blobs):
+            f.write(ENTRY.pack(e.dt.timestamp(), offset, len(blob)))
+            offset += len(blob)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+class RecordFile:
+    """Read access to a record file through mmap."""
+
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        try:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.f.close()
+            raise InvalidRecordFile(f"Empty record file: {path}")
+        magic, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise InvalidRecordFile(f"Not a record file: {path}")
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, i):
+        return ENTRY.unpack_from(self.mm, HEADER.size + i * ENTRY.size)
+
+    def bisect(self, ts) -> int:
+        """Return the first record index starting at or after `ts`."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read(self, i) -> CalendarEntry:
+        _, offset, length = self.entry(i)
+        return CalendarEntry.parse_raw(self.mm[offset : offset + length])
+
+    def between(
+        self,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+    ) -> List[CalendarEntry]:
+        """Return events starting in [start, end), sorted by start."""
+        lo = self.bisect(start.timestamp()) if start else 0
+        hi = self.bisect(end.timestamp()) if end else self.count
+        return [self.read(i) for i in range(lo, hi)]
+
+
+def read_records(
+    path,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> List[CalendarEntry]:
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return list()
+    with RecordFile(path) as rf:
+        return rf.between(start, end)
@@ -0,0 +1,181 @@
+"""Precomputed reminder timeline.
+
+The timeline is a heap of `[fire_ts, uid, channel, minutes]` items,
+one per event reminder, holding the next time each reminder fires.
+Due reminders are popped off the heap; for repeating events the
+reminder for the following occurrence is pushed back on. The heap is
+persisted next to the events file and updated per event on upsert.
+"""
+
+import os
+import json
+import heapq
+import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from models import CalendarEntry, Reminder
+from utils import next_occurrence, parse_offset
+from files import file_signature
+import constants
+
+UTC = datetime.timezone.utc
+CHANNELS = ("slack", "email", "sms", "macos")
+
+
+def parse_reminder(spec: str) -> Reminder:
+    """Return a reminder from a string like "1h" or "5m:sms"."""
+    offset, _, channel = spec.partition(":")
+    channel = channel or "slack"
+    if channel not in CHANNELS:
+        raise ValueError(f"channel must be one of {', '.join(CHANNELS)}: {channel}")
+    return Reminder(minutes=parse_offset(offset), channel=channel)
+
+
+def timeline_path(base_data_path) -> str:
+    return os.path.join(base_data_path, constants.REMINDERS_FILENAME)
+
+
+def next_items(event: CalendarEntry, after: datetime.datetime) -> List[list]:
+    """Return timeline items for the first occurrence of `event` at or after `after`.
+
+    A reminder whose time has passed for an occurrence that has not
+    started yet is included, so it fires on the next run.
+    """
+    occurrence = next_occurrence(event, after)
+    if occurrence is None:
+        return list()
+    return [
+        [
+            (occurrence - datetime.timedelta(minutes=r.minutes)).timestamp(),
+            event.uid,
+            r.channel,
+            r.minutes,
+        ]
+        for r in event.reminders or ()
+    ]
+
+
+def new_timeline() -> Dict:
+    # checked: timestamp up to which reminders were processed
+    return {"signature": None, "checked": None, "heap": list()}
+
+
+def build_timeline(events: Iterable[CalendarEntry], now: datetime.datetime) -> Dict:
+    timeline = new_timeline()
+    for e in events:
+        timeline["heap"].extend(next_items(e, now))
+    heapq.heapify(timeline["heap"])
+    return timeline
+
+
+def update_events(
+    timeline,
+    events: Sequence[CalendarEntry],
+    now: datetime.datetime,
+    removed_uids: Sequence[str] = (),
+) -> None:
+    """Replace the items of changed or removed events."""
+    uids = set(removed_uids) | {e.uid for e in events}
+    heap = [item for item in timeline["heap"] if item[1] not in uids]
+    heapq.heapify(heap)
+    for e in events:
+        for item in next_items(e, now):
+            heapq.heappush(heap, item)
+    timeline["heap"] = heap
+
+
+def pop_due(
+    timeline, now: datetime.datetime, events_by_uid: Dict[str, CalendarEntry]
+) -> List[tuple]:
+    """Pop reminders due at `now`; return (event, occurrence, channel, minutes).
+
+    Reminders whose event has already started are dropped rather than
+    sent late.
+    """
+    heap = timeline["heap"]
+    now_ts = now.timestamp()
+    timeline["checked"] = now_ts
+    due = list()
+    while heap and heap[0][0] <= now_ts:
+        fire_ts, uid, channel, minutes = heapq.heappop(heap)
+        event = events_by_uid.get(uid)
+        if event is None:
+            continue
+        occurrence_ts = fire_ts + minutes * 60
+        if occurrence_ts >= now_ts:
+            occurrence = datetime.datetime.fromtimestamp(occurrence_ts, UTC)
+            due.append((event, occurrence, channel, minutes))
+        # schedule this reminder for the next occurrence
+        after = datetime.datetime.fromtimestamp(max(occurrence_ts + 1, now_ts), UTC)
+        occurrence = next_occurrence(event, after)
+        if occurrence is not None:
+            fire = occurrence - datetime.timedelta(minutes=minutes)
+            heapq.heappush(heap, [fire.timestamp(), uid, channel, minutes])
+    return due
+
+
+def next_fire_time(timeline) -> Optional[datetime.datetime]:
+    heap = timeline["heap"]
+    if not heap:
+        return None
+    return datetime.datetime.fromtimestamp(heap[0][0], UTC)
+
+
+def read_timeline(base_data_path) -> Optional[Dict]:
+    path = timeline_path(base_data_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return None
+
+
+def write_timeline(base_data_path, timeline) -> None:
+    path = timeline_path(base_data_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wt") as f:
+        f.write(json.dumps(timeline))
+    os.replace(tmp_path, path)
+
+
+def load_timeline(base_data_path, events_data_path, events, now) -> Dict:
+    """Return the persisted timeline, rebuilding it if the events file changed.
+
+    A rebuild starts from the last processed time so reminders falling
+    between two runs are not lost.
+    """
+    signature = file_signature(events_data_path)
+    timeline = read_timeline(base_data_path)
+    if timeline is None or timeline.get("signature") != signature:
+        checked = timeline and timeline.get("checked")
+        after = datetime.datetime.fromtimestamp(checked, UTC) if checked else now
+        timeline = build_timeline(events, min(after, now))
+        timeline["signature"] = signature
+        timeline["checked"] = checked
+        write_timeline(base_data_path, timeline)
+    return timeline
+
+
+def update_timeline(
+    events_data_path,
+    signature,
+    events: Sequence[CalendarEntry] = (),
+    removed_uids: Sequence[str] = (),
+) -> None:
+    """Apply changed and removed events to the persisted timeline.
+
+    Call after the events file was written, with its `signature` from
+    before. Nothing happens if no timeline exists yet, or it was
+    already stale: the next reminder run rebuilds it.
+    """
+    base_data_path = os.path.dirname(events_data_path)
+    timeline = read_timeline(base_data_path)
+    if timeline is None or timeline.get("signature") != signature:
+        return
+    update_events(
+        timeline, events, datetime.datetime.now(UTC), removed_uids=removed_uids
+    )
+    timeline["signature"] = file_signature(events_data_path)
+    write_timeline(base_data_path, timeline)
@@ -0,0 +1,205 @@
+"""Full-text search over events.
+
+The index is an inverted index of case-folded tokens from an event's
+summary, description and any string values inside `data`. It is
+persisted next to the events file and updated per event on upsert.
+
+Index layout:
+
+    {
+        "signature": [mtime_ns, size],  # of the events file it reflects
+        "docs": {uid: [dt_isoformat, {term: weight}]},
+        "postings": {term: {uid: weight}},
+    }
+"""
+
+import os
+import re
+import json
+import math
+import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from models import CalendarEntry
+from files import file_signature
+import constants
+
+TOKEN_RE = re.compile(r"\w+")
+
+SUMMARY_WEIGHT = 3
+DESCRIPTION_WEIGHT = 2
+DATA_WEIGHT = 1
+
+
+def tokenize(text) -> List[str]:
+    return TOKEN_RE.findall(text.casefold())
+
+
+def data_strings(data) -> Iterable[str]:
+    """Yield all string values nested in `data`."""
+    if isinstance(data, str):
+        yield data
+    elif isinstance(data, dict):
+        for v in data.values():
+            yield from data_strings(v)
+    elif isinstance(data, (list, tuple)):
+        for v in data:
+            yield from data_strings(v)
+
+
+def event_terms(event: CalendarEntry) -> Dict[str, int]:
+    """Return weighted terms for an event."""
+    terms: Dict[str, int] = dict()
+    fields = [(event.summary, SUMMARY_WEIGHT)]
+    if event.description:
+        fields.append((event.description, DESCRIPTION_WEIGHT))
+    fields.extend((s, DATA_WEIGHT) for s in data_strings(event.data))
+    for text, weight in fields:
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + weight
+    return terms
+
+
+def index_path(base_data_path) -> str:
+    return os.path.join(base_data_path, constants.SEARCH_INDEX_FILENAME)
+
+
+def new_index() -> Dict:
+    return {"signature": None, "docs": dict(), "postings": dict()}
+
+
+def remove_event(index, uid) -> None:
+    doc = index["docs"].pop(uid, None)
+    if not doc:
+        return
+    postings = index["postings"]
+    for term in doc[1]:
+        uids = postings.get(term)
+        if uids is None:
+            continue
+        uids.pop(uid, None)
+        if not uids:
+            del postings[term]
+
+
+def add_event(index, event: CalendarEntry) -> None:
+    remove_event(index, event.uid)
+    terms = event_terms(event)
+    index["docs"][event.uid] = [event.dt.isoformat(), terms]
+    postings = index["postings"]
+    for term, weight in terms.items():
+        postings.setdefault(term, dict())[event.uid] = weight
+
+
+def build_index(events: Iterable[CalendarEntry]) -> Dict:
+    index = new_index()
+    for e in events:
+        add_event(index, e)
+    return index
+
+
+def read_index(base_data_path) -> Optional[Dict]:
+    path = index_path(base_data_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return None
+
+
+def write_index(base_data_path, index) -> None:
+    path = index_path(base_data_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wt") as f:
+        f.write(json.dumps(index))
+    os.replace(tmp_path, path)
+
+
+def load_index(base_data_path, events_data_path, events) -> Dict:
+    """Return the persisted index, rebuilding it if the events file changed."""
+    signature = file_signature(events_data_path)
+    index = read_index(base_data_path)
+    if index is None or index.get("signature") != signature:
+        index = build_index(events)
+        index["signature"] = signature
+        write_index(base_data_path, index)
+    return index
+
+
+def update_index(
+    events_data_path,
+    signature,
+    events: Sequence[CalendarEntry] = (),
+    removed_uids: Sequence[str] = (),
+) -> None:
+    """Apply changed and removed events to the persisted index.
+
+    Call after the events file was written, with its `signature` from
+    before. Nothing happens if no index exists yet, or it was already
+    stale: the next search rebuilds it.
+    """
+    base_data_path = os.path.dirname(events_data_path)
+    index = read_index(base_data_path)
+    if index is None or index.get("signature") != signature:
+        return
+    for uid in removed_uids:
+        remove_event(index, uid)
+    for e in events:
+        add_event(index, e)
+    index["signature"] = file_signature(events_data_path)
+    write_index(base_data_path, index)
+
+
+def search(
+    index,
+    query,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> List[Tuple[str, float]]:
+    """Return (uid, score) for events matching all query terms, best first."""
+    return search_indexes([index], query, start, end)
+
+
+def search_indexes(
+    indexes: Sequence[Dict],
+    query,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> List[Tuple[str, float]]:
+    """Search several indexes as one, e.g. the hot events and the archive.
+
+    Term and document counts are summed over the indexes, so the
+    scores of all results can be compared.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return list()
+    n_docs = sum(len(index["docs"]) for index in indexes)
+    counts = [sum(len(i["postings"].get(t, ())) for i in indexes) for t in terms]
+    results = list()
+    for index in indexes:
+        postings = index["postings"]
+        matches = [postings.get(t) for t in terms]
+        if not all(matches):
+            continue
+        # intersect starting from the rarest term
+        uids = set(min(matches, key=len))
+        for m in matches:
+            uids.intersection_update(m)
+        # an event in more than one index counts once, from the first
+        uids.difference_update(uid for uid, _ in results)
+        docs = index["docs"]
+        for uid in uids:
+            if start or end:
+                dt = datetime.datetime.fromisoformat(docs[uid][0])
+                if start and dt < start:
+                    continue
+                if end and dt >= end:
+                    continue
+            score = sum(
+                m[uid] * math.log(1 + n_docs / n) for m, n in zip(matches, counts)
+            )
+            results.append((uid, score))
+    return sorted(results, key=lambda r: -r[1])
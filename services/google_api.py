@@ -1,54 +1,165 @@
-import datetime
-import pickle
 import os.path
+import pickle
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from googleapiclient.discovery import build
+import arrow
+import httplib2
+import google_auth_httplib2
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document, DISCOVERY_URI
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
 
+API_NAME = "calendar"
+API_VERSION = "v3"
+DISCOVERY_FILENAME = f"{API_NAME}-{API_VERSION}-discovery.json"
+
+# refresh credentials this long before they expire
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# built services and credentials per data path, reused within the process
+_services = dict()
+_services_lock = threading.Lock()
+
 
-def get_google_events(context, max_events=10):
-    """Shows basic usage of the Google Calendar API.
-    Prints the start and name of the next 10 events on the user's calendar.
+def get_discovery_document(context, http=None) -> str:
+    """Return the calendar api discovery document, cached on disk."""
+    path = os.path.join(context["base_data_path"], DISCOVERY_FILENAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            return f.read()
+    doc = discovery_cache.get_static_doc(API_NAME, API_VERSION)
+    if not doc:
+        url = DISCOVERY_URI.format(api=API_NAME, apiVersion=API_VERSION)
+        _, content = (http or httplib2.Http()).request(url)
+        doc = content.decode() if isinstance(content, bytes) else content
+    with open(path, "wt") as f:
+        f.write(doc)
+    return doc
+
+
+def needs_refresh(creds, now=None) -> bool:
+    """Return True if credentials are invalid or expire soon."""
+    if not creds.valid:
+        return True
+    if not creds.expiry:
+        return False
+    # google-auth keeps expiry as naive utc
+    now = now or datetime.datetime.utcnow()
+    return creds.expiry - now < REFRESH_MARGIN
+
+
+def get_credentials(context, creds=None):
+    """Return credentials, refreshing them before they expire.
+
+    The file token.pickle stores the user's access and refresh tokens, and is
+    created automatically when the authorization flow completes for the first
+    time.
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
     token_file = os.path.join(context["base_data_path"], "token.pickle")
     credentials_file = os.path.join(context["base_data_path"], "credentials.json")
 
-    if os.path.exists(token_file):
+    if not creds and os.path.exists(token_file):
         with open(token_file, "rb") as token:
             creds = pickle.load(token)
+    if creds and not needs_refresh(creds):
+        return creds
     # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+    if creds and creds.refresh_token:
+        creds.refresh(Request())
+    else:
+        flow = InstalledAppFlow.from_client_secrets_file(credentials_file, SCOPES)
+        creds = flow.run_local_server(port=0)
+    # Save the credentials for the next run
+    with open(token_file, "wb") as token:
+        pickle.dump(creds, token)
+    return creds
+
+
+def get_service(context, http=None):
+    """Return a calendar service and its credentials, built once per process.
+
+    Pass `http` (e.g. an HttpMock) to use a transport instead of credentials.
+    """
+    key = (context["base_data_path"], id(http) if http else None)
+    with _services_lock:
+        service, creds = _services.get(key, (None, None))
+        if service is not None and (http or not needs_refresh(creds)):
+            return service, creds
+        doc = get_discovery_document(context, http)
+        if http:
+            service = build_from_document(doc, http=http)
         else:
-            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open(token_file, "wb") as token:
-            pickle.dump(creds, token)
+            creds = get_credentials(context, creds)
+            service = build_from_document(doc, credentials=creds)
+        _services[key] = (service, creds)
+        return service, creds
+
+
+def clear_services():
+    with _services_lock:
+        _services.clear()
+
+
+def fetch_calendar_events(service, calendar_id, time_min, max_events, http):
+    """Return up to `max_events` upcoming events of one calendar, page by page."""
+    items = list()
+    page_token = None
+    while len(items) < max_events:
+        events_result = (
+            service.events()
+            .list(
+                calendarId=calendar_id,
+                timeMin=time_min,
+                maxResults=min(max_events - len(items), 250),
+                singleEvents=True,
+                orderBy="startTime",
+                pageToken=page_token,
+            )
+            .execute(http=http)
+        )
+        items.extend(events_result.get("items", []))
+        page_token = events_result.get("nextPageToken")
+        if not page_token:
+            break
+    return items[:max_events]
 
-    service = build("calendar", "v3", credentials=creds)
+
+def get_google_events(context, max_events=10, calendar_ids=None, http=None):
+    """Return the next `max_events` events of each calendar.
+
+    Calendars are GOOGLE_CALENDAR_IDS from settings, default the
+    primary calendar, fetched concurrently. Events are sorted by start.
+    """
+    calendar_ids = calendar_ids or context.get("GOOGLE_CALENDAR_IDS") or ["primary"]
+    service, creds = get_service(context, http)
+
+    def http_for_thread():
+        # httplib2 connections are not thread safe, so each request
+        # thread gets its own unless a test transport was given
+        if http:
+            return http
+        return google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
 
     # Call the Calendar API
     now = datetime.datetime.utcnow().isoformat() + "Z"  # 'Z' indicates UTC time
-    print("Getting the upcoming 10 events")
-    events_result = (
-        service.events()
-        .list(
-            calendarId="primary",
-            timeMin=now,
-            maxResults=max_events,
-            singleEvents=True,
-            orderBy="startTime",
+    print(f"Getting the upcoming {max_events} events")
+    with ThreadPoolExecutor(max_workers=min(len(calendar_ids), 8)) as pool:
+        pages = pool.map(
+            lambda calendar_id: fetch_calendar_events(
+                service, calendar_id, now, max_events, http_for_thread()
+            ),
+            calendar_ids,
         )
-        .execute()
-    )
-    return events_result.get("items", [])
+        items = [item for page in pages for item in page]
+    return sorted(items, key=event_start)
+
+
+def event_start(item):
+    start = item.get("start", dict())
+    return arrow.get(start.get("dateTime") or start.get("date") or 0)
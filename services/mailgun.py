@@ -3,15 +3,20 @@ import urllib
 import requests
 
 
-def send_email(context, to_addresses, subject, body, from_address=None):
+def send_email(context, to_addresses, subject, body, from_address=None, html=None):
     from_address = from_address or context["MG_FROM"]
+    if isinstance(to_addresses, str):
+        to_addresses = [to_addresses]
+    data = {
+        "from": from_address,
+        "to": to_addresses,
+        "subject": subject,
+        "text": body,
+    }
+    if html:
+        data["html"] = html
     return requests.post(
         urllib.parse.urljoin(context["MG_API_URL"], "messages"),
         auth=("api", context["MG_API_KEY"]),
-        data={
-            "from": from_address,
-            "to": [to_addresses],
-            "subject": subject,
-            "text": body,
-        },
+        data=data,
     )
@@ -0,0 +1,164 @@
+"""Rate limited dispatch of outbound API requests.
+
+Each provider gets a token bucket. Jobs for one provider run in order,
+waiting for tokens; providers run in parallel. Responses or exceptions
+with status 429 (or 503) are retried after the server's Retry-After
+hint, and the hint pauses the provider's bucket for later jobs too.
+Jobs sharing a coalescing key are sent as a single request.
+
+Clock and sleep are injectable so behaviour can be tested without
+waiting.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# provider: (requests per second, burst capacity)
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "slack": (1.0, 1.0),
+    "mailgun": (5.0, 10.0),
+    "twilio": (1.0, 1.0),
+}
+FALLBACK_LIMIT = (1.0, 1.0)
+
+RETRY_STATUSES = (429, 503)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens=1.0) -> float:
+        """Return seconds until `tokens` can be taken."""
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            wait = max(0.0, self.paused_until - now)
+            if self.tokens < tokens:
+                wait = max(wait, (tokens - self.tokens) / self.rate)
+            return wait
+
+    def take(self, tokens=1.0) -> bool:
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            if now < self.paused_until or self.tokens < tokens:
+                return False
+            self.tokens -= tokens
+            return True
+
+    def pause(self, seconds) -> None:
+        """Hand out no tokens for `seconds`, e.g. after a Retry-After."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+def backoff_hint(result, attempt=0, backoff=1.0) -> Optional[float]:
+    """Return seconds to wait before retrying, or None if `result` is final.
+
+    `result` is a response or an exception; both are checked for a
+    retryable status and a Retry-After header.
+    """
+    status = getattr(result, "status_code", None) or getattr(result, "status", None)
+    if status not in RETRY_STATUSES:
+        return None
+    headers = getattr(result, "headers", None) or dict()
+    retry_after = headers.get("Retry-After")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return backoff * 2**attempt
+
+
+class OutboundScheduler:
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Any] = time.sleep,
+        max_retries=3,
+        backoff=1.0,
+    ):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or dict())
+        self.clock = clock
+        self.sleep = sleep
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.buckets: Dict[str, TokenBucket] = dict()
+        self.jobs: List[list] = list()
+        self.coalesced: Dict[Tuple[str, Any], int] = dict()
+
+    def bucket(self, provider) -> TokenBucket:
+        if provider not in self.buckets:
+            rate, capacity = self.limits.get(provider, FALLBACK_LIMIT)
+            self.buckets[provider] = TokenBucket(rate, capacity, self.clock)
+        return self.buckets[provider]
+
+    def submit(self, provider, fn, *args, **kwargs) -> int:
+        """Queue a call; return the index of its result in `run()`."""
+        self.jobs.append([provider, fn, args, kwargs])
+        return len(self.jobs) - 1
+
+    def coalesce(self, provider, key, item, send: Callable[[List], Any]) -> int:
+        """Queue `item`; all items with the same key go to one `send(items)`."""
+        i = self.coalesced.get((provider, key))
+        if i is None:
+            i = self.submit(provider, send, list())
+            self.coalesced[(provider, key)] = i
+        self.jobs[i][2][0].append(item)
+        return i
+
+    def call(self, provider, fn, args, kwargs):
+        bucket = self.bucket(provider)
+        result = None
+        for attempt in range(self.max_retries + 1):
+            while not bucket.take():
+                self.sleep(bucket.wait_time())
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                result = e
+            delay = backoff_hint(result, attempt, self.backoff)
+            if delay is None:
+                break
+            bucket.pause(delay)
+        return result
+
+    def run(self) -> List:
+        """Send all queued jobs; return results (or exceptions) in job order."""
+        jobs, self.jobs, self.coalesced = self.jobs, list(), dict()
+        results: List = [None] * len(jobs)
+        by_provider: Dict[str, List[int]] = dict()
+        for i, job in enumerate(jobs):
+            by_provider.setdefault(job[0], list()).append(i)
+
+        def run_provider(indexes):
+            for i in indexes:
+                results[i] = self.call(*jobs[i])
+
+        if len(by_provider) == 1:
+            run_provider(next(iter(by_provider.values())))
+        elif by_provider:
+            with ThreadPoolExecutor(max_workers=len(by_provider)) as pool:
+                for f in [pool.submit(run_provider, v) for v in by_provider.values()]:
+                    f.result()
+        return results
+
+
+def get_scheduler(context, **kwargs) -> OutboundScheduler:
+    """Return a scheduler using RATE_LIMITS from settings, if any."""
+    limits = {k: tuple(v) for k, v in (context.get("RATE_LIMITS") or dict()).items()}
+    return OutboundScheduler(limits, **kwargs)
@@ -2,15 +2,16 @@ import json
 
 import requests
 
-
 SLACK_API_URL = "https://slack.com/api/"
 
 slack_icon_url = "https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTuGqps7ZafuzUsViFGIremEL2a3NR0KO0s0RTCMXmzmREJd5m4MA&s"
 
 
-def post_message_to_slack(context, channel, text, blocks=None):
+def post_message(context, channel, text, blocks=None):
+    """Post a message and return the http response."""
+    api_url = context.get("SLACK_API_URL") or SLACK_API_URL
     return requests.post(
-        "https://slack.com/api/chat.postMessage",
+        f"{api_url.rstrip('/')}/chat.postMessage",
         {
             "token": context["SLACK_TOKEN"],
             "channel": channel,
@@ -19,4 +20,8 @@ def post_message_to_slack(context, channel, text, blocks=None):
             "username": "paul.wolf",
             "blocks": json.dumps(blocks) if blocks else None,
         },
-    ).json()
+    )
+
+
+def post_message_to_slack(context, channel, text, blocks=None):
+    return post_message(context, channel, text, blocks).json()
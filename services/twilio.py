@@ -1,13 +1,16 @@
 from twilio.rest import Client
 
 
-def send_sms(context, msg):
-    """Send sms."""
+def send_sms(context, msg, to=None):
+    """Send sms, by default to MY_MOBILE."""
 
     client = Client(context["TWILIO_ACCOUNT_SID"], context["TWILIO_AUTH_TOKEN"])
+    if context.get("TWILIO_API_URL"):
+        client.api.base_url = context["TWILIO_API_URL"]
 
     message = client.messages.create(
-        to=context["MY_MOBILE"], from_=context["TWILIO_ORIGIN_NUMBER"], body=msg
+        to=to or context["MY_MOBILE"], from_=context["TWILIO_ORIGIN_NUMBER"], body=msg
     )
 
     print(message.sid)
+    return message
@@ -0,0 +1,157 @@
+"""Events sharded into per-month files.
+
+A sharded events store is a directory (`events.d`) holding one
+`events-YYYY-MM.json` file per UTC month, in the events.json format,
+and a manifest with the content hash and event count of each shard:
+
+    {"shards": {"2020-11": {"hash": "...", "count": 12}}}
+
+Reads open only the shards overlapping the requested range and writes
+only rewrite shards whose content changed. The manifest is written
+last, so it only ever lists complete shards.
+"""
+
+import os
+import json
+import hashlib
+import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from models import CalendarEntry
+import encoding
+import constants
+import utils
+
+SHARDS_SUFFIX = ".d"
+
+
+def is_shards_path(path) -> bool:
+    return str(path).endswith(SHARDS_SUFFIX)
+
+
+def manifest_path(path) -> str:
+    return os.path.join(path, constants.MANIFEST_FILENAME)
+
+
+def shard_filename(key) -> str:
+    return f"events-{key}.json"
+
+
+def shard_path(path, key) -> str:
+    return os.path.join(path, shard_filename(key))
+
+
+def shard_key(dt: datetime.datetime) -> str:
+    return utils.period_key(dt, monthly=True)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_manifest(path) -> Dict:
+    mpath = manifest_path(path)
+    if not os.path.exists(mpath):
+        return {"shards": dict()}
+    with open(mpath) as f:
+        return json.load(f)
+
+
+def write_file(path, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_manifest(path, manifest) -> None:
+    write_file(manifest_path(path), json.dumps(manifest, indent=1).encode())
+
+
+def set_shard(path, manifest, key, data: Optional[bytes], count=None) -> None:
+    """Write shard `key` with `data`, or remove it if `data` is None.
+
+    Only the manifest entry is updated; the caller writes the manifest.
+    """
+    if data is None:
+        manifest["shards"].pop(key, None)
+        if os.path.exists(shard_path(path, key)):
+            os.remove(shard_path(path, key))
+        return
+    write_file(shard_path(path, key), data)
+    if count is None:
+        count = len(json.loads(data))
+    manifest["shards"][key] = {"hash": content_hash(data), "count": count}
+
+
+def serialize(events: Iterable[CalendarEntry]) -> bytes:
+    events = sorted(events, key=lambda e: e.dt)
+    return encoding.dumps_events(events)
+
+
+def read_shard(path, key) -> List[CalendarEntry]:
+    with open(shard_path(path, key)) as f:
+        return [CalendarEntry.parse_obj(d) for d in json.load(f)]
+
+
+def read_shards(
+    path,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> List[CalendarEntry]:
+    """Return events in [start, end) reading only overlapping shards."""
+    events = list()
+    for key in sorted(read_manifest(path)["shards"]):
+        shard_start, shard_end = utils.period_range(key)
+        if (start and shard_end <= start) or (end and shard_start >= end):
+            continue
+        for e in read_shard(path, key):
+            if (not start or e.dt >= start) and (not end or e.dt < end):
+                events.append(e)
+    return events
+
+
+def write_shards(
+    path,
+    events: Sequence[CalendarEntry],
+    changed: Optional[Iterable[datetime.datetime]] = None,
+) -> List[str]:
+    """Write events into shards; return keys of rewritten shards.
+
+    `events` is the complete event list. If `changed` holds the old
+    and new datetimes of changed events, only their shards are
+    considered; otherwise every shard is compared by hash.
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest = read_manifest(path)
+    keys = None if changed is None else {shard_key(dt) for dt in changed}
+    by_key: Dict[str, List[CalendarEntry]] = dict()
+    for e in events:
+        key = shard_key(e.dt)
+        if keys is None or key in keys:
+            by_key.setdefault(key, list()).append(e)
+
+    written = list()
+    for key in by_key.keys() | (keys or set()):
+        shard_events = by_key.get(key, ())
+        if not shard_events:
+            continue
+        data = serialize(shard_events)
+        digest = content_hash(data)
+        if manifest["shards"].get(key, dict()).get("hash") != digest:
+            write_file(shard_path(path, key), data)
+            manifest["shards"][key] = {"hash": digest, "count": len(shard_events)}
+            written.append(key)
+
+    # shards that no longer hold events
+    candidates = manifest["shards"].keys() if keys is None else keys
+    for key in [k for k in candidates if k not in by_key]:
+        if key in manifest["shards"]:
+            del manifest["shards"][key]
+            if os.path.exists(shard_path(path, key)):
+                os.remove(shard_path(path, key))
+            written.append(key)
+
+    if written or not os.path.exists(manifest_path(path)):
+        write_manifest(path, manifest)
+    return sorted(written)
@@ -0,0 +1,90 @@
+"""Startup snapshot of the parsed, sorted and indexed events.
+
+Parsing and validating every event on each invocation dominates
+startup for large calendars. The EventIndex built from the events
+file is pickled next to it together with a hash of the file content;
+if the hash still matches, the index is unpickled instead.
+"""
+
+import os
+import pickle
+import hashlib
+from typing import Optional
+
+from files import content_path, parse_events, read_events
+from index import EventIndex
+from records import is_records_path
+from shards import is_shards_path
+import constants
+
+SNAPSHOT_VERSION = 1
+
+
+def snapshot_path(events_data_path) -> str:
+    return os.path.join(os.path.dirname(events_data_path), constants.SNAPSHOT_FILENAME)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_snapshot(events_data_path, digest) -> Optional[EventIndex]:
+    """Return the snapshot index if it matches `digest`, else None."""
+    path = snapshot_path(events_data_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception:
+        return None
+    if (
+        not isinstance(snapshot, dict)
+        or snapshot.get("version") != SNAPSHOT_VERSION
+        or snapshot.get("hash") != digest
+    ):
+        return None
+    return snapshot["index"]
+
+
+def write_snapshot(events_data_path, index: EventIndex, digest=None) -> None:
+    """Write the snapshot for the current content of the events file."""
+    if is_records_path(events_data_path):
+        return
+    if digest is None:
+        with open(content_path(events_data_path), "rb") as f:
+            digest = content_hash(f.read())
+    path = snapshot_path(events_data_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(
+            {"version": SNAPSHOT_VERSION, "hash": digest, "index": index},
+            f,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_index(events_data_path) -> EventIndex:
+    """Return an index over the events file, from the snapshot if valid.
+
+    Record files are already sorted and indexed, so they are read
+    directly. Sharded stores are validated by the hash of their
+    manifest, which holds the hash of every shard.
+    """
+    if is_records_path(events_data_path):
+        return EventIndex(read_events(events_data_path))
+    path = content_path(events_data_path)
+    if not os.path.exists(path):
+        return EventIndex()
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = content_hash(data)
+    index = read_snapshot(events_data_path, digest)
+    if index is None:
+        if is_shards_path(events_data_path):
+            index = EventIndex(read_events(events_data_path))
+        else:
+            index = EventIndex(parse_events(data.decode()))
+        write_snapshot(events_data_path, index, digest)
+    return index
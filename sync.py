@@ -1,9 +1,25 @@
 import os
+import json
+import uuid
 
 import s3fs
-import arrow
 
 import constants
+import shards
+import merge
+import search
+import reminders
+import publish
+import snapshot
+from files import file_signature, parse_events, read_events, write_events
+from index import EventIndex
+
+DEFAULT_KEEP_CHANGESETS = 100
+MAX_PUSH_ROUNDS = 5
+
+
+class SyncError(Exception):
+    pass
 
 
 def get_s3(context):
@@ -13,28 +29,334 @@ def get_s3(context):
     )
 
 
+def remote_base_path(context):
+    return f"{context.get('BUCKET')}/{context.get('USERNAME')}"
+
+
 def remote_path(context):
-    return (
-        f"{context.get('BUCKET')}/{context.get('USERNAME')}/{constants.EVENTS_FILENAME}"
+    return f"{remote_base_path(context)}/{constants.EVENTS_FILENAME}"
+
+
+def remote_changes_path(context):
+    return f"{remote_base_path(context)}/changes"
+
+
+def remote_shards_path(context):
+    return f"{remote_base_path(context)}/{constants.EVENTS_SHARDS_DIRNAME}"
+
+
+def read_remote_manifest(s3, remote_dir):
+    path = f"{remote_dir}/{constants.MANIFEST_FILENAME}"
+    if not s3.exists(path):
+        return {"shards": dict()}
+    return json.loads(s3.cat(path))
+
+
+def changed_shards(source, target):
+    """Return keys of shards in manifest `source` that differ in `target`."""
+    return sorted(
+        key
+        for key, meta in source["shards"].items()
+        if target["shards"].get(key, dict()).get("hash") != meta["hash"]
+    )
+
+
+def shard_hash(manifest, key):
+    return manifest["shards"].get(key, dict()).get("hash")
+
+
+def base_shards_path(context):
+    """Return the copy of the shards as they were at the last sync."""
+    return os.path.join(base_data_path(context), constants.SYNC_BASE_SHARDS_DIRNAME)
+
+
+def read_shard_events(path, manifest, key):
+    if shard_hash(manifest, key) is None:
+        return list()
+    return shards.read_shard(path, key)
+
+
+def merge_shard(context, key, base, local, remote_data):
+    """Return the data of a shard changed on both sides, merged per event."""
+    base_events = read_shard_events(base_shards_path(context), base, key)
+    local_events = read_shard_events(context.get("events_data_path"), local, key)
+    remote_events = parse_events(remote_data.decode()) if remote_data else list()
+    merged, _ = merge.merge_events(base_events, local_events, remote_events)
+    return shards.serialize(merged) if merged else None
+
+
+def check_remote_manifest(s3, remote_dir, base):
+    """Raise SyncError if the remote shards moved past the base."""
+    remote = read_remote_manifest(s3, remote_dir)
+    if changed_shards(remote, base) or changed_shards(base, remote):
+        raise SyncError("Remote shards changed during push, push again to merge")
+
+
+def push_shards(context):
+    """Pull remote changes, then upload shards changed locally; return their keys.
+
+    Raises SyncError if another client pushed in between, rather than
+    overwriting its shards.
+    """
+    get_shards(context)
+    s3 = get_s3(context)
+    local_dir = context.get("events_data_path")
+    remote_dir = remote_shards_path(context)
+    base_dir = base_shards_path(context)
+    local = shards.read_manifest(local_dir)
+    base = shards.read_manifest(base_dir)
+    keys = changed_shards(local, base)
+    removed = set(base["shards"]) - set(local["shards"])
+    if not keys and not removed and s3.exists(remote_dir):
+        return keys
+    check_remote_manifest(s3, remote_dir, base)
+    for key in keys:
+        s3.put(
+            shards.shard_path(local_dir, key),
+            f"{remote_dir}/{shards.shard_filename(key)}",
+        )
+    # the manifest goes after new shards and before removing old ones,
+    # so the remote never lists missing shards
+    s3.pipe(
+        f"{remote_dir}/{constants.MANIFEST_FILENAME}",
+        json.dumps(local, indent=1).encode(),
+    )
+    for key in removed:
+        s3.rm(f"{remote_dir}/{shards.shard_filename(key)}")
+    os.makedirs(base_dir, exist_ok=True)
+    for key in keys + sorted(removed):
+        data = None
+        if key in local["shards"]:
+            with open(shards.shard_path(local_dir, key), "rb") as f:
+                data = f.read()
+        shards.set_shard(base_dir, base, key, data)
+    shards.write_manifest(base_dir, base)
+    return keys
+
+
+def get_shards(context):
+    """Bring in shards changed remotely since the last sync; return their keys.
+
+    Shards changed only on the remote are downloaded, shards changed
+    on both sides are merged per event. Shards changed only locally
+    are kept. The remote shards become the base of the next sync.
+    """
+    s3 = get_s3(context)
+    local_dir = context.get("events_data_path")
+    remote_dir = remote_shards_path(context)
+    base_dir = base_shards_path(context)
+    remote = read_remote_manifest(s3, remote_dir)
+    local = shards.read_manifest(local_dir)
+    base = shards.read_manifest(base_dir)
+    os.makedirs(local_dir, exist_ok=True)
+    os.makedirs(base_dir, exist_ok=True)
+    keys = list()
+    for key in sorted(set(remote["shards"]) | set(base["shards"])):
+        remote_hash = shard_hash(remote, key)
+        if remote_hash == shard_hash(base, key):
+            continue
+        data = None
+        if remote_hash:
+            data = s3.cat(f"{remote_dir}/{shards.shard_filename(key)}")
+        count = remote["shards"].get(key, dict()).get("count")
+        local_hash = shard_hash(local, key)
+        if local_hash == shard_hash(base, key):
+            shards.set_shard(local_dir, local, key, data, count)
+            keys.append(key)
+        elif local_hash != remote_hash:
+            shards.set_shard(
+                local_dir, local, key, merge_shard(context, key, base, local, data)
+            )
+            keys.append(key)
+        shards.set_shard(base_dir, base, key, data, count)
+    if keys or not os.path.exists(shards.manifest_path(local_dir)):
+        shards.write_manifest(local_dir, local)
+    shards.write_manifest(base_dir, base)
+    return keys
+
+
+def base_data_path(context):
+    return os.path.dirname(context.get("events_data_path"))
+
+
+def read_sync_state(context):
+    """Return the last synced remote events and the sync state.
+
+    The events are the common ancestor for the next three-way merge.
+    The state has this client's id, the highest changeset number seen
+    and the names of the changesets applied to the events.
+    """
+    path = os.path.join(base_data_path(context), constants.SYNC_STATE_FILENAME)
+    base_path = os.path.join(base_data_path(context), constants.SYNC_BASE_FILENAME)
+    state = {"client": None, "seq": None, "applied": None}
+    if os.path.exists(path):
+        with open(path) as f:
+            state.update(json.load(f))
+    if not state["client"]:
+        state["client"] = uuid.uuid4().hex[:12]
+    if not os.path.exists(base_path):
+        state.update(seq=None, applied=None)
+        return list(), state
+    return read_events(base_path), state
+
+
+def write_sync_state(context, events, state):
+    base_path = os.path.join(base_data_path(context), constants.SYNC_BASE_FILENAME)
+    write_events(base_path, events, allow_empty=True)
+    path = os.path.join(base_data_path(context), constants.SYNC_STATE_FILENAME)
+    with open(path, "wt") as f:
+        f.write(json.dumps(state))
+
+
+def changes_filename(seq, client):
+    return f"{seq:010d}-{client}.json"
+
+
+def changes_seq(name):
+    return int(name.split(".")[0].split("-")[0])
+
+
+def remote_changesets(s3, context):
+    """Return the sorted names of changesets on the remote.
+
+    Clients that pushed from the same base write the same number, the
+    client id in the name keeps them from overwriting each other.
+    """
+    path = remote_changes_path(context)
+    if not s3.exists(path):
+        return list()
+    names = (os.path.basename(p) for p in s3.ls(path, detail=False))
+    return sorted(
+        (n for n in names if n.endswith(".json")), key=lambda n: (changes_seq(n), n)
     )
 
 
+def read_remote_events(s3, context, base_events, state):
+    """Return the remote events and the names of the remote changesets.
+
+    If the base is known and no changeset after it was pruned, only
+    the changesets not applied yet are downloaded and applied to it;
+    otherwise the full remote file is downloaded.
+    """
+    names = remote_changesets(s3, context)
+    seq = state["seq"]
+    if seq is not None and names and changes_seq(names[0]) <= seq + 1:
+        events = base_events
+        applied = state["applied"]
+        if applied is None:
+            # states written before changesets had names only have a number
+            applied = [n for n in names if changes_seq(n) <= seq]
+        applied = set(applied)
+        for name in names:
+            if name not in applied:
+                path = f"{remote_changes_path(context)}/{name}"
+                events = merge.apply_changeset(events, json.loads(s3.cat(path)))
+        return events, names
+    if not s3.exists(remote_path(context)):
+        return list(), names
+    return parse_events(s3.cat(remote_path(context)).decode()), names
+
+
+def seen_state(state, names, seq=None):
+    """Return `state` with `names` applied, keeping only changesets still listed."""
+    seqs = [changes_seq(n) for n in names] + [s for s in (seq, state["seq"]) if s]
+    return dict(state, seq=max(seqs, default=None), applied=list(names))
+
+
+def prune_changesets(s3, context, names):
+    """Remove changesets that the full remote file has superseded.
+
+    Clients whose last sync is older than the oldest changeset left
+    download the full file instead.
+    """
+    keep = context.get("SYNC_KEEP_CHANGESETS", DEFAULT_KEEP_CHANGESETS)
+    if not names:
+        return
+    latest = changes_seq(names[-1])
+    old = [n for n in names if changes_seq(n) <= latest - keep]
+    for name in old:
+        s3.rm(f"{remote_changes_path(context)}/{name}")
+
+
+def apply_report(context, events, report, signature):
+    """Update derived indexes and caches for merged changes.
+
+    `signature` is the signature of the events file before the merged
+    events were written.
+    """
+    path = context.get("events_data_path")
+    merged = {e.uid: e for e in events}
+    changed = [merged[uid] for uid in report.added + report.updated]
+    search.update_index(path, signature, changed, removed_uids=report.removed)
+    reminders.update_timeline(path, signature, changed, removed_uids=report.removed)
+    publish.update_fragments(path, signature, changed, removed_uids=report.removed)
+    snapshot.write_snapshot(path, EventIndex(events))
+
+
+def print_report(report):
+    for label, uids in zip(("Added", "Updated", "Removed", "Conflicts"), report):
+        if uids:
+            print(f"{label.ljust(10)}: {len(uids)}")
+
+
+def pull_changes(context):
+    """Merge remote changes into the local events; return the merge report."""
+    s3 = get_s3(context)
+    base_events, state = read_sync_state(context)
+    remote_events, names = read_remote_events(s3, context, base_events, state)
+    local_events = read_events(context.get("events_data_path"))
+    merged, report = merge.merge_events(base_events, local_events, remote_events)
+    if report.added or report.updated or report.removed:
+        signature = file_signature(context.get("events_data_path"))
+        write_events(context.get("events_data_path"), merged, allow_empty=True)
+        apply_report(context, merged, report, signature)
+    write_sync_state(context, remote_events, seen_state(state, names))
+    return report
+
+
+def push_changes(context):
+    """Pull and merge, then upload local changes as a changeset.
+
+    The full events file is uploaded as well for new clients and
+    the notification server. If another client pushed meanwhile, its
+    changes are pulled and the full file is uploaded again, so the
+    last client to upload it has seen every changeset.
+    """
+    report = pull_changes(context)
+    s3 = get_s3(context)
+    base_events, state = read_sync_state(context)
+    local_events = read_events(context.get("events_data_path"))
+    changes = merge.changeset(base_events, local_events)
+    if merge.is_empty(changes) and s3.exists(remote_path(context)):
+        return report
+    seq = (state["seq"] or 0) + 1
+    name = changes_filename(seq, state["client"])
+    changes["seq"] = seq
+    s3.pipe(f"{remote_changes_path(context)}/{name}", json.dumps(changes).encode())
+    state = seen_state(state, state["applied"] + [name], seq)
+    write_sync_state(context, local_events, state)
+    for _ in range(MAX_PUSH_ROUNDS):
+        s3.pipe(remote_path(context), merge.serialize(local_events))
+        names = remote_changesets(s3, context)
+        if set(names) <= set(state["applied"]):
+            break
+        pulled = pull_changes(context)
+        report = merge.MergeReport(*(a + b for a, b in zip(report, pulled)))
+        local_events = read_events(context.get("events_data_path"))
+        _, state = read_sync_state(context)
+    prune_changesets(s3, context, names)
+    return report
+
+
 def push_event_data(context):
-    get_s3(context).put(context.get("events_data_path"), remote_path(context))
+    if shards.is_shards_path(context.get("events_data_path")):
+        return push_shards(context)
+    return push_changes(context)
 
 
 def get_event_data(context):
-
-    data = get_s3(context).info(remote_path(context))
-    remote_dt = data.get("LastModified")
-    local_events_path = context.get("events_data_path")
-    print(f"Remote file time : {arrow.get(remote_dt)}")
-    if os.path.exists(local_events_path):
-        print(f"Local file time  : {arrow.get(os.path.getmtime(local_events_path))}")
-        if not arrow.get(remote_dt) < arrow.get(
-            os.path.getmtime(context.get("events_data_path"))
-        ):
-            print("Remote is older than local, aborting")
-            return
-
-    get_s3(context).get_file(remote_path(context), context.get("events_data_path"))
+    if shards.is_shards_path(context.get("events_data_path")):
+        return get_shards(context)
+    report = pull_changes(context)
+    print_report(report)
+    return report
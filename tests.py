@@ -4,9 +4,15 @@ import unittest
 from unittest import mock
 import shutil
 import datetime
+import calendar
+import pytz
 import types
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 from click.testing import CliRunner
+import fsspec
+import requests
 from hypothesis import given
 import hypothesis.strategies as st
 from hypothesis import settings, Verbosity
@@ -20,13 +26,37 @@ from yc import (
     upsert_event,
     print_events,
     get_event,
+    parse_datetime,
+    parse_datetime_arg,
 )
 from yc import DatetimeInvalid, EventNotFound
 from models import CalendarEntry
-from files import write_events, read_events
+from files import write_events, read_events, parse_events
 import utils
 import notify
+import archive
+import search
+import digest
+import output
+import reminders
+import snapshot
+import records
+import shards
+import merge
+import loadtest
+import calview
+import publish
+import feeds
+import query
+import encoding
+import batch
+import timezones
+from models import Reminder, Repeats
+from index import EventIndex
 from services import twilio
+from services import scheduler
+from services import google_api
+from googleapiclient.http import HttpMockSequence
 import sync
 
 TEST_USERNAME = "_cal_test_user_"
@@ -49,6 +79,290 @@ SETTINGS = {
 }
 
 
+ICS_FEED = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:meeting-1\r
+DTSTAMP:20260101T120000Z\r
+DTSTART;TZID=Europe/London:{start:%Y%m%dT%H%M%S}\r
+DTEND;TZID=Europe/London:{end:%Y%m%dT%H%M%S}\r
+SUMMARY:Board meeting\\, room 1\r
+DESCRIPTION:Agenda:\\n1. budget and a very long line that is folded over\r
+  two lines\r
+RRULE:FREQ=WEEKLY\r
+BEGIN:VALARM\r
+TRIGGER:-PT15M\r
+DESCRIPTION:alarm\r
+END:VALARM\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:holiday\r
+DTSTART;VALUE=DATE:20261225\r
+SUMMARY:Christmas\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:call\r
+DTSTART:20261020T080000Z\r
+DURATION:PT1H30M\r
+SUMMARY:Call\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:gone\r
+DTSTART:20261021T080000Z\r
+STATUS:CANCELLED\r
+SUMMARY:Cancelled\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+def ics_feed(start=datetime.datetime(2026, 10, 19, 10)):
+    return ICS_FEED.format(start=start, end=start + datetime.timedelta(hours=1))
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serve ICS_FEED with an ETag and answer conditional requests with 304."""
+
+    etag = '"v1"'
+    body = ics_feed().encode()
+    requests = list()
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar; charset=utf-8")
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = list()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = scheduler.OutboundScheduler(
+            {"stub": (2.0, 1.0)}, clock=self.clock, sleep=self.clock.sleep
+        )
+
+    def test_token_bucket(self):
+        calls = list()
+        for i in range(5):
+            self.scheduler.submit("stub", lambda i=i: calls.append((i, self.clock())))
+        self.scheduler.run()
+        assert [t for _, t in calls] == [0.0, 0.5, 1.0, 1.5, 2.0]
+
+    def test_retry_after(self):
+        responses = [
+            types.SimpleNamespace(status_code=429, headers={"Retry-After": "30"}),
+            types.SimpleNamespace(status_code=200, headers={}),
+        ]
+        calls = list()
+
+        def send():
+            calls.append(self.clock())
+            return responses.pop(0)
+
+        i = self.scheduler.submit("stub", send)
+        j = self.scheduler.submit("stub", lambda: self.clock())
+        results = self.scheduler.run()
+        assert results[i].status_code == 200
+        assert calls == [0.0, 30.0]
+        assert results[j] >= 30.5
+
+    def test_retry_gives_up(self):
+        class Busy(Exception):
+            status = 429
+
+        def busy():
+            raise Busy()
+
+        self.scheduler.max_retries = 2
+        result = self.scheduler.call("stub", busy, (), {})
+        assert isinstance(result, Busy)
+        # exponential backoff without a Retry-After hint
+        assert self.clock.now >= 1.0 + 2.0
+
+    def test_coalesce(self):
+        sent = list()
+        for item, minute in (("a", 1), ("b", 1), ("c", 2)):
+            self.scheduler.coalesce("stub", minute, item, sent.append)
+        self.scheduler.run()
+        assert sent == [["a", "b"], ["c"]]
+
+    def test_providers_run_independently(self):
+        results = list()
+        self.scheduler.limits["other"] = (1.0, 1.0)
+        self.scheduler.submit("stub", lambda: results.append("stub"))
+        self.scheduler.submit("other", lambda: results.append("other"))
+        self.scheduler.run()
+        assert sorted(results) == ["other", "stub"]
+
+
+def google_page(items, next_page_token=None):
+    page = {"items": items}
+    if next_page_token:
+        page["nextPageToken"] = next_page_token
+    return ({"status": "200"}, json.dumps(page))
+
+
+def google_item(id, start):
+    return {"id": id, "summary": id, "start": {"dateTime": start}}
+
+
+class TestGoogleApi(unittest.TestCase):
+    def setUp(self):
+        self.base_data_path = os.path.join(
+            os.path.expanduser("~"), ".yew.d", TEST_USERNAME, "google"
+        )
+        if os.path.exists(self.base_data_path):
+            shutil.rmtree(self.base_data_path)
+        os.makedirs(self.base_data_path)
+        self.context = {"base_data_path": self.base_data_path}
+        google_api.clear_services()
+
+    def test_get_google_events_pages(self):
+        http = HttpMockSequence(
+            [
+                google_page([google_item("b", "2020-12-03T12:00:00Z")], "page2"),
+                google_page([google_item("a", "2020-12-03T11:00:00+00:00")]),
+            ]
+        )
+        items = google_api.get_google_events(self.context, 10, http=http)
+        assert [i["id"] for i in items] == ["a", "b"]
+        assert os.path.exists(
+            os.path.join(self.base_data_path, google_api.DISCOVERY_FILENAME)
+        )
+
+    def test_get_google_events_calendars(self):
+        http = HttpMockSequence(
+            [
+                google_page([google_item("x", "2020-12-03T12:00:00Z")]),
+                google_page([google_item("y", "2020-12-03T10:00:00Z")]),
+            ]
+        )
+        items = google_api.get_google_events(
+            self.context, 5, calendar_ids=["primary", "work"], http=http
+        )
+        assert [i["id"] for i in items] == ["y", "x"]
+
+    def test_service_is_cached(self):
+        http = HttpMockSequence([])
+        service, _ = google_api.get_service(self.context, http)
+        with mock.patch("services.google_api.build_from_document") as build:
+            assert google_api.get_service(self.context, http)[0] is service
+        assert not build.called
+
+    def test_credentials_refreshed_before_expiry(self):
+        creds = mock.Mock(valid=True, refresh_token="token")
+        creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        assert google_api.get_credentials(self.context, creds) is creds
+        assert not creds.refresh.called
+        creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        with mock.patch("services.google_api.pickle.dump"):
+            google_api.get_credentials(self.context, creds)
+        assert creds.refresh.called
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_stub_server(self):
+        with loadtest.StubServer(error_rate=1.0, retry_after=7, seed=1) as stub:
+            r = requests.post(f"{stub.url}/chat.postMessage", {"text": "hi"})
+        assert r.status_code == 429
+        assert r.headers["Retry-After"] == "7"
+        assert stub.requests == stub.errors == 1
+
+    def test_notify_soon(self):
+        report = loadtest.run_load_test(events=200, scenario="soon", seed=1)
+        assert report["events"] == 200
+        # events are coalesced into one slack message per minute
+        assert 0 < report["requests"] <= 16
+        assert report["p99_ms"] >= report["p50_ms"] > 0
+
+    def test_notify_today_with_errors(self):
+        report = loadtest.run_load_test(
+            events=50, scenario="today", users=3, error_rate=0.3, seed=3
+        )
+        assert report["errors"]
+        assert report["requests"] > report["errors"]
+
+
+class TestTimezones(unittest.TestCase):
+    def utc_hours(self, start, hours):
+        return [start + datetime.timedelta(hours=h) for h in range(hours)]
+
+    def test_to_local_many_matches_pytz(self):
+        start = datetime.datetime(2026, 3, 1, tzinfo=datetime.timezone.utc)
+        dts = self.utc_hours(start, 24 * 250)
+        for name in ("Europe/London", "America/New_York", "Australia/Sydney", "UTC"):
+            tz = pytz.timezone(name)
+            expected = [dt.astimezone(tz) for dt in dts]
+            assert timezones.to_local_many(dts, name) == expected
+            # unsorted input falls back to bisecting
+            assert timezones.to_local_many(dts[::-7], name) == expected[::-7]
+            assert [dt.utcoffset() for dt in timezones.to_local_many(dts, name)] == [
+                dt.utcoffset() for dt in expected
+            ]
+
+    def test_table_timezone(self):
+        tz = timezones.TableTimezone("Europe/London")
+        assert datetime.datetime(2026, 1, 1, tzinfo=tz).utcoffset().seconds == 0
+        summer = datetime.datetime(2026, 7, 1, 12, tzinfo=tz)
+        assert summer.utcoffset() == datetime.timedelta(hours=1)
+        assert summer.tzname() == "BST"
+        # the offset follows DST for conversions done in a long running process
+        before = datetime.datetime(2026, 3, 29, 0, 30, tzinfo=datetime.timezone.utc)
+        after = before + datetime.timedelta(hours=1)
+        assert before.astimezone(tz).hour == 0
+        assert after.astimezone(tz).hour == 2
+
+    def test_table_timezone_fold(self):
+        tz = timezones.TableTimezone("Europe/London")
+        first = datetime.datetime(2021, 10, 31, 0, 30, tzinfo=datetime.timezone.utc)
+        second = first + datetime.timedelta(hours=1)
+        # 01:30 happens twice when the clocks go back
+        assert [dt.astimezone(tz).isoformat() for dt in (first, second)] == [
+            "2021-10-31T01:30:00+01:00",
+            "2021-10-31T01:30:00+00:00",
+        ]
+        assert second.astimezone(tz).fold == 1
+        for dt in self.utc_hours(first - datetime.timedelta(hours=3), 8):
+            assert dt.astimezone(tz).astimezone(datetime.timezone.utc) == dt
+        wall = datetime.datetime(2021, 10, 31, 1, 30, tzinfo=tz)
+        assert wall.utcoffset() == datetime.timedelta(hours=1)
+        assert wall.replace(fold=1).utcoffset() == datetime.timedelta(0)
+        # a missing wall time uses the offset from before the change
+        gap = datetime.datetime(2021, 3, 28, 1, 30, tzinfo=tz)
+        assert gap.utcoffset() == datetime.timedelta(0)
+        assert gap.replace(fold=1).utcoffset() == datetime.timedelta(hours=1)
+
+    def test_day_start(self):
+        day = datetime.date(2026, 10, 19)
+        start = utils.day_start(day)
+        assert start.tzinfo is constants.CURRENT_TZ
+        assert start == datetime.datetime(2026, 10, 19, tzinfo=datetime.timezone.utc)
+        assert utils.dt_tomorrow() - utils.dt_today() == datetime.timedelta(days=1)
+
+
 class TestYewCal(unittest.TestCase):
     def setUp(self):
         self.username = TEST_USERNAME
@@ -162,6 +476,63 @@ class TestYewCal(unittest.TestCase):
             print(r)
             assert r.content == "ok"
 
+    def test_events_as_string_pads_minutes(self):
+        e = make_event("standup", "2020-12-03 09:05", "london")
+        assert notify.events_as_string([e]) == "09:05 standup\n"
+
+    def test_event_index(self):
+        index = EventIndex(reversed(self.events))
+        assert [e.dt for e in index] == sorted(e.dt for e in self.events)
+        today = utils.dt_today()
+        assert index.between(today, today + datetime.timedelta(days=1)) == [
+            self.events[3]
+        ]
+        assert index.get(self.events[1].uid) is self.events[1]
+        assert index.get_external("my_external_id") is self.events[0]
+        e = make_event("new", "in two days")
+        index.add(e)
+        assert index.between(e.dt, e.dt + datetime.timedelta(seconds=1)) == [e]
+        index.remove(self.events[0].uid)
+        assert len(index) == self.event_count
+        assert not index.get_external("my_external_id")
+
+    def test_compute_digests(self):
+        events = self.events + [make_event("later today", "today")]
+        events[-1].user = "someone_else"
+        windows = digest.get_windows(["today", "week"], utils.dt_today())
+        digests = digest.compute_digests(EventIndex(events), windows)
+        assert len(digests[None]["today"]) == 2
+        assert len(digests[None]["week"]) == 3
+        assert len(digests["someone_else"]["today"]) == 1
+        text, html = digest.render(windows, digests["someone_else"])
+        assert "later today" in text
+        assert "<li>" in html and "No events" in html
+
+    def test_send_digests(self):
+        context = dict(self.context)
+        context["DIGEST_CHANNELS"] = ["email", "slack", "sms"]
+        context["DIGEST_RECIPIENTS"] = [
+            {"user": None, "email": "a@example.com", "slack_channel": "#a"},
+            {"user": None, "email": "b@example.com", "mobile": "+441"},
+            {"user": "bob", "email": "bob@example.com"},
+        ]
+        with mock.patch("requests.post") as requests_post, mock.patch(
+            "services.twilio.Client"
+        ):
+            requests_post.return_value = types.SimpleNamespace(
+                status_code=200, content="ok", json=lambda: {"ok": True}
+            )
+            results = digest.send_digests(context, EventIndex(self.events))
+        channels = sorted((d.user or "", d.channel) for d in results)
+        assert channels == [
+            ("", "email"),
+            ("", "slack"),
+            ("", "sms"),
+            ("bob", "email"),
+        ]
+        # recipients of the same user share one email
+        assert results[0].target == ["a@example.com", "b@example.com"]
+
     def test_notify_impending_events(self):
         with mock.patch("requests.post") as requests_post:
             requests_post.return_value = types.SimpleNamespace(
@@ -169,15 +540,492 @@ class TestYewCal(unittest.TestCase):
             )
             notify.notify_impending_events(self.context, minutes=10000)
 
+    def test_notify_impending_events_coalesced(self):
+        events = [make_event("a", "in 5 minutes"), make_event("b", "in 5 minutes")]
+        events[1].dt = events[0].dt
+        write_events(self.events_data_path, events)
+        with mock.patch("requests.post") as requests_post:
+            requests_post.return_value = types.SimpleNamespace(
+                status_code=200, content="ok"
+            )
+            notify.notify_impending_events(self.context, minutes=10)
+        assert requests_post.call_count == 1
+        assert requests_post.call_args[0][1]["text"].count(" at ") == 2
+
     def test_twilio(self):
         with mock.patch("services.twilio.Client"):
             twilio.send_sms(self.context, "my message")
 
-    @mock.patch("sync.get_s3")
-    @mock.patch("sync.arrow.get")
-    def test_get_event_data(self, mock_arrow_get, mock_get_s3):
-        mock_arrow_get.return_value = datetime.datetime.now()
-        sync.get_event_data(self.context)
+    def test_get_event_data(self):
+        remote = os.path.join(os.path.dirname(self.events_data_path), "remote")
+        context = dict(self.context, BUCKET=remote, USERNAME="someone")
+        fs = fsspec.filesystem("file", auto_mkdir=True)
+        with mock.patch("sync.get_s3", return_value=fs):
+            # nothing remote yet
+            report = sync.get_event_data(context)
+            assert not any(report)
+            assert len(read_events(self.events_data_path)) == self.event_count
+
+    def test_merge_events(self):
+        base = self.events
+        local = [e.copy() for e in base]
+        remote = [e.copy() for e in base]
+        local[0].summary = "changed locally"
+        remote[1].summary = "changed remotely"
+        del remote[2]
+        remote.append(make_event("added remotely", "tomorrow"))
+        local[3].summary = "both changed, local later"
+        remote[2].summary = "both changed, remote earlier"
+        local[3].updated = remote[2].updated + datetime.timedelta(seconds=1)
+        merged, report = merge.merge_events(base, local, remote)
+        merged = {e.uid: e for e in merged}
+        assert merged[base[0].uid].summary == "changed locally"
+        assert merged[base[1].uid].summary == "changed remotely"
+        assert base[2].uid not in merged
+        assert merged[base[3].uid].summary == "both changed, local later"
+        assert report.added == [remote[-1].uid]
+        assert report.updated == [base[1].uid]
+        assert report.removed == [base[2].uid]
+        assert report.conflicts == [base[3].uid]
+
+    def test_changeset(self):
+        new = [e.copy() for e in self.events[1:]]
+        new[0].summary = "changed"
+        new.append(make_event("added", "tomorrow"))
+        changes = merge.changeset(self.events, new)
+        assert len(changes["upserts"]) == 2
+        assert changes["removed"] == [self.events[0].uid]
+        applied = merge.apply_changeset(self.events, changes)
+        assert sorted(e.uid for e in applied) == sorted(e.uid for e in new)
+        assert merge.is_empty(merge.changeset(new, applied))
+
+    def test_sync_merge(self):
+        base_data_path = os.path.dirname(self.events_data_path)
+        remote = os.path.join(base_data_path, "remote")
+        laptop = dict(self.context, BUCKET=remote, USERNAME="someone")
+        server = dict(laptop)
+        server["events_data_path"] = os.path.join(
+            base_data_path, "server", "events.json"
+        )
+        fs = fsspec.filesystem("file", auto_mkdir=True)
+        with mock.patch("sync.get_s3", return_value=fs):
+            sync.push_event_data(laptop)
+            report = sync.get_event_data(server)
+            assert len(report.added) == self.event_count
+            # concurrent edits on both sides are merged, not overwritten
+            upsert_event(
+                server["events_data_path"],
+                make_event("server event", "tomorrow"),
+                read_events(server["events_data_path"]),
+            )
+            sync.push_event_data(server)
+            upsert_event(
+                self.events_data_path,
+                make_event("laptop event", "tomorrow"),
+                self.events,
+            )
+            with mock.patch.object(fs, "cat", wraps=fs.cat) as cat:
+                report = sync.get_event_data(laptop)
+            # only the new changeset was downloaded, not the full file
+            downloaded = [c[0][0].rsplit("/", 1)[-1] for c in cat.call_args_list]
+            assert len(downloaded) == 1
+            assert downloaded[0].startswith("0000000002-")
+            assert len(report.added) == 1
+            summaries = {e.summary for e in read_events(self.events_data_path)}
+            assert {"server event", "laptop event"} <= summaries
+            sync.push_event_data(laptop)
+            sync.get_event_data(server)
+            assert len(read_events(server["events_data_path"])) == self.event_count + 2
+
+    def sync_clients(self, **extra):
+        base_data_path = os.path.dirname(self.events_data_path)
+        laptop = dict(
+            self.context,
+            BUCKET=os.path.join(base_data_path, "remote"),
+            USERNAME="someone",
+            **extra,
+        )
+        server = dict(laptop)
+        server["events_data_path"] = os.path.join(
+            base_data_path, "server", "events.json"
+        )
+        return laptop, server
+
+    def test_sync_concurrent_push(self):
+        laptop, server = self.sync_clients()
+        fs = fsspec.filesystem("file", auto_mkdir=True)
+        pull_changes = sync.pull_changes
+        stale = list()
+
+        def stale_pull(context):
+            # the server's pull ran before the laptop pushed
+            if context is server and not stale:
+                stale.append(context)
+                return merge.MergeReport(list(), list(), list(), list())
+            return pull_changes(context)
+
+        with mock.patch("sync.get_s3", return_value=fs):
+            sync.push_event_data(laptop)
+            sync.get_event_data(server)
+            upsert_event(
+                self.events_data_path,
+                make_event("laptop event", "tomorrow"),
+                self.events,
+            )
+            sync.push_event_data(laptop)
+            upsert_event(
+                server["events_data_path"],
+                make_event("server event", "tomorrow"),
+                read_events(server["events_data_path"]),
+            )
+            with mock.patch("sync.pull_changes", side_effect=stale_pull):
+                sync.push_event_data(server)
+            # both pushes from the same base are kept
+            names = sync.remote_changesets(fs, laptop)
+            assert [sync.changes_seq(n) for n in names] == [1, 2, 2]
+            remote = parse_events(fs.cat(sync.remote_path(laptop)).decode())
+            assert {"laptop event", "server event"} <= {e.summary for e in remote}
+            summaries = {e.summary for e in read_events(server["events_data_path"])}
+            assert {"laptop event", "server event"} <= summaries
+            report = sync.get_event_data(laptop)
+            assert len(report.added) == 1
+            assert len(read_events(self.events_data_path)) == self.event_count + 2
+
+    def test_sync_prune_changesets(self):
+        laptop, server = self.sync_clients(SYNC_KEEP_CHANGESETS=1)
+        fs = fsspec.filesystem("file", auto_mkdir=True)
+        with mock.patch("sync.get_s3", return_value=fs):
+            sync.push_event_data(laptop)
+            sync.get_event_data(server)
+            for summary in ("first", "second"):
+                upsert_event(
+                    self.events_data_path,
+                    make_event(summary, "tomorrow"),
+                    read_events(self.events_data_path),
+                )
+                sync.push_event_data(laptop)
+            names = sync.remote_changesets(fs, laptop)
+            assert [sync.changes_seq(n) for n in names] == [3]
+            # the server missed a pruned changeset and reads the full file
+            with mock.patch.object(fs, "cat", wraps=fs.cat) as cat:
+                report = sync.get_event_data(server)
+            assert [c[0][0] for c in cat.call_args_list] == [sync.remote_path(laptop)]
+            assert len(report.added) == 2
+
+    def test_parse_datetime(self):
+        # plain iso dates and times take the fast path
+        with mock.patch("dateparser.parse") as parse:
+            assert parse_datetime("2030-12-12") == datetime.datetime(2030, 12, 12)
+            assert parse_datetime("2030-12-12 09:30") == datetime.datetime(
+                2030, 12, 12, 9, 30
+            )
+            assert parse_datetime("2030-12-12T09:30:00+01:00").utcoffset() == (
+                datetime.timedelta(hours=1)
+            )
+            assert not parse.called
+        # other input is read by dateparser as before
+        for s in ("20301212", "2030W01", "tomorrow"):
+            with mock.patch("dateparser.parse") as parse:
+                parse_datetime(s)
+                parse.assert_called_once_with(s)
+
+    def test_next_occurrence(self):
+        e = make_event("weekly", "2020-10-20 09:00", "london")
+        e.repeats = Repeats.WEEKLY
+        after = make_event("x", "2020-11-01 12:00", "london").dt
+        occurrence = utils.next_occurrence(e, after)
+        # wall clock time is kept across the end of BST
+        assert occurrence.isoformat() == "2020-11-03T09:00:00+00:00"
+        e.repeats = Repeats.MONTHLY
+        assert utils.next_occurrence(e, after).date() == datetime.date(2020, 11, 20)
+        e.repeats = Repeats.UNIQUE
+        assert utils.next_occurrence(e, after) is None
+        assert utils.next_occurrence(e, e.dt) == e.dt
+
+    def test_parse_offset(self):
+        assert utils.parse_offset("5") == 5
+        assert utils.parse_offset("2h") == 120
+        assert utils.parse_offset("1d") == 1440
+        with self.assertRaises(ValueError):
+            utils.parse_offset("soon")
+
+    def test_reminder_timeline(self):
+        e = make_event("standup", "2020-10-20 09:00", "london")
+        e.repeats = Repeats.DAILY
+        e.reminders = [Reminder(minutes=60), Reminder(minutes=5, channel="sms")]
+        other = make_event("once", "2020-10-20 12:00", "london")
+        other.reminders = [Reminder(minutes=1440, channel="email")]
+        now = make_event("x", "2020-10-20 07:00", "london").dt
+        timeline = reminders.build_timeline([e, other], now)
+        assert len(timeline["heap"]) == 3
+        by_uid = {e.uid: e, other.uid: other}
+        # the day-before reminder for "once" is late but still useful
+        due = reminders.pop_due(timeline, now, by_uid)
+        assert [(d[0].summary, d[2]) for d in due] == [("once", "email")]
+        assert not reminders.pop_due(timeline, now, by_uid)
+        due = reminders.pop_due(timeline, now + datetime.timedelta(hours=1), by_uid)
+        assert [(d[0].summary, d[2]) for d in due] == [("standup", "slack")]
+        due = reminders.pop_due(timeline, now + datetime.timedelta(hours=2), by_uid)
+        assert [(d[0].summary, d[2]) for d in due] == [("standup", "sms")]
+        # repeating reminders are rescheduled for the next day
+        next_fire = reminders.next_fire_time(timeline)
+        assert next_fire == e.dt + datetime.timedelta(days=1, hours=-1)
+        e.reminders = None
+        reminders.update_events(timeline, [e], now)
+        assert not timeline["heap"]
+
+    def test_parse_reminder(self):
+        assert reminders.parse_reminder("5m:sms") == Reminder(minutes=5, channel="sms")
+        assert reminders.parse_reminder("1h").channel == "slack"
+        with self.assertRaises(ValueError):
+            reminders.parse_reminder("5m:pager")
+
+    def test_remind_unknown_channel(self):
+        e = make_event("standup", "in 10 minutes")
+        e.reminders = [Reminder(minutes=15, channel="pager")]
+        upsert_event(self.events_data_path, e, self.events)
+        with mock.patch("notify.notify_macos") as notify_macos:
+            count = notify.notify_reminders(dict(self.context))
+        assert count == 0
+        assert not notify_macos.called
+
+    def test_update_timeline_stale(self):
+        e = make_event("standup", "in 10 minutes")
+        e.reminders = [Reminder(minutes=15)]
+        # the timeline was built before an event arrived from outside
+        reminders.load_timeline(
+            os.path.dirname(self.events_data_path),
+            self.events_data_path,
+            self.events,
+            datetime.datetime.now(datetime.timezone.utc),
+        )
+        events = self.events + [e]
+        write_events(self.events_data_path, events)
+        upsert_event(self.events_data_path, make_event("other", "tomorrow"), events)
+        with mock.patch("notify.notify_macos"), mock.patch(
+            "requests.post"
+        ) as requests_post:
+            requests_post.return_value = types.SimpleNamespace(
+                status_code=200, content="ok"
+            )
+            assert notify.notify_reminders(dict(self.context)) == 1
+
+    def test_reminder_daemon_reload(self):
+        context = dict(self.context)
+        sleeps = list()
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 3:
+                raise StopIteration
+
+        with mock.patch("time.sleep", side_effect=sleep), mock.patch(
+            "notify.read_events", wraps=notify.read_events
+        ) as read:
+            with self.assertRaises(StopIteration):
+                notify.run_reminder_daemon(context)
+        # the events file did not change between runs
+        assert read.call_count == 1
+
+    def test_remind(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            cli,
+            [
+                f"--user={self.username}",
+                "create",
+                "soon",
+                "in 10 minutes",
+                "--remind",
+                "15m",
+                "-r",
+                "1d:sms",
+            ],
+        )
+        assert result.exit_code == 0
+        event = [e for e in read_events(self.events_data_path) if e.summary == "soon"]
+        assert [r.minutes for r in event[0].reminders] == [15, 1440]
+        with mock.patch("requests.post") as requests_post, mock.patch(
+            "services.twilio.Client"
+        ) as client:
+            requests_post.return_value = types.SimpleNamespace(
+                status_code=200, content="ok"
+            )
+            result = runner.invoke(cli, [f"--user={self.username}", "remind"])
+            assert "Sent 2 reminders" in result.output
+            result = runner.invoke(cli, [f"--user={self.username}", "remind"])
+            assert "Sent 0 reminders" in result.output
+        assert requests_post.call_count == 1
+        assert client.return_value.messages.create.call_count == 1
+
+    def test_snapshot(self):
+        index = snapshot.load_index(self.events_data_path)
+        assert len(index) == self.event_count
+        assert os.path.exists(snapshot.snapshot_path(self.events_data_path))
+        with mock.patch("snapshot.parse_events") as parse_events:
+            index = snapshot.load_index(self.events_data_path)
+        assert not parse_events.called
+        assert [e.uid for e in index] == [
+            e.uid for e in sorted(self.events, key=lambda e: e.dt)
+        ]
+        assert index.get_external("my_external_id").summary == "event1"
+        # changed content invalidates the snapshot
+        write_events(self.events_data_path, self.events[:2])
+        assert len(snapshot.load_index(self.events_data_path)) == 2
+
+    def test_upsert_event_updates_snapshot(self):
+        index = snapshot.load_index(self.events_data_path)
+        events = list(index.events)
+        e = make_event("snapshot event", "in two days")
+        upsert_event(self.events_data_path, e, events, index)
+        with mock.patch("snapshot.parse_events") as parse_events:
+            index = snapshot.load_index(self.events_data_path)
+        assert not parse_events.called
+        assert index.get(e.uid).summary == "snapshot event"
+
+    def test_records(self):
+        path = os.path.join(os.path.dirname(self.events_data_path), "events.rec")
+        write_events(path, self.events)
+        events = read_events(path)
+        assert [e.uid for e in events] == [
+            e.uid for e in sorted(self.events, key=lambda e: e.dt)
+        ]
+        assert events[0].data is None
+        assert [e for e in events if e.data][0].data == {"mydata": "could be anything"}
+        start = utils.dt_today()
+        end = start + datetime.timedelta(days=1)
+        assert [e.summary for e in read_events(path, start, end)] == ["event4"]
+        with records.RecordFile(path) as rf:
+            assert len(rf) == self.event_count
+            assert rf.read(rf.bisect(start.timestamp())).summary == "event4"
+        write_events(path, [], allow_empty=True)
+        assert read_events(path) == []
+        with self.assertRaises(records.InvalidRecordFile):
+            records.RecordFile(self.events_data_path)
+
+    def test_records_format(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, [f"--user={self.username}", "convert", "records"])
+        assert result.exit_code == 0
+        settings_path = os.path.join(
+            os.path.dirname(self.events_data_path), constants.SETTINGS_FILENAME
+        )
+        with open(settings_path, "wt") as f:
+            f.write(json.dumps(dict(SETTINGS, EVENTS_FORMAT="records")))
+        result = runner.invoke(cli, [f"--user={self.username}", "today"])
+        assert result.exit_code == 0
+        assert len(result.output.strip().split("\n")) == 2
+        result = runner.invoke(
+            cli, [f"--user={self.username}", "create", "record event", "tomorrow"]
+        )
+        assert result.exit_code == 0
+        result = runner.invoke(cli, [f"--user={self.username}", "future"])
+        assert len(result.output.strip().split("\n")) == self.event_count + 2
+
+    def test_shards(self):
+        path = os.path.join(os.path.dirname(self.events_data_path), "events.d")
+        old_event = make_event("old event", "2019-06-01 10:00", "london")
+        write_events(path, self.events + [old_event])
+        manifest = shards.read_manifest(path)
+        assert "2019-06" in manifest["shards"]
+        assert sum(m["count"] for m in manifest["shards"].values()) == 5
+        assert len(read_events(path)) == 5
+        start = make_event("x", "2019-01-01", "london").dt
+        end = make_event("x", "2020-01-01", "london").dt
+        with mock.patch("shards.read_shard", wraps=shards.read_shard) as read_shard:
+            assert [e.uid for e in read_events(path, start, end)] == [old_event.uid]
+        assert read_shard.call_count == 1
+        # only the shards of the changed datetimes are rewritten
+        new_dt = make_event("x", "2019-08-01 10:00", "london").dt
+        changed = [old_event.dt, new_dt]
+        old_event.dt = new_dt
+        written = shards.write_shards(path, self.events + [old_event], changed)
+        assert written == ["2019-06", "2019-08"]
+        assert not os.path.exists(shards.shard_path(path, "2019-06"))
+        assert not shards.write_shards(path, self.events + [old_event])
+
+    def test_sharded_format(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, [f"--user={self.username}", "convert", "sharded"])
+        assert result.exit_code == 0
+        settings_path = os.path.join(
+            os.path.dirname(self.events_data_path), constants.SETTINGS_FILENAME
+        )
+        with open(settings_path, "wt") as f:
+            f.write(json.dumps(dict(SETTINGS, EVENTS_FORMAT="sharded")))
+        result = runner.invoke(
+            cli,
+            [f"--user={self.username}", "edit", self.events[1].uid],
+            input="\n\n\n\n\n\n\n",
+        )
+        assert result.exit_code == 0
+        result = runner.invoke(cli, [f"--user={self.username}", "future"])
+        assert len(result.output.strip().split("\n")) == self.event_count + 1
+
+    def test_sync_shards(self):
+        remote = os.path.join(os.path.dirname(self.events_data_path), "remote")
+        context = dict(self.context, BUCKET=remote, USERNAME="someone")
+        context["events_data_path"] = os.path.join(
+            os.path.dirname(self.events_data_path), "events.d"
+        )
+        write_events(context["events_data_path"], self.events)
+        fs = fsspec.filesystem("file", auto_mkdir=True)
+        with mock.patch("sync.get_s3", return_value=fs):
+            assert sync.push_event_data(context)
+            assert not sync.push_event_data(context)
+            other = dict(context)
+            other["events_data_path"] = os.path.join(remote, "clone.d")
+            assert sync.get_event_data(other)
+            assert len(read_events(other["events_data_path"])) == self.event_count
+            write_events(
+                context["events_data_path"],
+                self.events + [make_event("x", "2019-06-01 10:00", "london")],
+            )
+            assert sync.push_event_data(context) == ["2019-06"]
+            assert sync.get_event_data(other) == ["2019-06"]
+            assert len(read_events(other["events_data_path"])) == self.event_count + 1
+
+    def test_sync_shards_merge(self):
+        laptop, server = self.sync_clients()
+        base_data_path = os.path.dirname(self.events_data_path)
+        laptop["events_data_path"] = os.path.join(base_data_path, "events.d")
+        server["events_data_path"] = os.path.join(base_data_path, "server", "events.d")
+        first = make_event("first", "2019-06-01 10:00", "london")
+        write_events(laptop["events_data_path"], [first])
+        fs = fsspec.filesystem("file", auto_mkdir=True)
+        with mock.patch("sync.get_s3", return_value=fs):
+            sync.push_event_data(laptop)
+            sync.get_event_data(server)
+            # a local edit survives a pull of an unchanged remote
+            local = [first, make_event("local", "2019-06-02 10:00", "london")]
+            write_events(laptop["events_data_path"], local)
+            assert sync.get_event_data(laptop) == []
+            assert len(read_events(laptop["events_data_path"])) == 2
+            # edits of the same shard on both sides are merged per event
+            write_events(
+                server["events_data_path"],
+                [first, make_event("remote", "2019-06-03 10:00", "london")],
+            )
+            sync.push_event_data(server)
+            assert sync.get_event_data(laptop) == ["2019-06"]
+            summaries = {e.summary for e in read_events(laptop["events_data_path"])}
+            assert summaries == {"first", "local", "remote"}
+            sync.push_event_data(laptop)
+            sync.get_event_data(server)
+            assert len(read_events(server["events_data_path"])) == 3
+            # a push does not overwrite shards pushed after its pull
+            write_events(
+                laptop["events_data_path"],
+                local + [make_event("late", "2019-06-04 10:00", "london")],
+            )
+            write_events(server["events_data_path"], [first])
+            sync.push_event_data(server)
+            with mock.patch("sync.get_shards"):
+                with self.assertRaises(sync.SyncError):
+                    sync.push_event_data(laptop)
+            sync.push_event_data(laptop)
+            summaries = {e.summary for e in read_events(laptop["events_data_path"])}
+            assert summaries == {"first", "late"}
 
     def test_get_event(self):
         # use short form of uuid
@@ -248,6 +1096,44 @@ class TestYewCal(unittest.TestCase):
         assert len(result.output.strip().split("\n")) == (self.event_count + 1)
         assert result.exit_code == 0
 
+    def test_future_jsonl(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            cli,
+            [f"--user={self.username}", "future", "--format", "jsonl"],
+        )
+        assert result.exit_code == 0
+        rows = [json.loads(line) for line in result.output.strip().split("\n")]
+        assert len(rows) == self.event_count
+        assert set(rows[0]) == set(output.DEFAULT_FIELDS)
+        assert rows[0]["duration"] == 3600.0
+
+    def test_all_csv_fields(self):
+        runner = CliRunner()
+        for fmt, delimiter in (("csv", ","), ("tsv", "\t")):
+            result = runner.invoke(
+                cli,
+                [
+                    f"--user={self.username}",
+                    "all",
+                    "-f",
+                    fmt,
+                    "--fields",
+                    "uid,summary,external_id",
+                ],
+            )
+            assert result.exit_code == 0
+            lines = result.output.strip().split("\n")
+            assert lines[0] == delimiter.join(["uid", "summary", "external_id"])
+            assert len(lines) == self.event_count + 1
+
+    def test_unknown_field(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            cli, [f"--user={self.username}", "today", "-f", "csv", "--fields", "nope"]
+        )
+        assert result.exit_code != 0
+
     def test_today(self):
         runner = CliRunner()
         result = runner.invoke(
@@ -271,6 +1157,28 @@ class TestYewCal(unittest.TestCase):
         )
         assert result.exit_code == 0
 
+    def test_cal_months(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, [f"--user={self.username}", "cal", "12"])
+        assert result.exit_code == 0
+        today = datetime.date.today()
+        year, month = calview.add_months(today.year, today.month, 11)
+        assert f"{calendar.month_name[month]} {year}" in result.output
+
+    def test_day_histogram(self):
+        events = [
+            make_event("a", "2020-12-03 10:00", "london"),
+            make_event("b", "2020-12-03 11:00", "london"),
+            make_event("c", "2020-12-05 11:00", "london"),
+        ]
+        counts = calview.day_histogram(events)
+        assert counts[datetime.date(2020, 12, 3)] == 2
+        lines = calview.format_month(2020, 12, counts)
+        assert lines[0].strip() == "December 2020"
+        assert len(lines) == 8
+        assert " 3·2" in "".join(lines)
+        assert calview.add_months(2020, 12, 1) == (2021, 1)
+
     def test_describe(self):
         runner = CliRunner()
         result = runner.invoke(
@@ -325,6 +1233,465 @@ class TestYewCal(unittest.TestCase):
         )
         assert result.exit_code == 0
 
+    def test_archive_events(self):
+        base_data_path = os.path.dirname(self.events_data_path)
+        old_event = make_event("old event", "2019-06-01 10:00", "london")
+        older_event = make_event("older event", "2018-03-01 10:00", "london")
+        events = self.events + [old_event, older_event]
+        before = make_event("cutoff", "2020-01-01", "london").dt
+        hot, count = archive.archive_events(
+            self.events_data_path, base_data_path, events, before
+        )
+        assert count == 2
+        assert len(hot) == self.event_count
+        assert len(read_events(self.events_data_path)) == self.event_count
+        assert archive.list_segments(base_data_path) == ["2018", "2019"]
+        archived = archive.read_archived_events(base_data_path, start=before)
+        assert not archived
+        archived = archive.read_archived_events(
+            base_data_path, start=make_event("x", "2019-01-01", "london").dt
+        )
+        assert [e.uid for e in archived] == [old_event.uid]
+        # archiving again is idempotent
+        archive.archive_events(self.events_data_path, base_data_path, events, before)
+        assert len(archive.read_archived_events(base_data_path)) == 2
+
+    def test_archive(self):
+        write_events(
+            self.events_data_path,
+            self.events + [make_event("old event", "2019-06-01 10:00", "london")],
+        )
+        runner = CliRunner()
+        result = runner.invoke(
+            cli, [f"--user={self.username}", "archive", "--before", "2020-01-01"]
+        )
+        assert result.exit_code == 0
+        assert "Archived 1 events" in result.output
+        assert len(read_events(self.events_data_path)) == self.event_count
+        result = runner.invoke(cli, [f"--user={self.username}", "all"])
+        assert len(result.output.strip().split("\n")) == (self.event_count + 2)
+
+    def test_search_index(self):
+        event = make_event(
+            "Planning meeting",
+            "tomorrow",
+            data={
+                "conferenceData": {
+                    "entryPoints": [{"uri": "https://meet.example.com/abc-xyz"}]
+                }
+            },
+        )
+        index = search.build_index(self.events + [event])
+        assert [uid for uid, _ in search.search(index, "MEETING")] == [event.uid]
+        assert [uid for uid, _ in search.search(index, "meet example")] == [event.uid]
+        assert not search.search(index, "planning nothing")
+        assert not search.search(
+            index, "planning", start=make_event("x", "in 3 days").dt
+        )
+        event.summary = "Retrospective"
+        search.add_event(index, event)
+        assert not search.search(index, "planning")
+        assert search.search(index, "retrospective")
+        search.remove_event(index, event.uid)
+        assert not search.search(index, "retrospective")
+        assert "retrospective" not in index["postings"]
+
+    def test_search_ranking(self):
+        in_summary = make_event("budget", "tomorrow")
+        in_data = make_event("other", "tomorrow", data={"notes": "budget"})
+        index = search.build_index([in_data, in_summary])
+        assert [uid for uid, _ in search.search(index, "budget")] == [
+            in_summary.uid,
+            in_data.uid,
+        ]
+
+    def test_search(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, [f"--user={self.username}", "search", "event1"])
+        assert result.exit_code == 0
+        assert len(result.output.strip().split("\n")) == 2
+        # upsert updates the persisted index incrementally
+        base_data_path = os.path.dirname(self.events_data_path)
+        upsert_event(self.events_data_path, make_event("zebra", "today"), self.events)
+        index = search.read_index(base_data_path)
+        assert index["signature"] == search.file_signature(self.events_data_path)
+        result = runner.invoke(cli, [f"--user={self.username}", "search", "zebra"])
+        assert len(result.output.strip().split("\n")) == 2
+
+    def test_search_indexes(self):
+        old = make_event("budget review", "2019-06-01 10:00", "london")
+        new = make_event("budget", "tomorrow", data={"notes": "review"})
+        events = self.events + [new]
+        combined = search.search(search.build_index(events + [old]), "budget")
+        split = search.search_indexes(
+            [search.build_index(events), search.build_index([old])], "budget"
+        )
+        # scores are the same as if all events were in one index
+        assert dict(split) == dict(combined)
+
+    def test_search_archive(self):
+        write_events(
+            self.events_data_path,
+            self.events + [make_event("zebra crossing", "2019-06-01 10:00", "london")],
+        )
+        runner = CliRunner()
+        runner.invoke(
+            cli, [f"--user={self.username}", "archive", "--before", "2020-01-01"]
+        )
+        result = runner.invoke(cli, [f"--user={self.username}", "search", "zebra"])
+        assert result.exit_code == 0
+        assert "zebra crossing" in result.output
+        result = runner.invoke(
+            cli, [f"--user={self.username}", "search", "zebra", "--start", "2020-01-01"]
+        )
+        assert "zebra crossing" not in result.output
+
+    def test_search_after_archive(self):
+        write_events(
+            self.events_data_path,
+            self.events + [make_event("old zebra", "2019-06-01 10:00", "london")],
+        )
+        runner = CliRunner()
+        user = f"--user={self.username}"
+        result = runner.invoke(cli, [user, "search", "zebra"])
+        assert result.output.count("old zebra") == 1
+        runner.invoke(cli, [user, "archive", "--before", "2020-01-01"])
+        index = search.read_index(os.path.dirname(self.events_data_path))
+        assert index["signature"] == search.file_signature(self.events_data_path)
+        result = runner.invoke(cli, [user, "create", "other", "tomorrow"])
+        assert result.exit_code == 0
+        result = runner.invoke(cli, [user, "search", "zebra"])
+        assert result.exit_code == 0
+        assert result.output.count("old zebra") == 1
+
+    def test_update_index_stale(self):
+        base_data_path = os.path.dirname(self.events_data_path)
+        search.load_index(base_data_path, self.events_data_path, self.events)
+        # the events file changed without updating the index
+        events = self.events[1:]
+        write_events(self.events_data_path, events)
+        zebra = make_event("zebra", "today")
+        upsert_event(self.events_data_path, zebra, events)
+        # the stale index is not marked as current
+        index = search.read_index(base_data_path)
+        assert index["signature"] != search.file_signature(self.events_data_path)
+        index = search.load_index(base_data_path, self.events_data_path, events)
+        assert self.events[0].uid not in index["docs"]
+        assert zebra.uid in index["docs"]
+
+    def test_write_events_format(self):
+        self.events[0].reminders = [Reminder(minutes=5)]
+        self.events[0].summary = 'caf\u00e9 "quoted"'
+        self.events[1].data = {"when": datetime.date(2020, 1, 1), 1: [1.5, None]}
+        write_events(self.events_data_path, self.events)
+        expected = json.dumps([json.loads(e.json()) for e in self.events])
+        with open(self.events_data_path) as f:
+            assert f.read() == expected
+        assert encoding.dumps_events([]) == b"[]"
+
+    def test_write_events_orjson(self):
+        encoding.encoder = "orjson"
+        try:
+            write_events(self.events_data_path, self.events)
+        finally:
+            encoding.encoder = "json"
+        events = read_events(self.events_data_path)
+        assert [e.dict() for e in events] == [e.dict() for e in self.events]
+
+    def run_query(self, expr):
+        return query.run(
+            expr,
+            EventIndex(self.events),
+            lambda: search.build_index(self.events),
+            parse_datetime_arg,
+        )
+
+    def test_query_plan(self):
+        r = self.run_query("external_id:my_external_id")
+        assert r.plan.access.kind == "external_id"
+        assert r.examined == 1 and r.events == [self.events[0]]
+
+        later = sorted(self.events, key=lambda e: e.dt)[2:]
+        r = self.run_query(f'summary:event after:"{later[0].dt.isoformat()}"')
+        assert r.plan.access.kind == "interval"
+        assert r.examined == 2 and r.events == later
+
+        # the rarest text term is cheaper than the interval
+        r = self.run_query(f'after:"{self.events[3].dt.isoformat()}" event2')
+        assert r.plan.access.kind == "text"
+        assert r.examined == 1 and r.events == [self.events[1]]
+
+        r = self.run_query("text:event2 or external_id:my_external_id")
+        assert r.plan.access.kind == "union"
+        assert {e.uid for e in r.events} == {self.events[0].uid, self.events[1].uid}
+
+        r = self.run_query("text:event2 or has:external_id")
+        assert r.plan.access.kind == "scan"
+        assert r.examined == self.event_count and len(r.events) == 2
+
+        r = self.run_query("not (tz:london or repeats:weekly) and summary:EVENT")
+        assert r.plan.access.kind == "scan"
+        assert self.events[0] not in r.events and len(r.events) == 3
+        assert "examined 4, matched 3" in query.explain(r)
+
+    def test_query_errors(self):
+        for expr in ("unknown:x", "(summary:x", "repeats:sometimes", "or", "on:xyz"):
+            with self.assertRaises(query.QueryError):
+                self.run_query(expr)
+
+    def test_query(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            cli,
+            [f"--user={self.username}", "query", "summary:event", "-f", "jsonl"],
+        )
+        assert result.exit_code == 0
+        assert len(result.output.strip().split("\n")) == self.event_count
+        result = runner.invoke(
+            cli, [f"--user={self.username}", "query", "has:source", "--explain"]
+        )
+        assert result.exit_code == 0
+        assert "scan all events (~4 events)" in result.output
+        assert "event1" in result.output
+        result = runner.invoke(cli, [f"--user={self.username}", "query", "repeats:x"])
+        assert result.exit_code == 2
+
+    def test_parse_ics(self):
+        lines = ics_feed().splitlines(keepends=True)
+        events = list(feeds.parse_ics(iter(lines), "cal.ics", default_tz="UTC"))
+        assert [e.summary for e in events] == [
+            "Board meeting, room 1",
+            "Christmas",
+            "Call",
+        ]
+        meeting, holiday, call = events
+        assert meeting.dt.isoformat() == "2026-10-19T10:00:00+01:00"
+        assert meeting.timezone == "Europe/London"
+        assert meeting.duration == datetime.timedelta(hours=1)
+        assert meeting.repeats == Repeats.WEEKLY
+        assert meeting.description == (
+            "Agenda:\n1. budget and a very long line that is folded over two lines"
+        )
+        assert meeting.source == "cal.ics" and meeting.external_id == "meeting-1"
+        assert holiday.duration == datetime.timedelta(days=1)
+        assert call.dt.isoformat() == "2026-10-20T08:00:00+00:00"
+        assert call.duration == datetime.timedelta(minutes=90)
+        # uids are stable across fetches
+        again = list(feeds.parse_ics(iter(lines), "cal.ics", default_tz="UTC"))
+        assert [e.uid for e in again] == [e.uid for e in events]
+
+    def test_subscribe_path(self):
+        base_data_path = os.path.dirname(self.events_data_path)
+        feed_path = os.path.join(base_data_path, "team.ics")
+        start = utils.dt_nowish(60).astimezone(pytz.timezone("Europe/London"))
+        with open(feed_path, "wt") as f:
+            f.write(ics_feed(start.replace(tzinfo=None)))
+        with open(self.events_data_path, "rb") as f:
+            events_json = f.read()
+
+        runner = CliRunner()
+        result = runner.invoke(cli, [f"--user={self.username}", "subscribe", feed_path])
+        assert result.exit_code == 0
+        assert f"{feed_path}: 3 events" in result.output
+        result = runner.invoke(cli, [f"--user={self.username}", "future"])
+        assert "Board meeting" in result.output
+        assert "event2" in result.output
+        with open(self.events_data_path, "rb") as f:
+            assert f.read() == events_json
+
+        # unchanged files are not parsed again
+        with mock.patch("feeds.parse_ics") as parse_ics:
+            assert feeds.refresh_all(base_data_path) == {feed_path: False}
+        assert not parse_ics.called
+        with open(feed_path, "a") as f:
+            f.write("\n")
+        assert feeds.refresh_all(base_data_path) == {feed_path: True}
+
+        result = runner.invoke(
+            cli, [f"--user={self.username}", "subscribe", feed_path, "--remove"]
+        )
+        assert result.exit_code == 0
+        result = runner.invoke(cli, [f"--user={self.username}", "future"])
+        assert "Board meeting" not in result.output
+
+    def test_subscribe_url(self):
+        base_data_path = os.path.dirname(self.events_data_path)
+        FeedHandler.requests = list()
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/team.ics"
+            feed, state = feeds.subscribe(base_data_path, url)
+            assert state["etag"] == '"v1"' and state["count"] == 3
+            with mock.patch("feeds.parse_ics") as parse_ics:
+                assert feeds.refresh_all(base_data_path) == {url: False}
+            assert not parse_ics.called
+            assert FeedHandler.requests[-1]["If-None-Match"] == '"v1"'
+            # not refreshed again within FEED_REFRESH_MINUTES
+            events = feeds.feed_events({"base_data_path": base_data_path})
+            assert len(FeedHandler.requests) == 2
+            assert {e.summary for e in events} == {
+                "Board meeting, room 1",
+                "Christmas",
+                "Call",
+            }
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def publish_context(self, target):
+        base_data_path = os.path.dirname(self.events_data_path)
+        return dict(self.context, base_data_path=base_data_path, PUBLISH_TARGET=target)
+
+    def test_publish(self):
+        base_data_path = os.path.dirname(self.events_data_path)
+        target = os.path.join(base_data_path, "public")
+        context = self.publish_context(target)
+        now = utils.dt_today()
+        published = publish.publish(context, self.events, now)
+        assert published.uploaded and published.events == self.event_count
+        with open(os.path.join(target, "calendar.ics")) as f:
+            parsed = list(feeds.parse_ics(f, target))
+        by_dt = sorted(self.events, key=lambda e: e.dt)
+        assert [e.summary for e in parsed] == [e.summary for e in by_dt]
+        assert [e.dt for e in parsed] == [e.dt.replace(microsecond=0) for e in by_dt]
+        with open(os.path.join(target, "calendar.json")) as f:
+            assert f.read() == encoding.dumps_events(by_dt).decode()
+
+        # unchanged content is not written again
+        assert not publish.publish(context, self.events, now).uploaded
+
+        # upserts only render the changed event
+        event = self.events[2].copy()
+        event.summary = "renamed"
+        with mock.patch("publish.render_ics", wraps=publish.render_ics) as render:
+            upsert_event(self.events_data_path, event, self.events)
+            published = publish.publish(context, self.events, now)
+        assert render.call_count == 1
+        assert published.uploaded
+        with open(os.path.join(target, "calendar.ics")) as f:
+            assert "SUMMARY:renamed" in f.read()
+
+        # events beyond the horizon are left out
+        context["PUBLISH_DAYS"] = 3
+        published = publish.publish(context, self.events, now)
+        assert published.events == 2
+
+    def test_publish_outside_edit(self):
+        base_data_path = os.path.dirname(self.events_data_path)
+        target = os.path.join(base_data_path, "public")
+        context = self.publish_context(target)
+        now = utils.dt_today()
+        publish.publish(context, self.events, now)
+        # an event added without upsert_event, then a regular upsert
+        pulled = make_event("pulled", "tomorrow")
+        events = self.events + [pulled]
+        write_events(self.events_data_path, events)
+        upsert_event(self.events_data_path, make_event("created", "tomorrow"), events)
+        publish.publish(context, events, now)
+        with open(os.path.join(target, "calendar.json")) as f:
+            summaries = {e["summary"] for e in json.load(f)}
+        assert {"pulled", "created"} <= summaries
+
+    def test_publish_rebuild(self):
+        context = self.publish_context("memory://published/cal")
+        now = utils.dt_today()
+        publish.publish(context, self.events, now)
+        # a change that bypassed upsert_event only renders what changed
+        self.events[0].summary = "pulled, with a comma"
+        self.events[0].updated = self.events[0].updated + datetime.timedelta(1)
+        self.events[1].repeats = Repeats.WEEKLY
+        self.events[1].dt -= datetime.timedelta(days=60)
+        self.events[1].updated = self.events[0].updated
+        write_events(self.events_data_path, self.events)
+        with mock.patch("publish.render_ics", wraps=publish.render_ics) as render:
+            published = publish.publish(context, self.events, now)
+        assert render.call_count == 2
+        # the repeating event started before the window but is still published
+        assert published.uploaded and published.events == self.event_count
+        fs = fsspec.filesystem("memory")
+        try:
+            ics = fs.cat("/published/cal/calendar.ics").decode()
+        finally:
+            fs.rm("/published", recursive=True)
+        assert "SUMMARY:pulled\\, with a comma" in ics
+        assert "RRULE:FREQ=WEEKLY" in ics
+
+    def test_publish_command(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, [f"--user={self.username}", "publish"])
+        assert result.exit_code == 1
+        assert "PUBLISH_TARGET" in result.output
+
+    def test_delete(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            cli, [f"--user={self.username}", "delete", self.events[1].uid, "--yes"]
+        )
+        assert result.exit_code == 0
+        events = read_events(self.events_data_path)
+        assert len(events) == self.event_count - 1
+        assert self.events[1].uid not in {e.uid for e in events}
+
+    def test_batch(self):
+        # build the persisted indexes so the batch has to maintain them
+        runner = CliRunner()
+        runner.invoke(cli, [f"--user={self.username}", "search", "event1"])
+        base_data_path = os.path.dirname(self.events_data_path)
+        operations = [
+            {"op": "create", "summary": "zebra crossing", "dt": "2030-01-02 10:00"},
+            {
+                "op": "create",
+                "summary": "remind me",
+                "dt": "2030-01-03",
+                "remind": ["1d"],
+            },
+            {
+                "op": "update",
+                "uid": self.events[1].uid,
+                "summary": "moved",
+                "dt": "2030-01-01 09:00",
+                "timezone": "london",
+            },
+            {"op": "delete", "external_id": "my_external_id"},
+            {"op": "delete", "uid": "no such event"},
+            {"op": "frobnicate"},
+        ]
+        stdin = "\n".join(json.dumps(op) for op in operations) + "\nnot json\n"
+        result = runner.invoke(cli, [f"--user={self.username}", "batch"], input=stdin)
+        assert result.exit_code == 1
+        results = [json.loads(line) for line in result.output.strip().split("\n")]
+        assert [r["ok"] for r in results] == [True] * 4 + [False] * 3
+        assert results[4]["error"].startswith("event not found")
+        assert results[6]["line"] == 7
+
+        events = {e.uid: e for e in read_events(self.events_data_path)}
+        assert len(events) == self.event_count + 1
+        assert self.events[0].uid not in events
+        moved = events[self.events[1].uid]
+        assert moved.summary == "moved"
+        assert moved.timezone == "Europe/London"
+        assert moved.dt.isoformat() == "2030-01-01T09:00:00+00:00"
+        assert events[results[1]["uid"]].reminders[0].minutes == 1440
+
+        index = search.read_index(base_data_path)
+        assert index["signature"] == search.file_signature(self.events_data_path)
+        assert set(index["docs"]) == set(events)
+        assert snapshot.load_index(self.events_data_path).get(results[0]["uid"])
+
+    def test_batch_update_is_atomic(self):
+        index = EventIndex(self.events)
+        uid = self.events[2].uid
+        results, changes = batch.apply_operations(
+            index,
+            [(1, {"op": "update", "uid": uid, "summary": "x", "repeats": "sometimes"})],
+            make_event,
+        )
+        assert results[0].error == "invalid repeats: sometimes"
+        assert not changes
+        assert index.get(uid).summary == "event3"
+
     # notify-soon
     # notify-today
     # pull-events
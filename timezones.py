@@ -0,0 +1,183 @@
+"""Cached UTC offset tables and batch conversion to local time.
+
+Each zone's transitions are read once from pytz and kept as parallel
+lists, so converting a datetime is a bisect plus an `astimezone` to a
+shared fixed-offset `datetime.timezone`.
+"""
+
+import os
+import datetime
+import functools
+from bisect import bisect_right
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import pytz
+
+EPOCH = datetime.datetime(1970, 1, 1)
+LOCALTIME_PATH = "/etc/localtime"
+DAY = 86400
+
+
+class ZoneTable(NamedTuple):
+    name: str
+    transitions: List[float]  # utc timestamps, first is -inf
+    offsets: List[Tuple[int, int, str]]  # utcoffset seconds, dst seconds, tzname
+
+
+def _timestamp(naive_utc: datetime.datetime) -> float:
+    return (naive_utc - EPOCH).total_seconds()
+
+
+@functools.lru_cache(maxsize=None)
+def get_table(name: str) -> ZoneTable:
+    """Return the transition table for the zone `name`."""
+    tz = pytz.timezone(name)
+    if not hasattr(tz, "_utc_transition_times"):
+        now = datetime.datetime(2000, 1, 1)
+        info = (
+            int(tz.utcoffset(now).total_seconds()),
+            int((tz.dst(now) or datetime.timedelta(0)).total_seconds()),
+            tz.tzname(now),
+        )
+        return ZoneTable(name, [float("-inf")], [info])
+    transitions = [float("-inf")] + [
+        _timestamp(t) for t in tz._utc_transition_times[1:]
+    ]
+    offsets = [
+        (int(offset.total_seconds()), int(dst.total_seconds()), tzname)
+        for offset, dst, tzname in tz._transition_info
+    ]
+    return ZoneTable(name, transitions, offsets)
+
+
+@functools.lru_cache(maxsize=None)
+def fixed_timezone(seconds: int, tzname: str) -> datetime.timezone:
+    return datetime.timezone(datetime.timedelta(seconds=seconds), tzname)
+
+
+def lookup(table: ZoneTable, ts: float) -> Tuple[int, int, str]:
+    """Return (offset, dst, tzname) in effect at utc timestamp `ts`."""
+    return table.offsets[bisect_right(table.transitions, ts) - 1]
+
+
+def to_local(dt: datetime.datetime, name: str) -> datetime.datetime:
+    """Convert an aware datetime to zone `name`."""
+    return to_local_many([dt], name)[0]
+
+
+def to_local_many(dts: Iterable[datetime.datetime], name: str):
+    """Convert aware datetimes to zone `name` in one pass.
+
+    Sorted input, the usual case, walks the transition table instead
+    of bisecting it for every datetime.
+    """
+    table = get_table(name)
+    transitions = table.transitions
+    last = len(transitions) - 1
+    result = list()
+    i = 0
+    prev = float("-inf")
+    for dt in dts:
+        ts = dt.timestamp()
+        if ts < prev:
+            i = bisect_right(transitions, ts) - 1
+        else:
+            while i < last and transitions[i + 1] <= ts:
+                i += 1
+        prev = ts
+        offset, _, tzname = table.offsets[i]
+        result.append(dt.astimezone(fixed_timezone(offset, tzname)))
+    return result
+
+
+def convert_many(dts: Iterable[datetime.datetime], tz: datetime.tzinfo):
+    """Convert aware datetimes to `tz`, using the cached table if possible."""
+    if isinstance(tz, TableTimezone):
+        return to_local_many(dts, tz.name)
+    return [dt.astimezone(tz) for dt in dts]
+
+
+class TableTimezone(datetime.tzinfo):
+    """A tzinfo backed by a cached transition table.
+
+    Unlike a fixed offset taken at import time this stays correct
+    across DST changes in long running processes, and unlike pytz
+    zones it can be passed as `tzinfo=` directly.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.table = get_table(name)
+
+    def _info(self, dt):
+        # offsets in effect a day either side; zones never change twice a day
+        wall = _timestamp(dt.replace(tzinfo=None))
+        before = lookup(self.table, wall - DAY)
+        after = lookup(self.table, wall + DAY)
+        before_valid = lookup(self.table, wall - before[0])[0] == before[0]
+        after_valid = lookup(self.table, wall - after[0])[0] == after[0]
+        # PEP 495: an ambiguous or missing wall time takes the offset
+        # from before the transition unless fold is set
+        if before_valid != after_valid:
+            return before if before_valid else after
+        return after if dt.fold else before
+
+    def utcoffset(self, dt):
+        if dt is None:
+            return None
+        return datetime.timedelta(seconds=self._info(dt)[0])
+
+    def dst(self, dt):
+        if dt is None:
+            return None
+        return datetime.timedelta(seconds=self._info(dt)[1])
+
+    def tzname(self, dt):
+        if dt is None:
+            return self.name
+        return self._info(dt)[2]
+
+    def fromutc(self, dt):
+        ts = _timestamp(dt.replace(tzinfo=None))
+        i = bisect_right(self.table.transitions, ts) - 1
+        offset = self.table.offsets[i][0]
+        local = dt + datetime.timedelta(seconds=offset)
+        # the repeated hour after clocks go back is the second occurrence
+        if i > 0:
+            repeated = self.table.offsets[i - 1][0] - offset
+            if ts < self.table.transitions[i] + repeated:
+                local = local.replace(fold=1)
+        return local
+
+    def __reduce__(self):
+        return TableTimezone, (self.name,)
+
+    def __repr__(self):
+        return f"TableTimezone({self.name!r})"
+
+    def __str__(self):
+        return self.name
+
+
+def local_zone_name() -> Optional[str]:
+    """Return the IANA name of the local zone if it can be determined."""
+    candidates = [os.environ.get("TZ", "").lstrip(":")]
+    try:
+        import tzlocal
+
+        candidates.append(tzlocal.get_localzone_name())
+    except Exception:
+        pass
+    try:
+        candidates.append(os.readlink(LOCALTIME_PATH).split("zoneinfo/", 1)[1])
+    except (OSError, IndexError):
+        pass
+    for name in candidates:
+        if name in pytz.all_timezones_set:
+            return name
+    return None
+
+
+def local_timezone() -> Optional[TableTimezone]:
+    name = local_zone_name()
+    return TableTimezone(name) if name else None
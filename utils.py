@@ -1,20 +1,36 @@
 import re
+import math
+import datetime
+import functools
+from typing import Optional, Tuple
 
 import arrow
+import pytz
 
 from constants import CURRENT_TZ
+from models import Repeats
 
 
 def dt_nowish(minutes):
-    return arrow.get(arrow.get().shift(minutes=minutes)).to(CURRENT_TZ)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (now + datetime.timedelta(minutes=minutes)).astimezone(CURRENT_TZ)
+
+
+@functools.lru_cache(maxsize=4)
+def day_start(day: datetime.date) -> datetime.datetime:
+    """Start of the utc `day` in the local timezone."""
+    return datetime.datetime.combine(
+        day, datetime.time(), tzinfo=datetime.timezone.utc
+    ).astimezone(CURRENT_TZ)
 
 
 def dt_today():
-    return arrow.get(arrow.get().date()).to(CURRENT_TZ)
+    return day_start(datetime.datetime.now(datetime.timezone.utc).date())
 
 
 def dt_tomorrow():
-    return arrow.get(arrow.get().date()).shift(days=1).to(CURRENT_TZ)
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    return day_start(today + datetime.timedelta(days=1))
 
 
 def is_uuid(uid):
@@ -33,3 +49,80 @@ def is_short_uuid(s):
 
 def get_short_uid(s):
     return s.split("-")[0]
+
+
+REPEAT_UNITS = {
+    Repeats.HOURLY: "hours",
+    Repeats.DAILY: "days",
+    Repeats.WEEKLY: "weeks",
+    Repeats.MONTHLY: "months",
+    Repeats.YEARLY: "years",
+}
+
+UNIT_SECONDS = {"hours": 3600, "days": 86400, "weeks": 7 * 86400}
+
+
+def next_occurrence(event, after: datetime.datetime) -> Optional[datetime.datetime]:
+    """Return the first start of `event` at or after `after`, or None.
+
+    Repeating events keep their wall clock time in the event timezone
+    across DST changes.
+    """
+    if event.dt >= after:
+        return event.dt
+    unit = REPEAT_UNITS.get(event.repeats)
+    if not unit:
+        return None
+    tz = pytz.timezone(event.timezone)
+    start = arrow.Arrow.fromdatetime(event.dt.astimezone(tz).replace(tzinfo=None))
+    if unit in UNIT_SECONDS:
+        n = math.ceil((after - event.dt).total_seconds() / UNIT_SECONDS[unit])
+    elif unit == "months":
+        n = (after.year - event.dt.year) * 12 + after.month - event.dt.month
+    else:
+        n = after.year - event.dt.year
+
+    def occurrence(n):
+        return tz.localize(start.shift(**{unit: n}).naive)
+
+    # the estimate can be off by one period around DST changes and month ends
+    while n > 1 and occurrence(n - 1) >= after:
+        n -= 1
+    while occurrence(n) < after:
+        n += 1
+    return occurrence(n)
+
+
+def parse_offset(s) -> int:
+    """Return minutes for an offset like "15", "15m", "2h" or "1d"."""
+    m = re.match(r"\s*(\d+)\s*([mhdw]?)\s*\Z", s, re.I)
+    if not m:
+        raise ValueError(f"Invalid offset: {s}")
+    return (
+        int(m.group(1))
+        * {"": 1, "m": 1, "h": 60, "d": 1440, "w": 10080}[m.group(2).lower()]
+    )
+
+
+def period_key(dt: datetime.datetime, monthly=False) -> str:
+    """Return the UTC year or month of a datetime, e.g. "2020" or "2020-11"."""
+    dt = dt.astimezone(datetime.timezone.utc)
+    if monthly:
+        return f"{dt.year:04d}-{dt.month:02d}"
+    return f"{dt.year:04d}"
+
+
+def period_range(key) -> Tuple[datetime.datetime, datetime.datetime]:
+    """Return the UTC start (inclusive) and end (exclusive) of a period key."""
+    utc = datetime.timezone.utc
+    if "-" in key:
+        year, month = (int(v) for v in key.split("-"))
+        start = datetime.datetime(year, month, 1, tzinfo=utc)
+        if month == 12:
+            return start, datetime.datetime(year + 1, 1, 1, tzinfo=utc)
+        return start, datetime.datetime(year, month + 1, 1, tzinfo=utc)
+    year = int(key)
+    return (
+        datetime.datetime(year, 1, 1, tzinfo=utc),
+        datetime.datetime(year + 1, 1, 1, tzinfo=utc),
+    )
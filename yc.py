@@ -1,4 +1,6 @@
 import os
+import re
+import sys
 import json
 import uuid
 
@@ -6,10 +8,11 @@ from typing import List, Optional
 import pytz
 import datetime
 import getpass
-import calendar
+import functools
 
 import click
 import dateparser
+import requests
 import arrow
 
 import utils
@@ -17,17 +20,48 @@ from utils import dt_today, dt_tomorrow
 
 from constants import CURRENT_TZ, DEFAULT_TZ_NAME
 import constants
-from models import Repeats, CalendarEntry
-from files import read_events, write_events
-from notify import notify_impending_events, notify_todays_events
+import timezones
+from models import Repeats, CalendarEntry, Reminder
+from files import read_events, write_events, supports_range_reads, file_signature
+from notify import (
+    notify_impending_events,
+    notify_todays_events,
+    notify_reminders,
+    run_reminder_daemon,
+)
 import sync
+import publish
+import feeds
+import query
+import encoding
+import batch
+import archive
+import search as search_index
+import output
+import calview
+import reminders
+import snapshot
+from index import EventIndex
 from services import google_api
 
+ISO_DATETIME_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}"
+    r"(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:\d{2})?)?\Z"
+)
+
 
 def parse_datetime(dt_str):
+    # iso strings are common in scripts and much cheaper to parse directly;
+    # anything else, including compact iso forms, goes to dateparser
+    if ISO_DATETIME_RE.match(dt_str):
+        try:
+            return datetime.datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
+        except ValueError:
+            pass
     return dateparser.parse(dt_str)
 
 
+@functools.lru_cache(maxsize=None)
 def timezone_name_from_string(tz_str) -> str:
     """Return a timezone string.
     if we get a string like "London"
@@ -94,11 +128,15 @@ def make_event(
 
 
 def upsert_event(
-    events_data_path, event: CalendarEntry, event_data: List[CalendarEntry]
+    events_data_path,
+    event: CalendarEntry,
+    event_data: List[CalendarEntry],
+    index: Optional[EventIndex] = None,
 ) -> None:
     """Update or add event.
 
     This mutates the context event list and writes the event file.
+    If an index is given, it is updated and saved as the startup snapshot.
 
     """
     # check if event exists
@@ -106,16 +144,47 @@ def upsert_event(
     if events:
         # update existing
         e = events[0]
+        changed = [e.dt, event.dt]
         e.summary = event.summary
         e.description = event.description
+        e.dt = event.dt
+        e.timezone = event.timezone
         e.updated = datetime.datetime.now(CURRENT_TZ)
         e.duration = event.duration
         e.repeats = event.repeats
+        e.reminders = event.reminders
     else:
         # insert new
+        e = event
+        changed = [event.dt]
         event_data.append(event)
 
-    write_events(events_data_path, event_data)
+    signature = file_signature(events_data_path)
+    write_events(events_data_path, event_data, changed=changed)
+    search_index.update_index(events_data_path, signature, [e])
+    reminders.update_timeline(events_data_path, signature, [e])
+    publish.update_fragments(events_data_path, signature, [e])
+    if index is not None:
+        index.add(e)
+        snapshot.write_snapshot(events_data_path, index)
+
+
+def delete_event(
+    events_data_path,
+    event: CalendarEntry,
+    event_data: List[CalendarEntry],
+    index: Optional[EventIndex] = None,
+) -> None:
+    """Remove event from the context event list and write the event file."""
+    event_data[:] = [e for e in event_data if e.uid != event.uid]
+    signature = file_signature(events_data_path)
+    write_events(events_data_path, event_data, allow_empty=True, changed=[event.dt])
+    search_index.update_index(events_data_path, signature, removed_uids=[event.uid])
+    reminders.update_timeline(events_data_path, signature, removed_uids=[event.uid])
+    publish.update_fragments(events_data_path, signature, removed_uids=[event.uid])
+    if index is not None:
+        index.remove(event.uid)
+        snapshot.write_snapshot(events_data_path, index)
 
 
 def print_events(events, human=None, numbered=None, use_local_time=True):
@@ -124,15 +193,18 @@ def print_events(events, human=None, numbered=None, use_local_time=True):
     numbered: if you want to show a menu, we number the events
     use_local_time: print the time for our current timezone
     """
-    # import pdb; pdb.set_trace()
+    events = list(events)
+    # convert all start times in one pass instead of per row
+    times = [e.dt for e in events]
+    if use_local_time:
+        times = timezones.convert_many(times, CURRENT_TZ)
     current_date = None
-    print(f"Current time: {arrow.get()}, {constants.CURRENT_TZ}")
-    for i, e in enumerate(events):
-        # tz = pytz.timezone(e.timezone)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    print(f"Current time: {now.isoformat()}, {constants.CURRENT_TZ}")
+    for i, (e, dt) in enumerate(zip(events, times)):
         if not current_date == e.dt.date():
-            day_string = arrow.get(arrow.get(e.dt).date()).format("ddd YYYY-MM-DD")
             current_date = e.dt.date()
-            click.echo(day_string.ljust(16), nl=False)
+            click.echo(current_date.strftime("%a %Y-%m-%d").ljust(16), nl=False)
         else:
             print("".ljust(16), end="")
 
@@ -142,22 +214,16 @@ def print_events(events, human=None, numbered=None, use_local_time=True):
             print(e.uid.split("-")[0].ljust(10), end="")
 
         # print time
-        dt = (
-            arrow.get(e.dt.astimezone(constants.CURRENT_TZ))
-            if use_local_time
-            else arrow.get(e.dt)
-        )
         if human:
             click.echo(
                 click.style(arrow.get(dt).humanize().ljust(16), fg="blue"), nl=False
             )
         else:
-            dtf = dt.format("HH:mm")
-            print(dtf.ljust(8), end="")
+            print(f"{dt:%H:%M}".ljust(8), end="")
 
         click.echo(click.style(e.summary[:20].ljust(22), fg="green"), nl=False)
 
-        tz_string = f"[{arrow.get(e.dt).format('HH:mm')} {e.timezone}]"
+        tz_string = f"[{e.dt:%H:%M} {e.timezone}]"
         print(tz_string.ljust(22), end="")
         print(str(e.duration).ljust(10), end="")
         if not e.repeats == Repeats.UNIQUE:
@@ -165,6 +231,52 @@ def print_events(events, human=None, numbered=None, use_local_time=True):
         print()
 
 
+def show_events(events, human=None, local=True, fmt=None, fields=None):
+    """Print events as text or stream them in a machine readable format."""
+    if not fmt or fmt == "text":
+        print_events(events, human, use_local_time=local)
+        return
+    try:
+        field_names = output.parse_fields(fields)
+    except output.UnknownField as e:
+        raise click.BadParameter(str(e), param_hint="--fields")
+    output.stream_events(events, fmt, sys.stdout, field_names)
+
+
+def with_feeds(context, events, start=None, end=None) -> List[CalendarEntry]:
+    """Return events merged with those of subscribed feeds in [start, end)."""
+    subscribed = feeds.feed_events(context, start, end)
+    if not subscribed:
+        return events
+    return sorted([*events, *subscribed], key=lambda e: e.dt)
+
+
+def load_events(context, start=None, end=None) -> List[CalendarEntry]:
+    """Return events starting in [start, end), loading them on first use.
+
+    With the record file format, a range query before anything was
+    loaded decodes only the records in range.
+    """
+    if context.get("events") is None:
+        if (start or end) and supports_range_reads(context["events_data_path"]):
+            return read_events(context["events_data_path"], start, end)
+        index = snapshot.load_index(context["events_data_path"])
+        context["events"] = list(index.events)
+        context["index"] = index
+    if start or end:
+        return context["index"].between(start, end)
+    return context["events"]
+
+
+def events_filename(events_format) -> str:
+    """Return the events file name for the EVENTS_FORMAT setting."""
+    if events_format == "records":
+        return constants.EVENTS_RECORDS_FILENAME
+    if events_format == "sharded":
+        return constants.EVENTS_SHARDS_DIRNAME
+    return constants.EVENTS_FILENAME
+
+
 @click.group()
 @click.option("--user", help="User name", default=None, required=False)
 @click.option("--debug", "-d", is_flag=True, help="Debug flag", required=False)
@@ -172,15 +284,19 @@ def print_events(events, human=None, numbered=None, use_local_time=True):
 def cli(ctx, user, debug):
     username = user or getpass.getuser()
     base_data_path = os.path.join(os.path.expanduser("~"), ".yew.d", username, "cal")
-    events_data_path = os.path.join(base_data_path, constants.EVENTS_FILENAME)
     settings_path = os.path.join(base_data_path, constants.SETTINGS_FILENAME)
     ctx.ensure_object(dict)
-    events = read_events(events_data_path)
-    ctx.obj["events"] = sorted(events, key=lambda c: c.dt)
     ctx.obj["username"] = user
     with open(settings_path) as f:
         settings = json.load(f)
     ctx.obj.update(settings)
+    events_data_path = os.path.join(
+        base_data_path, events_filename(settings.get("EVENTS_FORMAT"))
+    )
+    encoding.encoder = settings.get("EVENTS_ENCODER", "json")
+    # events are loaded on first use, see load_events()
+    ctx.obj["events"] = None
+    ctx.obj["index"] = None
     ctx.obj["events_data_path"] = events_data_path
     ctx.obj["base_data_path"] = base_data_path
     ctx.obj["debug"] = debug
@@ -191,8 +307,14 @@ def cli(ctx, user, debug):
 @click.argument("dt", required=False)
 @click.option("--timezone", "-t", required=False)
 @click.option("--interactive", "-i", required=False)
+@click.option(
+    "--remind",
+    "-r",
+    multiple=True,
+    help="Reminder before the event like 1d, 1h or 5m, optionally with channel: 5m:sms",
+)
 @click.pass_context
-def create(ctx, summary, dt, timezone, interactive):
+def create(ctx, summary, dt, timezone, interactive, remind):
     """Create a calendar event."""
     if not summary:
         summary = "my summary"
@@ -201,14 +323,24 @@ def create(ctx, summary, dt, timezone, interactive):
         dt = dt_tomorrow().isoformat()
         interactive = True
     timezone = timezone or DEFAULT_TZ_NAME
-    events = ctx.obj.get("events")
+    events = load_events(ctx.obj)
     e = make_event(summary, dt, timezone)
+    if remind:
+        e.reminders = parse_reminders(remind)
     if interactive:
         e = edit_event_interactive(e)
-    upsert_event(ctx.obj["events_data_path"], e, events)
+    upsert_event(ctx.obj["events_data_path"], e, events, ctx.obj["index"])
     e.dump()
 
 
+def parse_reminders(specs) -> List[Reminder]:
+    """Return reminders from strings like "1h" or "5m:sms"."""
+    try:
+        return [reminders.parse_reminder(spec) for spec in specs]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--remind")
+
+
 def edit_event_interactive(event: CalendarEntry) -> CalendarEntry:
     """Interactively query the user for the event data.
 
@@ -265,22 +397,84 @@ def get_event(events, name: str) -> CalendarEntry:
 def edit(ctx, name):
     """Edit a calendar event."""
 
-    events = ctx.obj.get("events")
+    events = load_events(ctx.obj)
 
     event = get_event(events, name)
-    event = edit_event_interactive(event)
+    # edit a copy so upsert_event sees what changed
+    event = edit_event_interactive(event.copy())
 
-    upsert_event(ctx.obj["events_data_path"], event, events)
+    upsert_event(ctx.obj["events_data_path"], event, events, ctx.obj["index"])
     event.dump()
 
 
+@cli.command()
+@click.argument("name", required=False)
+@click.option("--yes", "-y", is_flag=True, help="Do not ask for confirmation")
+@click.pass_context
+def delete(ctx, name, yes):
+    """Delete a calendar event."""
+
+    events = load_events(ctx.obj)
+    event = get_event(events, name)
+    event.dump()
+    if yes or click.confirm("Delete this event?"):
+        delete_event(ctx.obj["events_data_path"], event, events, ctx.obj["index"])
+
+
+@cli.command("batch")
+@click.argument("operations", type=click.File("r"), default="-")
+@click.pass_context
+def batch_cmd(ctx, operations):
+    """Apply JSON lines of create, update and delete operations.
+
+    Everything is written once at the end; one JSON result line is
+    printed per operation.
+    """
+    load_events(ctx.obj)
+    index = ctx.obj["index"]
+    results, changes = batch.apply_operations(
+        index, batch.parse_operations(operations), make_event
+    )
+    batch.commit(ctx.obj["events_data_path"], index, changes)
+    ctx.obj["events"] = list(index.events)
+    for r in results:
+        click.echo(batch.result_json(r))
+    if any(r.error for r in results):
+        ctx.exit(1)
+
+
+@cli.command()
+@click.argument("feed", required=False)
+@click.option("--remove", is_flag=True, help="Unsubscribe from the feed")
+@click.pass_context
+def subscribe(ctx, feed, remove):
+    """Subscribe to an .ics feed url or path; without one refresh all feeds.
+
+    Events of subscribed feeds are shown by today, tomorrow and future.
+    """
+    base_data_path = ctx.obj["base_data_path"]
+    if feed and remove:
+        if not feeds.unsubscribe(base_data_path, feed):
+            raise click.BadParameter(f"Not subscribed: {feed}", param_hint="FEED")
+        return
+    if feed:
+        try:
+            feeds.subscribe(base_data_path, feed)
+        except (OSError, requests.RequestException) as e:
+            raise click.ClickException(f"Could not fetch {feed}: {e}")
+    else:
+        feeds.refresh_all(base_data_path)
+    for name, state in feeds.read_registry(base_data_path).items():
+        print(f"{name}: {state.get('count', 0)} events")
+
+
 @cli.command()
 @click.argument("name", required=False)
 @click.pass_context
 def describe(ctx, name):
     """Show detail about a calendar event."""
 
-    events = ctx.obj.get("events")
+    events = load_events(ctx.obj)
     event = get_event(events, name)
     event.dump()
 
@@ -288,50 +482,159 @@ def describe(ctx, name):
 @cli.command()
 @click.option("--human", "-h", is_flag=True, required=False)
 @click.option("--local", "-l", is_flag=True, default=True, required=False)
+@click.option("--format", "-f", "fmt", type=click.Choice(("text",) + output.FORMATS))
+@click.option("--fields", required=False, help="Comma separated fields")
 @click.pass_context
-def today(ctx, human, local):
+def today(ctx, human, local, fmt, fields):
     """Show today's events."""
-    events = ctx.obj.get("events")
-    events = tuple(e for e in events if e.dt >= dt_today() and e.dt < dt_tomorrow())
-    print_events(events, human, use_local_time=local)
+    start, end = dt_today(), dt_tomorrow()
+    events = with_feeds(ctx.obj, load_events(ctx.obj, start, end), start, end)
+    show_events(events, human, local, fmt, fields)
 
 
 @cli.command()
 @click.option("--human", "-h", is_flag=True, required=False)
 @click.option("--local", "-l", is_flag=True, default=True, required=False)
+@click.option("--format", "-f", "fmt", type=click.Choice(("text",) + output.FORMATS))
+@click.option("--fields", required=False, help="Comma separated fields")
 @click.pass_context
-def tomorrow(ctx, human, local):
+def tomorrow(ctx, human, local, fmt, fields):
     """Show tomorrow's events."""
-    events = ctx.obj.get("events")
-
-    events = (
-        e
-        for e in events
-        if e.dt >= dt_tomorrow() and e.dt < arrow.get(dt_tomorrow()).shift(days=1)
-    )
-    print_events(events, human, use_local_time=local)
+    start = dt_tomorrow()
+    end = start + datetime.timedelta(days=1)
+    events = with_feeds(ctx.obj, load_events(ctx.obj, start, end), start, end)
+    show_events(events, human, local, fmt, fields)
 
 
 @cli.command()
 @click.option("--human", "-h", is_flag=True, required=False)
 @click.option("--local", "-l", is_flag=True, default=True, required=False)
+@click.option("--format", "-f", "fmt", type=click.Choice(("text",) + output.FORMATS))
+@click.option("--fields", required=False, help="Comma separated fields")
 @click.pass_context
-def future(ctx, human, local):
+def future(ctx, human, local, fmt, fields):
     """Show all future events."""
 
-    events = ctx.obj.get("events")
-    events = tuple(e for e in events if e.dt >= dt_today())
-    print_events(events, human, use_local_time=local)
+    start = dt_today()
+    events = with_feeds(ctx.obj, load_events(ctx.obj, start), start)
+    show_events(events, human, local, fmt, fields)
 
 
 @cli.command()
 @click.option("--human", "-h", is_flag=True, required=False)
 @click.option("--local", "-l", is_flag=True, default=True, required=False)
+@click.option("--format", "-f", "fmt", type=click.Choice(("text",) + output.FORMATS))
+@click.option("--fields", required=False, help="Comma separated fields")
 @click.pass_context
-def all(ctx, human, local):
-    """List all events, past and future."""
-    events = ctx.obj.get("events")
-    print_events(events, human, use_local_time=local)
+def all(ctx, human, local, fmt, fields):
+    """List all events, past and future, including archived events."""
+    events = load_events(ctx.obj)
+    archived = archive.read_archived_events(ctx.obj["base_data_path"])
+    if archived:
+        events = sorted(archived + events, key=lambda c: c.dt)
+    show_events(events, human, local, fmt, fields)
+
+
+@cli.command()
+@click.argument("terms", nargs=-1, required=True)
+@click.option("--start", "-s", required=False, help="Only events from this date")
+@click.option("--end", "-e", required=False, help="Only events before this date")
+@click.option("--limit", "-n", default=20, required=False)
+@click.option("--human", "-h", is_flag=True, required=False)
+@click.pass_context
+def search(ctx, terms, start, end, limit, human):
+    """Search summary, description and data of events."""
+    start = parse_datetime_arg(start)
+    end = parse_datetime_arg(end)
+    query = " ".join(terms)
+    events = load_events(ctx.obj)
+    index = search_index.load_index(
+        ctx.obj["base_data_path"], ctx.obj["events_data_path"], events
+    )
+    indexes = [index]
+    by_uid = {e.uid: e for e in events}
+    if start is None or not events or start < events[0].dt:
+        # the range reaches into the past, so archived events may match
+        archived = archive.read_archived_events(ctx.obj["base_data_path"], start, end)
+        if archived:
+            indexes.append(search_index.build_index(archived))
+            by_uid.update({e.uid: e for e in archived})
+    results = search_index.search_indexes(indexes, query, start, end)
+    found = [by_uid[uid] for uid, _ in results if uid in by_uid]
+    print_events(found[:limit], human)
+
+
+@cli.command("query")
+@click.argument("expression", nargs=-1, required=True)
+@click.option("--explain", is_flag=True, help="Show the query plan and timings")
+@click.option("--human", "-h", is_flag=True, required=False)
+@click.option("--format", "-f", "fmt", type=click.Choice(("text",) + output.FORMATS))
+@click.option("--fields", required=False, help="Comma separated fields")
+@click.pass_context
+def query_cmd(ctx, expression, explain, human, fmt, fields):
+    """Select events with a filter expression like: after:today summary:lunch"""
+
+    events = load_events(ctx.obj)
+    try:
+        result = query.run(
+            " ".join(expression),
+            ctx.obj["index"],
+            lambda: search_index.load_index(
+                ctx.obj["base_data_path"], ctx.obj["events_data_path"], events
+            ),
+            parse_datetime_arg,
+        )
+    except query.QueryError as e:
+        raise click.BadParameter(str(e), param_hint="EXPRESSION")
+    if explain:
+        for line in query.explain(result):
+            click.echo(line, err=True)
+    show_events(result.events, human, True, fmt, fields)
+
+
+def parse_datetime_arg(dt_str) -> Optional[datetime.datetime]:
+    """Parse an optional datetime option, assuming local time if naive."""
+    if not dt_str:
+        return None
+    dt = parse_datetime(dt_str)
+    if not dt:
+        raise DatetimeInvalid(f"Could not turn into datetime: {dt_str}")
+    if not dt.tzinfo:
+        dt = dt.replace(tzinfo=CURRENT_TZ)
+    return dt
+
+
+@cli.command("archive")
+@click.option("--before", "-b", required=True, help="Archive events before this date")
+@click.option("--monthly", "-m", is_flag=True, help="Use per-month segments")
+@click.pass_context
+def archive_cmd(ctx, before, monthly):
+    """Move past events into compressed archive segments."""
+    dt = parse_datetime_arg(before)
+    period = archive.MONTHLY if monthly else archive.YEARLY
+    events = load_events(ctx.obj)
+    signature = file_signature(ctx.obj["events_data_path"])
+    hot, count = archive.archive_events(
+        ctx.obj["events_data_path"],
+        ctx.obj["base_data_path"],
+        events,
+        dt,
+        period=period,
+    )
+    if count:
+        archived = list({e.uid for e in events} - {e.uid for e in hot})
+        search_index.update_index(
+            ctx.obj["events_data_path"], signature, removed_uids=archived
+        )
+        reminders.update_timeline(
+            ctx.obj["events_data_path"], signature, removed_uids=archived
+        )
+        publish.update_fragments(
+            ctx.obj["events_data_path"], signature, removed_uids=archived
+        )
+    # reload from the rewritten events file on next use
+    ctx.obj["events"] = None
+    print(f"Archived {count} events")
 
 
 @cli.command()
@@ -349,11 +652,14 @@ def tz(ctx, name):
 
 @cli.command()
 @click.pass_context
-@click.argument("months", required=False)
+@click.argument("months", required=False, default=1, type=int)
 def cal(ctx, months):
-    """Show calendar for months."""
-    dt = datetime.datetime.today()
-    calendar.prmonth(dt.year, dt.month)
+    """Show calendar for months with the number of events per day."""
+    today = datetime.datetime.now(CURRENT_TZ).date()
+    start, end = calview.month_span(today.year, today.month, months)
+    counts = calview.day_histogram(load_events(ctx.obj, start, end))
+    for line in calview.format_months(today.year, today.month, months, counts, today):
+        click.echo(line)
 
 
 @cli.command()
@@ -379,18 +685,59 @@ def notify_soon(ctx, minutes):
     notify_impending_events(ctx.obj, int(minutes))
 
 
+@cli.command()
+@click.option("--daemon", is_flag=True, help="Keep running and send reminders on time")
+@click.pass_context
+def remind(ctx, daemon):
+    """Send due event reminders."""
+    if daemon:
+        run_reminder_daemon(ctx.obj)
+    else:
+        count = notify_reminders(ctx.obj)
+        print(f"Sent {count} reminders")
+
+
+@cli.command()
+@click.argument("to_format", type=click.Choice(("json", "records", "sharded")))
+@click.pass_context
+def convert(ctx, to_format):
+    """Convert the events file to the json, record or sharded format."""
+    path = os.path.join(ctx.obj["base_data_path"], events_filename(to_format))
+    events = load_events(ctx.obj)
+    write_events(path, events, allow_empty=True)
+    print(f"Wrote {len(events)} events to {path}")
+    if not path == ctx.obj["events_data_path"]:
+        print(f'Set "EVENTS_FORMAT": "{to_format}" in settings.json to use it')
+
+
+@cli.command("publish")
+@click.option("--force", is_flag=True, help="Write the feeds even if unchanged")
+@click.pass_context
+def publish_cmd(ctx, force):
+    """Publish upcoming events as .ics and JSON feeds to PUBLISH_TARGET."""
+    try:
+        published = publish.publish(ctx.obj, load_events(ctx.obj), force=force)
+    except publish.PublishError as e:
+        raise click.ClickException(str(e))
+    state = "published" if published.uploaded else "unchanged, not published"
+    print(f"{published.events} events {state} ({published.hash[:12]})")
+
+
 @cli.command()
 @click.pass_context
 def push_events(ctx):
     """Push event data to remote storage."""
-    sync.push_event_data(ctx.obj)
+    try:
+        sync.push_event_data(ctx.obj)
+    except sync.SyncError as e:
+        raise click.ClickException(str(e))
     print("Events pushed")
 
 
 @cli.command()
 @click.pass_context
 def pull_events(ctx):
-    """Pull event data from remote storage. Overwrites local data."""
+    """Pull event data from remote storage and merge it into local data."""
     sync.get_event_data(ctx.obj)
     print("Event data pulled")
 
@@ -406,14 +753,6 @@ def info(ctx):
     print(f"{'DEFAULT_TZ_NAME'.ljust(25)}: {str(constants.DEFAULT_TZ_NAME)[:50]}")
 
 
-def existing_external_event(external_id, events) -> Optional[CalendarEntry]:
-    """Return existing external event or None."""
-    events = tuple(e for e in events if e.external_id == external_id)
-    if len(events):
-        return events[0]
-    return None
-
-
 @cli.command()
 @click.pass_context
 def pull_google_events(ctx):
@@ -422,7 +761,7 @@ def pull_google_events(ctx):
     """
     #  import ipdb; ipdb.set_trace()
     rejected = list()
-    events = ctx.obj.get("events")
+    events = load_events(ctx.obj)
     gevents = google_api.get_google_events(ctx.obj, 10)
     for e in gevents:
         external_id = e.get("id")
@@ -437,7 +776,7 @@ def pull_google_events(ctx):
             duration = dt_end - dt_start
         tz_str = e.get("start")["timeZone"] if "timeZone" in e.get("start") else None
         data = e.get("conferenceData")
-        existing_event = existing_external_event(e, events)
+        existing_event = ctx.obj["index"].get_external(external_id)
         if existing_event or external_id in rejected:
             print("skipping existing event: {existing_event}")
             continue
@@ -461,7 +800,9 @@ def pull_google_events(ctx):
                 source="googlecal",
                 data=data,
             )
-            upsert_event(ctx.obj["events_data_path"], new_event, events)
+            upsert_event(
+                ctx.obj["events_data_path"], new_event, events, ctx.obj["index"]
+            )
         else:
             print("SKIPPING")
 